@@ -0,0 +1,103 @@
+import com.google.zxing.BinaryBitmap;
+import com.google.zxing.DecodeHintType;
+import com.google.zxing.LuminanceSource;
+import com.google.zxing.PlanarYUVLuminanceSource;
+import com.google.zxing.ReaderException;
+import com.google.zxing.Result;
+import com.google.zxing.common.HybridBinarizer;
+import com.google.zxing.pdf417.PDF417Reader;
+
+import java.io.BufferedInputStream;
+import java.io.BufferedOutputStream;
+import java.io.DataInputStream;
+import java.io.DataOutputStream;
+import java.io.EOFException;
+import java.io.IOException;
+import java.nio.charset.StandardCharsets;
+import java.util.EnumMap;
+import java.util.Map;
+
+/**
+ * Resident ZXing PDF417 decoder for decoder_backends.ZxingBackend
+ *
+ * Reads batches of grayscale images on stdin and answers each batch on
+ * stdout, so the JVM starts once per Python process instead of per image.
+ * A whole batch is read before anything is written, so the caller can
+ * write a batch in full and then read the answers without deadlocking.
+ *
+ * Request:  int count, then per image: int width, int height, width*height luminance bytes
+ * Response: per image: int barcodes (-1 if decoding raised), then per barcode:
+ *           int length, UTF-8 text (byte compaction decodes as ISO-8859-1)
+ * Ints are big-endian.
+ *
+ * Only needs core-3.5.3.jar:
+ *     java -cp core-3.5.3.jar ZxingServer.java              (JDK 11+, compiled on start)
+ *     javac -cp core-3.5.3.jar -d zxing ZxingServer.java    (compile once, run with a JRE)
+ */
+public final class ZxingServer {
+
+    private static final int MAX_PIXELS = 64 * 1024 * 1024;
+
+    public static void main(String[] args) throws IOException {
+        DataInputStream in = new DataInputStream(new BufferedInputStream(System.in, 1 << 16));
+        DataOutputStream out = new DataOutputStream(new BufferedOutputStream(System.out, 1 << 16));
+
+        PDF417Reader reader = new PDF417Reader();
+        Map<DecodeHintType, Object> hints = new EnumMap<>(DecodeHintType.class);
+        hints.put(DecodeHintType.TRY_HARDER, Boolean.TRUE);
+
+        while (true) {
+            int count;
+            try {
+                count = in.readInt();
+            } catch (EOFException e) {
+                return;  // The Python side closed the pipe
+            }
+
+            byte[][] images = new byte[count][];
+            int[] widths = new int[count];
+            int[] heights = new int[count];
+            for (int i = 0; i < count; i++) {
+                widths[i] = in.readInt();
+                heights[i] = in.readInt();
+                if ((long) widths[i] * heights[i] > MAX_PIXELS) {
+                    throw new IOException("Image too large: " + widths[i] + "x" + heights[i]);
+                }
+                images[i] = new byte[widths[i] * heights[i]];
+                in.readFully(images[i]);
+            }
+
+            for (int i = 0; i < count; i++) {
+                writeResults(out, decode(reader, hints, images[i], widths[i], heights[i]));
+                images[i] = null;
+            }
+            out.flush();
+        }
+    }
+
+    private static Result[] decode(PDF417Reader reader, Map<DecodeHintType, Object> hints,
+                                   byte[] pixels, int width, int height) {
+        try {
+            LuminanceSource source = new PlanarYUVLuminanceSource(pixels, width, height, 0, 0, width, height, false);
+            return reader.decodeMultiple(new BinaryBitmap(new HybridBinarizer(source)), hints);
+        } catch (ReaderException e) {
+            return new Result[0];
+        } catch (RuntimeException e) {
+            System.err.println("ZxingServer: " + e);
+            return null;
+        }
+    }
+
+    private static void writeResults(DataOutputStream out, Result[] results) throws IOException {
+        if (results == null) {
+            out.writeInt(-1);
+            return;
+        }
+        out.writeInt(results.length);
+        for (Result result : results) {
+            byte[] text = result.getText().getBytes(StandardCharsets.UTF_8);
+            out.writeInt(text.length);
+            out.write(text);
+        }
+    }
+}
@@ -3,16 +3,19 @@ Flask API for PDF417 Barcode Decoding
 Uses pdf417decoder - Pure Python PDF417 decoder with excellent support
 """
 
+import os
 from flask import Flask, request, jsonify
 from flask_cors import CORS
-from pdf417decoder import PDF417Decoder
-from PIL import Image, ImageEnhance
-import io
-import base64
+from PIL import Image
+from image_input import read_image_request, InvalidRequest
+from decode_pipeline import run_cascade, DECODE_MODES
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for React app
 
+# Reject oversized uploads before they are buffered (Flask answers 413)
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MAX_UPLOAD_MB', '20')) * 1024 * 1024
+
 @app.route('/', methods=['GET'])
 def index():
     """API information endpoint"""
@@ -22,7 +25,7 @@ def index():
         'decoder': 'pdf417decoder (Pure Python)',
         'endpoints': {
             '/health': 'GET - Health check',
-            '/decode': 'POST - Decode barcode from base64 image'
+            '/decode': 'POST - Decode barcode from a raw, multipart or base64 JSON image'
         },
         'instructions': 'Open barcode-test-python-api.html in your browser to test'
     })
@@ -32,72 +35,27 @@ def health():
     """Health check endpoint"""
     return jsonify({'status': 'ok', 'decoder': 'pdf417decoder (Pure Python)'})
 
-def try_decode_with_preprocessing(original_image):
+def try_decode_with_preprocessing(original_image, mode=None, parallelism=None, localize=None,
+                                  pyramid=None):
     """
     Try decoding with different preprocessing methods
-    Returns (success, barcode_data, method_used)
+    Returns (success, barcode_data, cascade_result)
     """
-    # Define preprocessing functions
-    def preprocess_original(img):
-        return img
-
-    def preprocess_bright(img):
-        return ImageEnhance.Brightness(img).enhance(1.5)
-
-    def preprocess_high_contrast(img):
-        return ImageEnhance.Contrast(img).enhance(2.0)
-
-    def preprocess_sharp(img):
-        return ImageEnhance.Sharpness(img).enhance(2.0)
-
-    def preprocess_grayscale(img):
-        return img.convert('L').convert('RGB')
-
-    def preprocess_very_bright(img):
-        return ImageEnhance.Brightness(img).enhance(2.0)
-
-    preprocessing_methods = [
-        ("original", preprocess_original),
-        ("bright", preprocess_bright),
-        ("high_contrast", preprocess_high_contrast),
-        ("sharp", preprocess_sharp),
-        ("grayscale", preprocess_grayscale),
-        ("very_bright", preprocess_very_bright),
-    ]
-
-    for method_name, preprocess_func in preprocessing_methods:
-        try:
-            # Create a copy of the original image
-            img_copy = original_image.copy()
-
-            # Apply preprocessing
-            processed_img = preprocess_func(img_copy)
-
-            # Ensure it's a valid PIL Image
-            if not isinstance(processed_img, Image.Image):
-                continue
-
-            # Try to decode
-            decoder = PDF417Decoder(processed_img)
-            decode_count = decoder.decode()
-
-            if decode_count > 0:
-                # Success! Extract all barcodes
-                results = []
-                for i in range(decode_count):
-                    barcode_text = decoder.barcode_data_index_to_string(i)
-                    results.append({
-                        'type': 'PDF417',
-                        'data': barcode_text,
-                        'raw': barcode_text
-                    })
-                return True, results, method_name
-        except Exception as e:
-            # Try next method
-            print(f"Method {method_name} failed: {str(e)}")
-            continue
-
-    return False, [], None
+    cascade = run_cascade(original_image, mode=mode, parallelism=parallelism, localize=localize,
+                          pyramid=pyramid, accept='any')
+
+    if not cascade.barcodes:
+        return False, [], cascade
+
+    # Success! Extract all barcodes
+    results = []
+    for barcode_text, _ in cascade.barcodes:
+        results.append({
+            'type': 'PDF417',
+            'data': barcode_text,
+            'raw': barcode_text
+        })
+    return True, results, cascade
 
 
 @app.route('/decode', methods=['POST'])
@@ -105,9 +63,16 @@ def decode_barcode():
     """
     Decode barcode from image with automatic preprocessing
 
-    Request body:
+    Request body, one of:
+        raw image/jpeg or image/png body (options in the query string)
+        multipart/form-data with an "image" file field (options as form fields)
+        JSON with a base64 image:
     {
-        "image": "base64_encoded_image_data"
+        "image": "base64_encoded_image_data",
+        "mode": "race",            (optional, "sequential" or "race")
+        "race_workers": 3,         (optional, max variants in flight in race mode)
+        "localize": true,          (optional, crop to the barcode region first)
+        "pyramid": true            (optional, try downscaled copies first)
     }
 
     Response:
@@ -119,34 +84,30 @@ def decode_barcode():
                 "data": "raw barcode text"
             }
         ],
-        "preprocessing_used": "bright"
+        "preprocessing_used": "bright",
+        "resolution_used": "860x184"
     }
     """
     try:
-        data = request.get_json()
+        try:
+            image_file, data = read_image_request(request)
+        except InvalidRequest as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
 
-        if not data or 'image' not in data:
+        if image_file is None:
             return jsonify({'success': False, 'error': 'No image provided'}), 400
 
-        # Decode base64 image
-        image_data = data['image']
-
-        # Remove data URL prefix if present
-        if ',' in image_data:
-            image_data = image_data.split(',')[1]
-
-        # Decode base64 to bytes
-        image_bytes = base64.b64decode(image_data)
-
-        # Convert to PIL Image
-        image = Image.open(io.BytesIO(image_bytes))
+        # Open lazily; the pipeline decodes it once, straight to grayscale
+        image = Image.open(image_file)
 
-        # Convert to RGB if needed
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
+        mode = data.get('mode')
+        if mode is not None and mode not in DECODE_MODES:
+            return jsonify({'success': False, 'error': f'Invalid mode: {mode}'}), 400
 
         # Try decoding with different preprocessing methods
-        success, results, method_used = try_decode_with_preprocessing(image)
+        success, results, cascade = try_decode_with_preprocessing(
+            image, mode=mode, parallelism=data.get('race_workers'), localize=data.get('localize'),
+            pyramid=data.get('pyramid'))
 
         if not success:
             return jsonify({
@@ -159,7 +120,8 @@ def decode_barcode():
             'success': True,
             'barcodes': results,
             'count': len(results),
-            'preprocessing_used': method_used
+            'preprocessing_used': cascade.method_used,
+            'resolution_used': f'{cascade.resolution[0]}x{cascade.resolution[1]}'
         })
 
     except Exception as e:
@@ -3,18 +3,61 @@ Flask API for South African Document Decoding
 Decodes and decrypts SA driver's licenses and vehicle discs
 """
 
-from flask import Flask, request, jsonify
-from flask_cors import CORS
-from pdf417decoder import PDF417Decoder
-from PIL import Image, ImageEnhance
+import os
 import io
-import base64
-import sys
-from sa_license_decoder import decode_sa_license, decode_sa_vehicle_disc
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from flask import Flask, Response, request, jsonify, stream_with_context
+from flask_cors import CORS
+from PIL import Image
+from sa_license_decoder import decode_disc_record, decode_license_record, response_dict
+from image_input import read_image_request, parse_options, InvalidRequest
+from batch_decode import BATCH_ORDERS, iter_multipart, iter_ndjson, iter_zip, open_zip, stream_results
+from decode_pipeline import run_cascade, accept_predicate, ACCEPT_PREDICATES, DECODE_MODES, VARIANT_STATS
+from decoder_backends import DECODER
+from result_cache import PAYLOAD_CACHE, RESULT_CACHE, image_key
+from deadline import Deadline, DeadlineExceeded
+from decode_trace import Trace, size_of
+from jobs import JOBS_BACKEND, JobElsewhere, JobsDisabled, QueueFull, create_backend, validate_callback_url
+from variant_stats import DOCUMENT_TYPES
+from metrics import DOCUMENTS, render_metrics
+
+# DEBUG traces every variant; the default INFO logs one line per decoded document
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO').upper(),
+                    format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for React app
 
+# Reject oversized uploads before they are buffered (Flask answers 413)
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MAX_UPLOAD_MB', '20')) * 1024 * 1024
+
+# Decodes run at once per worker process; the other request threads stay free for /health
+DECODE_CONCURRENCY = int(os.environ.get('DECODE_CONCURRENCY', '1'))
+
+# Decodes that may wait for a busy slot at once; any more are answered 503 straight away,
+# so waiting decodes never hold the request threads /health and /stats need
+DECODE_QUEUE_DEPTH = int(os.environ.get('DECODE_QUEUE_DEPTH', '1'))
+
+# Seconds a decode waits for a free slot before answering 503
+DECODE_QUEUE_TIMEOUT = float(os.environ.get('DECODE_QUEUE_TIMEOUT', '30'))
+
+# Streamed /decode/batch requests at once per worker process; each holds a request thread
+# until its last result, so any more are answered 503 straight away
+BATCH_CONCURRENCY = int(os.environ.get('BATCH_CONCURRENCY', '1'))
+
+DECODE_SLOTS = threading.BoundedSemaphore(DECODE_CONCURRENCY)
+BATCH_SLOTS = threading.BoundedSemaphore(BATCH_CONCURRENCY) if BATCH_CONCURRENCY > 0 else None
+DECODE_WAITING = threading.BoundedSemaphore(DECODE_QUEUE_DEPTH) if DECODE_QUEUE_DEPTH > 0 else None
+
+
+class DecodeBusy(Exception):
+    """Every decode slot of this worker is busy and the queue is full, or stayed busy for DECODE_QUEUE_TIMEOUT"""
+
 
 @app.route('/', methods=['GET'])
 def index():
@@ -22,14 +65,19 @@ def index():
     return jsonify({
         'name': 'SA Document Decoding API',
         'version': '3.0',
-        'decoder': 'pdf417decoder + RSA decryption (SA-specific)',
+        'decoder': ' / '.join(DECODER.names) + ' + RSA decryption (SA-specific)',
         'supported_documents': [
             'SA Driver License (encrypted PDF417)',
             'SA Vehicle License Disc (text PDF417)'
         ],
         'endpoints': {
             '/health': 'GET - Health check',
-            '/decode': 'POST - Decode SA document from base64 image'
+            '/decode': 'POST - Decode SA document from a raw, multipart or base64 JSON image',
+            '/decode/batch': 'POST - Decode many images (multipart, ZIP or NDJSON), streams NDJSON results',
+            '/jobs': 'POST - Queue a decode job, returns a job id (same body as /decode)',
+            '/jobs/<id>': 'GET - Job status and result',
+            '/stats': 'GET - Preprocessing variant and cache statistics',
+            '/metrics': 'GET - Prometheus metrics for decode stages and variants'
         },
         'instructions': 'Handles RSA decryption for SA driver licenses automatically'
     })
@@ -45,96 +93,264 @@ def health():
     })
 
 
+@app.route('/stats', methods=['GET'])
+def stats():
+    """Preprocessing variant and cache statistics for this worker process"""
+    return jsonify(dict(VARIANT_STATS.snapshot(), result_cache=RESULT_CACHE.stats(),
+                        payload_cache=PAYLOAD_CACHE.stats(), jobs=JOBS.stats()))
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus metrics for this worker process, or for the whole host with METRICS_DIR"""
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+
 @app.route('/favicon.ico')
 def favicon():
     """Return empty response for favicon to prevent 404 errors"""
     return '', 204
 
 
-def try_decode_with_preprocessing(original_image):
+def try_decode_with_preprocessing(original_image, mode=None, parallelism=None, document_type=None,
+                                  localize=None, pyramid=None, deadline=None, trace=None, accept=None):
     """
     Try decoding with different preprocessing methods
-    Returns (success, barcode_data, barcode_bytes, method_used)
+    Returns (success, barcode_data, barcode_bytes, cascade_result)
+    Raises DeadlineExceeded when `deadline` passes first
+    """
+    cascade = run_cascade(original_image, mode=mode, parallelism=parallelism,
+                          document_type=document_type, localize=localize, pyramid=pyramid,
+                          deadline=deadline, trace=trace, accept=accept)
+
+    if not cascade.barcodes:
+        return False, None, None, cascade
+
+    barcode_text, barcode_bytes = cascade.barcodes[0]
+    logger.debug("barcode_text length: %d, barcode_bytes length: %d",
+                 len(barcode_text or ''), len(barcode_bytes or b''))
+
+    return True, barcode_text, barcode_bytes, cascade
+
+
+def cascade_info(cascade):
+    """Response fields describing how the barcode was found"""
+    return {
+        'preprocessing_used': cascade.method_used,
+        'resolution_used': f'{cascade.resolution[0]}x{cascade.resolution[1]}' if cascade.resolution else None,
+        'barcode_localized': cascade.localized,
+        'decoder_backend': cascade.backend
+    }
+
+
+def validate_options(data):
+    """Raise InvalidRequest for decode options with invalid values"""
+    mode = data.get('mode')
+    if mode is not None and mode not in DECODE_MODES:
+        raise InvalidRequest(f'Invalid mode: {mode}')
+
+    document_type = data.get('document_type')
+    if document_type is not None and document_type not in DOCUMENT_TYPES:
+        raise InvalidRequest(f'Invalid document_type: {document_type}')
+
+    accept = data.get('accept')
+    if accept is not None and accept not in ACCEPT_PREDICATES:
+        raise InvalidRequest(f'Invalid accept: {accept}')
+
+    deadline_ms = data.get('deadline_ms')
+    if deadline_ms is not None and (not isinstance(deadline_ms, int) or deadline_ms < 0):
+        raise InvalidRequest(f'Invalid deadline_ms: {deadline_ms}')
+
+
+def deadline_response(e):
+    """/decode response for a request whose deadline passed"""
+    return {
+        'success': False,
+        'timed_out': True,
+        'error': str(e),
+        'stage': e.stage,
+        'variants_tried': e.variants_tried,
+        'deadline_ms': e.budget_ms,
+        'elapsed_ms': e.elapsed_ms
+    }
+
+
+def decode_image(image_file, data, trace=None):
     """
-    # Define preprocessing functions
-    def preprocess_original(img):
-        return img
+    Decode one uploaded image into the /decode response dict
+
+    Results are cached by image content for RESULT_CACHE_TTL seconds, so a
+    retried upload is answered without decoding again ("cached": true).
+    When the request's deadline passes, the decode stops at the next stage
+    boundary and a "timed_out" response is returned (and not cached).
+    With the trace option the response also gets a "trace" of stage timings,
+    which is never cached.
+
+    Args:
+        image_file: File object holding the encoded image
+        data: Decode options (mode, race_workers, document_type, localize, pyramid,
+              cache, deadline_ms, trace)
+        trace: Trace already holding the request's earlier stages, else one is
+               started from the trace option
+
+    Raises:
+        InvalidRequest: when an option has an invalid value
+    """
+    validate_options(data)
+    deadline = Deadline.from_options(data)
+    trace = trace or Trace.from_options(data)
+    key = None
+
+    try:
+        if RESULT_CACHE.enabled and data.get('cache', True):
+            with trace.stage('result_cache') as span:
+                key = image_key(image_file, data)
+                cached = RESULT_CACHE.get(key)
+                if span is not None:
+                    span['hit'] = cached is not None
+            if cached is not None:
+                return with_trace(dict(cached, cached=True), trace)
 
-    def preprocess_bright(img):
-        return ImageEnhance.Brightness(img).enhance(1.5)
+        with decode_slot(deadline, trace):
+            result = decode_uncached(image_file, data, deadline, trace)
 
-    def preprocess_high_contrast(img):
-        return ImageEnhance.Contrast(img).enhance(2.0)
+    except DeadlineExceeded as e:
+        DOCUMENTS.inc(document_type=data.get('document_type') or 'unknown', outcome='timeout')
+        return with_trace(deadline_response(e), trace)
 
-    def preprocess_sharp(img):
-        return ImageEnhance.Sharpness(img).enhance(2.0)
+    if key is not None:
+        RESULT_CACHE.set(key, result)
+    return with_trace(result, trace)
 
-    def preprocess_grayscale(img):
-        return img.convert('L').convert('RGB')
 
-    def preprocess_very_bright(img):
-        return ImageEnhance.Brightness(img).enhance(2.0)
+@contextmanager
+def decode_slot(deadline, trace):
+    """
+    Hold one of this worker's DECODE_CONCURRENCY decode slots
 
-    preprocessing_methods = [
-        ("original", preprocess_original),
-        ("bright", preprocess_bright),
-        ("high_contrast", preprocess_high_contrast),
-        ("sharp", preprocess_sharp),
-        ("grayscale", preprocess_grayscale),
-        ("very_bright", preprocess_very_bright),
-    ]
+    When every slot is busy, at most DECODE_QUEUE_DEPTH decodes wait, each
+    up to DECODE_QUEUE_TIMEOUT (or what is left of the deadline); a decode
+    beyond that raises DecodeBusy at once. Raises DeadlineExceeded or
+    DecodeBusy when no slot frees up in time.
+    """
+    if not DECODE_SLOTS.acquire(blocking=False):
+        if DECODE_WAITING is None or not DECODE_WAITING.acquire(blocking=False):
+            raise DecodeBusy(f'All {DECODE_CONCURRENCY} decode slots are busy and '
+                             f'{max(0, DECODE_QUEUE_DEPTH)} decodes are already waiting')
 
-    for method_name, preprocess_func in preprocessing_methods:
         try:
-            print(f"DEBUG: Trying preprocessing method: {method_name}", file=sys.stderr, flush=True)
-            # Create a copy of the original image
-            img_copy = original_image.copy()
-
-            # Apply preprocessing
-            processed_img = preprocess_func(img_copy)
-            print(f"DEBUG: Preprocessing applied successfully", file=sys.stderr, flush=True)
-
-            # Ensure it's a valid PIL Image
-            if not isinstance(processed_img, Image.Image):
-                print(f"DEBUG: Not a valid PIL Image after preprocessing", file=sys.stderr, flush=True)
-                continue
-
-            # Try to decode
-            print(f"DEBUG: Creating PDF417Decoder...", file=sys.stderr, flush=True)
-            decoder = PDF417Decoder(processed_img)
-            print(f"DEBUG: Calling decoder.decode()...", file=sys.stderr, flush=True)
-            decode_count = decoder.decode()
-            print(f"DEBUG: decode_count = {decode_count}", file=sys.stderr, flush=True)
-
-            if decode_count > 0:
-                # Success! Get barcode data and raw bytes
-                barcode_text = decoder.barcode_data_index_to_string(0)
-
-                # Debug: Print all decoder attributes
-                print(f"DEBUG: decode_count = {decode_count}", file=sys.stderr, flush=True)
-                print(f"DEBUG: decoder attributes: {dir(decoder)}", file=sys.stderr, flush=True)
-
-                # Try to get raw bytes from barcode_binary_data attribute
-                barcode_bytes = None
-                if hasattr(decoder, 'barcode_binary_data'):
-                    print(f"DEBUG: barcode_binary_data exists: {decoder.barcode_binary_data is not None}", file=sys.stderr, flush=True)
-                    barcode_bytes = decoder.barcode_binary_data
-                if hasattr(decoder, 'barcodes_data'):
-                    print(f"DEBUG: barcodes_data exists: {decoder.barcodes_data is not None}", file=sys.stderr, flush=True)
-                    if decoder.barcodes_data and len(decoder.barcodes_data) > 0:
-                        barcode_bytes = decoder.barcodes_data[0]
-
-                print(f"DEBUG: barcode_text length: {len(barcode_text) if barcode_text else 0}", file=sys.stderr, flush=True)
-                print(f"DEBUG: barcode_bytes type: {type(barcode_bytes)}", file=sys.stderr, flush=True)
-                print(f"DEBUG: barcode_bytes length: {len(barcode_bytes) if barcode_bytes else 0}", file=sys.stderr, flush=True)
-
-                return True, barcode_text, barcode_bytes, method_name
-        except Exception as e:
-            # Try next method
-            print(f"Method {method_name} failed: {str(e)}", file=sys.stderr, flush=True)
-            continue
-
-    return False, None, None, None
+            remaining = deadline.remaining()
+            timeout = DECODE_QUEUE_TIMEOUT if remaining is None else min(DECODE_QUEUE_TIMEOUT, remaining)
+            with trace.stage('queue'):
+                acquired = DECODE_SLOTS.acquire(timeout=timeout)
+        finally:
+            DECODE_WAITING.release()
+
+        if not acquired:
+            deadline.check('queue')
+            raise DecodeBusy(f'All {DECODE_CONCURRENCY} decode slots stayed busy for {timeout:g} s')
+
+    try:
+        yield
+    finally:
+        DECODE_SLOTS.release()
+
+
+def with_trace(result, trace):
+    """The response with the trace attached, leaving a cached result untouched"""
+    if not trace.enabled:
+        return result
+    return dict(result, trace=trace.as_dict())
+
+
+def decode_payload(kind, barcode_bytes, decoder, data, trace):
+    """
+    Decrypt/parse a barcode, reusing the result for a payload seen before
+
+    The cache keeps the parsed record; the response dict is built here.
+    """
+    if not data.get('cache', True):
+        return response_dict(decoder())
+
+    decoded = []
+
+    def decode_and_note():
+        decoded.append(True)
+        return decoder()
+
+    result = PAYLOAD_CACHE.decode(kind, barcode_bytes, decode_and_note)
+    trace.note(payload_cache='miss' if decoded else 'hit')
+    return response_dict(result)
+
+
+def decode_uncached(image_file, data, deadline, trace):
+    """Run the cascade and the document decoders on one image"""
+    mode = data.get('mode')
+    document_type = data.get('document_type')
+
+    # Open lazily; the pipeline decodes it once, straight to grayscale
+    with trace.stage('image_open') as span:
+        image = Image.open(image_file)
+        if span is not None:
+            span.update(size=size_of(image), format=image.format, mode=image.mode)
+
+    # Try decoding with different preprocessing methods
+    with trace.stage('cascade'):
+        success, barcode_text, barcode_bytes, cascade = try_decode_with_preprocessing(
+            image, mode=mode, parallelism=data.get('race_workers'), document_type=document_type,
+            localize=data.get('localize'), pyramid=data.get('pyramid'), deadline=deadline,
+            trace=trace, accept=accept_predicate(data.get('accept'), cache=data.get('cache', True)))
+
+    if not success:
+        DOCUMENTS.inc(document_type=document_type or 'unknown', outcome='failure')
+        return {
+            'success': False,
+            'error': 'No PDF417 barcode found in image after trying multiple preprocessing methods',
+            'hint': 'Ensure good lighting, focus, and that the barcode is clearly visible'
+        }
+
+    # Determine document type and decode accordingly
+    result = {}
+
+    # Check if it's an encrypted SA driver license (720 bytes)
+    if barcode_bytes and len(barcode_bytes) == 720:
+        logger.info("Detected SA Driver License (720 bytes), decrypting...")
+        deadline.check('decryption')
+        detected = 'license'
+        result = decode_payload('license', barcode_bytes, lambda: decode_license_record(barcode_bytes, trace),
+                                data, trace)
+        result.update(cascade_info(cascade))
+        result['barcode_format'] = 'PDF417'
+
+    # Check if it's a vehicle disc (starts with %)
+    elif barcode_text and barcode_text.startswith('%'):
+        logger.info("Detected SA Vehicle Disc (text format)")
+        detected = 'disc'
+        result = decode_payload('disc', barcode_bytes, lambda: decode_disc(barcode_text, trace), data, trace)
+        result.update(cascade_info(cascade))
+        result['barcode_format'] = 'PDF417'
+
+    # Unknown format
+    else:
+        # Return raw data for debugging
+        detected = 'unknown'
+        result = {
+            'success': True,
+            'license_type': 'UNKNOWN',
+            'barcode_format': 'PDF417',
+            **cascade_info(cascade),
+            'raw_data': barcode_text,
+            'data_length': len(barcode_bytes) if barcode_bytes else len(barcode_text),
+            'hint': 'Barcode decoded but format not recognized as SA license or vehicle disc'
+        }
+
+    DOCUMENTS.inc(document_type=detected, outcome='success' if result.get('success') else 'failure')
+    return result
+
+
+def decode_disc(barcode_text, trace):
+    with trace.stage('disc_parse'):
+        return decode_disc_record(barcode_text)
 
 
 @app.route('/decode', methods=['POST'])
@@ -142,9 +358,21 @@ def decode_document():
     """
     Decode SA document from image with automatic decryption
 
-    Request body:
+    Request body, one of:
+        raw image/jpeg or image/png body (options in the query string)
+        multipart/form-data with an "image" file field (options as form fields)
+        JSON with a base64 image:
     {
-        "image": "base64_encoded_image_data"
+        "image": "base64_encoded_image_data",
+        "mode": "race",            (optional, "sequential", "race" or "vote")
+        "race_workers": 3,         (optional, max variants in flight in race mode)
+        "document_type": "license", (optional hint, "license" or "disc")
+        "localize": true,          (optional, crop to the barcode region first)
+        "pyramid": true,           (optional, try downscaled copies first)
+        "accept": "any",           (optional, "document" or "any": which barcode ends the cascade)
+        "cache": false,            (optional, skip the result cache for this request)
+        "deadline_ms": 5000,       (optional, time budget; also the X-Deadline-Ms header)
+        "trace": true              (optional, add a per-stage "trace" to the response)
     }
 
     Response for SA Driver License:
@@ -159,83 +387,195 @@ def decode_document():
             ...
         },
         "license_info": {...},
-        "preprocessing_used": "high_contrast"
+        "preprocessing_used": "high_contrast",
+        "resolution_used": "860x184",
+        "barcode_localized": true
+    }
+
+    Response when the deadline passes first:
+    {
+        "success": false,
+        "timed_out": true,
+        "error": "Decode deadline of 5000 ms exceeded during cascade after 4 variants",
+        "stage": "cascade",
+        "variants_tried": 4,
+        "deadline_ms": 5000,
+        "elapsed_ms": 5012
     }
     """
     try:
-        data = request.get_json()
-
-        if not data or 'image' not in data:
+        started = time.perf_counter()
+        image_file, data = read_image_request(request)
+        if image_file is None:
             return jsonify({'success': False, 'error': 'No image provided'}), 400
 
-        # Decode base64 image
-        image_data = data['image']
+        trace = Trace.from_options(data, started)
+        trace.record('payload_decode', time.perf_counter() - started, content_type=request.mimetype,
+                     bytes=request.content_length)
+        return jsonify(decode_image(image_file, data, trace))
 
-        # Remove data URL prefix if present
-        if ',' in image_data:
-            image_data = image_data.split(',')[1]
+    except InvalidRequest as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
 
-        # Decode base64 to bytes
-        image_bytes = base64.b64decode(image_data)
+    except DecodeBusy as e:
+        response = jsonify({'success': False, 'error': f'{e}, retry later'})
+        response.headers['Retry-After'] = '5'
+        return response, 503
 
-        # Convert to PIL Image
-        image = Image.open(io.BytesIO(image_bytes))
+    except Exception as e:
+        import traceback
+        error_details = traceback.format_exc()
+        logger.error(error_details)
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'details': error_details
+        }), 500
 
-        # Convert to RGB if needed
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
 
-        # Try decoding with different preprocessing methods
-        success, barcode_text, barcode_bytes, method_used = try_decode_with_preprocessing(image)
+def decode_batch_item(item_id, image_bytes, data):
+    """Decode one batch image in a batch pool process"""
+    try:
+        # The batch is already spread over the cores, so no nested race pool
+        result = decode_image(io.BytesIO(image_bytes), dict(data, mode='sequential'))
+    except Exception as e:
+        result = {'success': False, 'error': str(e)}
+
+    result['id'] = item_id
+    return result
 
-        if not success:
-            return jsonify({
-                'success': False,
-                'error': 'No PDF417 barcode found in image after trying multiple preprocessing methods',
-                'hint': 'Ensure good lighting, focus, and that the barcode is clearly visible'
-            })
 
-        # Determine document type and decode accordingly
-        result = {}
+@app.route('/decode/batch', methods=['POST'])
+def decode_batch():
+    """
+    Decode many images in one request
 
-        # Check if it's an encrypted SA driver license (720 bytes)
-        if barcode_bytes and len(barcode_bytes) == 720:
-            print(f"Detected SA Driver License (720 bytes), decrypting...")
-            result = decode_sa_license(barcode_bytes)
-            result['preprocessing_used'] = method_used
-            result['barcode_format'] = 'PDF417'
+    Request body, one of:
+        multipart/form-data: any number of image file fields
+        application/zip: an archive of images
+        application/x-ndjson: one {"id": "...", "image": "<base64>"} per line
 
-        # Check if it's a vehicle disc (starts with %)
-        elif barcode_text and barcode_text.startswith('%'):
-            print(f"Detected SA Vehicle Disc (text format)")
-            result = decode_sa_vehicle_disc(barcode_text)
-            result['preprocessing_used'] = method_used
-            result['barcode_format'] = 'PDF417'
+    Query parameters:
+        order: "input" (default) or "completion"
+        plus the /decode options (document_type, localize, pyramid)
 
-        # Unknown format
+    Response: application/x-ndjson, one line per image with the /decode
+    result plus "id" (file name, NDJSON id or line number) and "index".
+    503 with Retry-After when BATCH_CONCURRENCY batches are already streaming.
+    """
+    if BATCH_SLOTS is None or not BATCH_SLOTS.acquire(blocking=False):
+        response = jsonify({'success': False, 'error': f'{max(0, BATCH_CONCURRENCY)} batches are already '
+                                                       f'running on this worker, retry later'})
+        response.headers['Retry-After'] = '5'
+        return response, 503
+
+    try:
+        data = parse_options(request.args.to_dict())
+        order = data.pop('order', 'input')
+        if order not in BATCH_ORDERS:
+            raise InvalidRequest(f'Invalid order: {order}')
+
+        document_type = data.get('document_type')
+        if document_type is not None and document_type not in DOCUMENT_TYPES:
+            raise InvalidRequest(f'Invalid document_type: {document_type}')
+
+        mimetype = request.mimetype
+        if mimetype == 'multipart/form-data':
+            items = iter_multipart(request.files)
+        elif mimetype in ('application/zip', 'application/x-zip-compressed'):
+            items = iter_zip(open_zip(request.stream))
+        elif mimetype in ('application/x-ndjson', 'application/jsonl'):
+            items = iter_ndjson(request.stream)
         else:
-            # Return raw data for debugging
-            result = {
-                'success': True,
-                'license_type': 'UNKNOWN',
-                'barcode_format': 'PDF417',
-                'preprocessing_used': method_used,
-                'raw_data': barcode_text,
-                'data_length': len(barcode_bytes) if barcode_bytes else len(barcode_text),
-                'hint': 'Barcode decoded but format not recognized as SA license or vehicle disc'
-            }
-
-        return jsonify(result)
+            raise InvalidRequest(f'Unsupported batch content type: {mimetype}')
 
-    except Exception as e:
-        import traceback
-        error_details = traceback.format_exc()
-        print(f"ERROR: {error_details}")  # Log to console
-        return jsonify({
-            'success': False,
-            'error': str(e),
-            'details': error_details
-        }), 500
+    except InvalidRequest as e:
+        BATCH_SLOTS.release()
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except BaseException:
+        BATCH_SLOTS.release()
+        raise
+
+    def generate():
+        for result in stream_results(items, decode_batch_item, data, order):
+            yield json.dumps(result) + '\n'
+
+    response = Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    # The slot is held until the server closes the stream, whether or not the client read it all
+    response.call_on_close(BATCH_SLOTS.release)
+    return response
+
+
+def decode_job(image_bytes, data):
+    """Decode one queued job in a job worker process"""
+    # Job workers are already separate processes, so no nested race pool
+    return decode_image(io.BytesIO(image_bytes), dict(data, mode='sequential'))
+
+
+JOBS = create_backend(JOBS_BACKEND, decode_job)
+
+
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    """
+    Queue an image for decoding and return immediately
+
+    Request body: as /decode, plus an optional "callback_url" that receives
+    the finished job record as a JSON POST.
+
+    Response (202): {"success": true, "job_id": "...", "status": "queued", "status_url": "/jobs/<id>"}
+    503 with Retry-After when JOBS_MAX_PENDING jobs are already waiting,
+    503 when jobs are disabled (see gunicorn.conf.py).
+    """
+    try:
+        image_file, data = read_image_request(request)
+        if image_file is None:
+            return jsonify({'success': False, 'error': 'No image provided'}), 400
+
+        validate_options(data)
+        if data.get('callback_url'):
+            validate_callback_url(data['callback_url'])
+
+        image_bytes = image_file.getvalue() if hasattr(image_file, 'getvalue') else image_file.read()
+        job_id = JOBS.submit(image_bytes, data)
+
+    except InvalidRequest as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+    except QueueFull as e:
+        response = jsonify({'success': False, 'error': f'Job queue is full ({e}), retry later'})
+        response.headers['Retry-After'] = '5'
+        return response, 503
+
+    except JobsDisabled as e:
+        return jsonify({'success': False, 'error': str(e)}), 503
+
+    status_url = f'/jobs/{job_id}'
+    response = jsonify({'success': True, 'job_id': job_id, 'status': 'queued', 'status_url': status_url})
+    response.headers['Location'] = status_url
+    return response, 202
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """
+    Job status: "queued", "running", "done" (with "result") or "failed" (with "error")
+
+    Finished jobs are kept for JOB_RESULT_TTL seconds, then answer 404.
+    A memory backend job polled on another web worker answers 500: the
+    deployment needs one worker or the redis backend.
+    """
+    try:
+        record = JOBS.status(job_id)
+    except JobElsewhere as e:
+        logger.error("%s", e)
+        return jsonify({'success': False, 'error': str(e)}), 500
+    except JobsDisabled as e:
+        return jsonify({'success': False, 'error': str(e)}), 503
+
+    if record is None:
+        return jsonify({'success': False, 'error': 'Unknown or expired job'}), 404
+    return jsonify(record)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,162 @@
+"""
+Batch decoding support for /decode/batch
+Reads many images from multipart, ZIP or NDJSON bodies one at a time,
+decodes them across a process pool and yields results as they finish
+"""
+
+import json
+import os
+import tempfile
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable, Dict, Iterable, Iterator, Optional, Tuple
+
+from image_input import decode_base64_image, InvalidRequest
+from pools import LazyPool
+
+# Decode processes per web worker for batch requests (0 = one per core). gunicorn.conf.py
+# sets it to the worker's share of the host's CPUs, so the pools together use each core once
+BATCH_WORKERS = int(os.environ.get('BATCH_WORKERS', '0') or 0)
+
+# Images submitted but not yet streamed back, per pool process.
+# Bounds memory regardless of batch size.
+IN_FLIGHT_PER_WORKER = 2
+
+# ZIP bodies are spooled to disk past this size so they can be seeked
+ZIP_SPOOL_BYTES = 32 * 1024 * 1024
+
+# Uncompressed bytes read from a ZIP body, per member and in total. MAX_CONTENT_LENGTH only
+# bounds the compressed body, and images barely compress, so a real batch stays under it
+MAX_ZIP_BYTES = int(os.environ.get('MAX_UPLOAD_MB', '20')) * 1024 * 1024
+
+BATCH_ORDERS = ('input', 'completion')
+
+# (item id, image bytes or None, error message or None)
+BatchItem = Tuple[str, Optional[bytes], Optional[str]]
+
+_BATCH_POOL = LazyPool(ProcessPoolExecutor, BATCH_WORKERS or os.cpu_count() or 1,
+                       start_method='forkserver')
+
+
+def iter_multipart(files) -> Iterator[BatchItem]:
+    """Yield every uploaded file of a multipart request, in field order"""
+    for index, (field, upload) in enumerate(files.items(multi=True)):
+        yield upload.filename or f'{field}-{index}', upload.read(), None
+
+
+def open_zip(stream) -> zipfile.ZipFile:
+    """
+    Spool a ZIP body so it can be seeked and open it
+
+    Done before the response starts so a bad archive can still get a 400.
+    The spool file is released with the archive.
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=ZIP_SPOOL_BYTES)
+    while True:
+        chunk = stream.read(1024 * 1024)
+        if not chunk:
+            break
+        spool.write(chunk)
+    spool.seek(0)
+
+    try:
+        return zipfile.ZipFile(spool)
+    except zipfile.BadZipFile as e:
+        spool.close()
+        raise InvalidRequest(f'Invalid ZIP body: {e}')
+
+
+def iter_zip(archive: zipfile.ZipFile, max_bytes: int = MAX_ZIP_BYTES) -> Iterator[BatchItem]:
+    """
+    Yield the files of an archive; only one member is held in memory at a time
+
+    A member whose uncompressed size would take the archive past `max_bytes`
+    is not read and gets an error instead, so a zip bomb cannot exhaust
+    memory (zipfile stops reading a member at its declared size).
+    """
+    total = 0
+    with archive:
+        for info in archive.infolist():
+            if info.is_dir():
+                continue
+            if total + info.file_size > max_bytes:
+                yield info.filename, None, (f'Archive member of {info.file_size} bytes exceeds the '
+                                            f'{max_bytes} byte limit on uncompressed images')
+                continue
+            total += info.file_size
+            yield info.filename, archive.read(info), None
+
+
+def iter_ndjson(stream) -> Iterator[BatchItem]:
+    """Yield one item per line of {"id": ..., "image": "<base64>"}"""
+    for line_number, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+
+        item_id = str(line_number)
+        try:
+            record = json.loads(line)
+            item_id = str(record.get('id', item_id))
+            yield item_id, decode_base64_image(record['image']), None
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            yield item_id, None, f'Invalid NDJSON record: {e}'
+
+
+def stream_results(items: Iterable[BatchItem], worker: Callable, options: Dict,
+                   order: str = 'input') -> Iterator[Dict]:
+    """
+    Decode `items` on the batch pool and yield one result dict per item
+
+    `worker(item_id, image_bytes, options)` runs in a pool process. Results
+    carry the item's position as 'index'. With order='input' they come back
+    in upload order, with order='completion' as soon as each one finishes.
+    At most IN_FLIGHT_PER_WORKER items per process are pending at any time.
+    """
+    pool = _BATCH_POOL.get()
+    max_in_flight = pool._max_workers * IN_FLIGHT_PER_WORKER
+    pending = deque()
+
+    def result_of(index, item_id, future):
+        try:
+            result = future.result()
+        except Exception as e:
+            result = {'id': item_id, 'success': False, 'error': f'Decode failed: {e}'}
+        result['index'] = index
+        return result
+
+    def finished(index, item_id, error):
+        return {'id': item_id, 'index': index, 'success': False, 'error': error}
+
+    for index, (item_id, image_bytes, error) in enumerate(items):
+        if error is not None:
+            if order == 'completion' or not pending:
+                yield finished(index, item_id, error)
+                continue
+            # Keep input order: park the error behind the items still running
+            pending.append((index, item_id, None, error))
+        else:
+            pending.append((index, item_id, pool.submit(worker, item_id, image_bytes, options), None))
+
+        while len(pending) >= max_in_flight:
+            yield from _drain(pending, order, result_of, finished)
+
+    while pending:
+        yield from _drain(pending, order, result_of, finished)
+
+
+def _drain(pending: deque, order: str, result_of, finished) -> Iterator[Dict]:
+    """Yield the entries of `pending` that are ready, waiting for at least one"""
+    if order == 'input':
+        index, item_id, future, error = pending.popleft()
+        yield finished(index, item_id, error) if future is None else result_of(index, item_id, future)
+        # Flush whatever is already complete behind it
+        while pending and (pending[0][2] is None or pending[0][2].done()):
+            index, item_id, future, error = pending.popleft()
+            yield finished(index, item_id, error) if future is None else result_of(index, item_id, future)
+        return
+
+    done, _ = wait([entry[2] for entry in pending], return_when=FIRST_COMPLETED)
+    for entry in [entry for entry in pending if entry[2] in done]:
+        pending.remove(entry)
+        yield result_of(entry[0], entry[1], entry[2])
@@ -0,0 +1,267 @@
+"""
+Micro-benchmark for sa_license_decoder.parse_data
+Times the single-pass offset-based parser against the previous byte-at-a-time
+implementation (kept below for reference) on synthetic decrypted records,
+after checking both produce the same fields
+
+Usage: python bench_parse_data.py [records] [repeats]
+"""
+
+import random
+import sys
+import timeit
+from typing import Dict
+
+from sa_license_decoder import DECRYPTED_SIZE, detect_version, parse_data
+
+
+# --- Previous implementation -------------------------------------------------
+
+def legacy_read_string(data: bytes, index: int) -> tuple:
+    """Read a single string from data"""
+    value = ''
+    delimiter = 0xe0
+
+    while True:
+        currentByte = data[index]
+        index += 1
+
+        if currentByte == 0xe0 or currentByte == 0xe1:
+            delimiter = currentByte
+            break
+
+        value += chr(currentByte)
+
+    return value, index, delimiter
+
+
+def legacy_read_strings(data: bytes, index: int, length: int) -> tuple:
+    """Read multiple strings from data"""
+    strings = []
+
+    i = 0
+    while i < length:
+        value = ''
+        while True:
+            currentByte = data[index]
+            index += 1
+
+            if currentByte == 0xe0:
+                break
+            elif currentByte == 0xe1:
+                if value != '':
+                    i += 1
+                break
+
+            value += chr(currentByte)
+
+        i += 1
+
+        if value != '':
+            strings.append(value)
+
+    return strings, index
+
+
+def legacy_read_nibble_date_string(nibble_queue: list) -> str:
+    """Read date from nibble queue"""
+    m = nibble_queue.pop(0)
+    if m == 10:
+        return ''
+
+    c = nibble_queue.pop(0)
+    d = nibble_queue.pop(0)
+    y = nibble_queue.pop(0)
+
+    m1 = nibble_queue.pop(0)
+    m2 = nibble_queue.pop(0)
+
+    d1 = nibble_queue.pop(0)
+    d2 = nibble_queue.pop(0)
+
+    return f'{m}{c}{d}{y}-{m1}{m2}-{d1}{d2}'
+
+
+def legacy_read_nibble_date_list(nibble_queue: list, length: int) -> list:
+    """Read multiple dates from nibble queue"""
+    date_list = []
+
+    for i in range(length):
+        date_string = legacy_read_nibble_date_string(nibble_queue)
+        if date_string != '':
+            date_list.append(date_string)
+
+    return date_list
+
+
+def legacy_parse_data(data: bytes) -> Dict:
+    """sa_license_decoder.parse_data before the single-pass rewrite, """
+    # Find the start of strings section (0x82 marker)
+    index = 0
+    for i in range(len(data)):
+        if data[i] == 0x82:
+            index = i
+            break
+
+    if index == 0:
+        raise ValueError("Could not find string section marker (0x82)")
+
+    # Skip marker and next byte
+    index += 2
+
+    # Read all string fields
+    vehicle_codes, index = legacy_read_strings(data, index, 4)
+    surname, index, delimiter = legacy_read_string(data, index)
+    initials, index, delimiter = legacy_read_string(data, index)
+
+    prdp_code = ''
+    if delimiter == 0xe0:
+        prdp_code, index, delimiter = legacy_read_string(data, index)
+
+    id_country_of_issue, index, delimiter = legacy_read_string(data, index)
+    license_country_of_issue, index, delimiter = legacy_read_string(data, index)
+
+    vehicle_restrictions, index = legacy_read_strings(data, index, 4)
+    license_number, index, delimiter = legacy_read_string(data, index)
+
+    # Read ID number (13 characters)
+    id_number = ''
+    for i in range(13):
+        id_number += chr(data[index])
+        index += 1
+
+    id_number_type = f'{data[index]:02d}'
+    index += 1
+
+    # Read binary nibble data
+    nibble_queue = []
+    while True:
+        currentByte = data[index]
+        index += 1
+        if currentByte == 0x57:
+            break
+
+        nibbles = [currentByte >> 4, currentByte & 0x0f]
+        nibble_queue += nibbles
+
+    # Parse nibble data
+    license_code_issue_dates = legacy_read_nibble_date_list(nibble_queue, 4)
+    driver_restriction_codes = f'{nibble_queue.pop(0)}{nibble_queue.pop(0)}'
+    prdp_permit_expiry_date = legacy_read_nibble_date_string(nibble_queue)
+    license_issue_number = f'{nibble_queue.pop(0)}{nibble_queue.pop(0)}'
+    birthdate = legacy_read_nibble_date_string(nibble_queue)
+    license_issue_date = legacy_read_nibble_date_string(nibble_queue)
+    license_expiry_date = legacy_read_nibble_date_string(nibble_queue)
+
+    gender_code = f'{nibble_queue.pop(0)}{nibble_queue.pop(0)}'
+    gender = 'Male' if gender_code == '01' else 'Female'
+
+    # Return structured data
+    return {
+        'success': True,
+        'license_type': 'SA_DRIVER_LICENSE',
+        'version': detect_version(data),
+        'personal_info': {
+            'surname': surname,
+            'initials': initials,
+            'id_number': id_number,
+            'id_number_type': id_number_type,
+            'id_country_of_issue': id_country_of_issue,
+            'birth_date': birthdate,
+            'gender': gender
+        },
+        'license_info': {
+            'license_number': license_number,
+            'license_country_of_issue': license_country_of_issue,
+            'license_issue_number': license_issue_number,
+            'license_issue_date': license_issue_date,
+            'license_expiry_date': license_expiry_date,
+            'vehicle_codes': vehicle_codes,
+            'vehicle_restrictions': vehicle_restrictions,
+            'license_code_issue_dates': license_code_issue_dates,
+            'driver_restriction_codes': driver_restriction_codes
+        },
+        'prdp_info': {
+            'code': prdp_code,
+            'expiry_date': prdp_permit_expiry_date
+        }
+    }
+
+
+# --- Synthetic records -------------------------------------------------------
+
+def _field(rng: random.Random, length: int) -> bytes:
+    return bytes(rng.choice(b'ABCDEFGHIJKLMNOPQRSTUVWXYZ') for _ in range(length))
+
+
+def _group(rng: random.Random, values: list) -> bytes:
+    """
+    Four-slot field group: each read takes one slot, except a value closed
+    by 0xe1, which takes two. Pads with empty slots in either style.
+    """
+    if len(values) == 4 or rng.random() < 0.5:
+        return b''.join(v + b'\xe0' for v in values) + b'\xe0' * (4 - len(values))
+
+    out = b''.join(v + b'\xe0' for v in values[:-1]) + values[-1] + b'\xe1'
+    return out + b'\xe1' * (3 - len(values))
+
+
+def _date(rng: random.Random) -> bytes:
+    year = rng.randint(1950, 2030)
+    return f'{year}{rng.randint(1, 12):02d}{rng.randint(1, 28):02d}'
+
+
+def make_record(rng: random.Random) -> bytes:
+    """Build a plausible 714-byte decrypted licence payload"""
+    codes = [_field(rng, 2) for _ in range(rng.randint(1, 4))]
+    restrictions = [_field(rng, 1) for _ in range(rng.randint(1, 4))]
+    with_prdp = rng.random() < 0.3
+
+    out = bytes(rng.randint(0, 0x7f) for _ in range(10)) + b'\x82\x5a'
+    out += _group(rng, codes)
+    out += _field(rng, rng.randint(3, 12)) + b'\xe0'
+    out += _field(rng, 2) + (b'\xe0' + _field(rng, 1) + b'\xe0' if with_prdp else b'\xe1')
+    out += b'ZA\xe0ZA\xe0'
+    out += _group(rng, restrictions)
+    out += _field(rng, 12) + b'\xe0'
+    out += ''.join(str(rng.randint(0, 9)) for _ in range(13)).encode() + b'\x01'
+
+    digits = ''
+    for i in range(4):
+        digits += _date(rng) if i < len(codes) else 'a'
+    digits += '00' + (_date(rng) if with_prdp else 'a') + '01'
+    digits += _date(rng) + _date(rng) + _date(rng) + rng.choice(['01', '02'])
+    if len(digits) % 2:
+        digits += '0'
+    nibbles = bytes.fromhex(digits)
+
+    # 0x57 ends the nibble section, so it must not occur inside it
+    nibbles = nibbles.replace(b'\x57', b'\x56')
+    out += nibbles + b'\x57'
+    return out + bytes(rng.randint(0, 255) for _ in range(DECRYPTED_SIZE - len(out)))
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    rng = random.Random(0)
+    records = [make_record(rng) for _ in range(count)]
+
+    for record in records:
+        if legacy_parse_data(record) != parse_data(record):
+            raise SystemExit(f'Parsers disagree on record {record.hex()}')
+    print(f'{count} records parsed identically by both implementations')
+
+    # Alternate the two so load on the machine hits both alike
+    legacy = current = float('inf')
+    for _ in range(repeats):
+        legacy = min(legacy, timeit.timeit(lambda: [legacy_parse_data(r) for r in records], number=1))
+        current = min(current, timeit.timeit(lambda: [parse_data(r) for r in records], number=1))
+    print(f'previous: {legacy / count * 1e6:8.1f} us/record')
+    print(f'current:  {current / count * 1e6:8.1f} us/record')
+    print(f'speedup:  {legacy / current:8.2f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,506 @@
+"""
+Benchmark suite for the in-process decode pipeline and decode_sa_license
+Generates a reproducible corpus of synthetic licence and vehicle-disc
+barcodes under controlled blur, noise, rotation, glare and resolution,
+decodes it without a server and writes the results as JSON so runs can be
+compared across commits
+
+Licence barcodes are encrypted with a test RSA key derived from the seed
+and registered as an extra key version, so they decrypt like real ones.
+Needs pdf417gen to draw the barcodes (pip install pdf417gen).
+
+Usage:
+    python bench_pipeline.py [--seed 0] [--samples 2] [--records 500]
+                             [--out bench_results.json] [--compare old.json]
+                             [--save-corpus DIR] [--skip-variants] [--skip-backends]
+"""
+
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+from typing import Dict, List, Tuple
+
+# The adaptive order depends on earlier requests; keep runs comparable unless asked otherwise
+os.environ.setdefault('CASCADE_ORDERING', 'fixed')
+
+import cv2
+import numpy as np
+import rsa
+
+from bench_parse_data import make_record
+from barcode_locator import locate_barcode
+from decode_pipeline import VARIANT_STATS, decode_variant, run_cascade
+from decoder_backends import BACKENDS, BackendError
+from preprocessing import PREPROCESSING_METHODS
+from sa_license_decoder import DECRYPTED_SIZE, decode_sa_license, register_key_version
+
+try:
+    from pdf417gen import encode, render_image
+    from pdf417gen.compaction import compact_bytes
+    from pdf417gen.encoding import chunks, compute_error_correction_code_words, encode_rows, get_padding
+except ImportError:
+    sys.exit('bench_pipeline.py needs pdf417gen to draw the synthetic barcodes: pip install pdf417gen')
+
+# Key version and header the synthetic licences are encrypted for
+BENCH_KEY_VERSION = 99
+BENCH_KEY_HEADER = bytes([0x01, 0xbe, 0x0c, 0x45])
+
+# Degradations applied to the corpus: name -> parameters
+CONDITIONS = {
+    'clean': {},
+    'blur': {'blur_sigma': 1.2},
+    'noise': {'noise_sigma': 18},
+    'rotation': {'angle': 10},
+    'glare': {'glare': 150},
+    'low_res': {'module': 2},
+    'high_res': {'module': 8, 'scene': (4000, 3000)},
+}
+
+DEFAULT_MODULE = 3
+DEFAULT_SCENE = (1600, 1200)
+
+DISC_MAKES = [('VOLKSWAGEN', 'POLO'), ('TOYOTA', 'COROLLA'), ('FORD', 'RANGER'), ('NISSAN', 'NP200')]
+DISC_COLOURS = ['White', 'Silver', 'Red', 'Blue', 'Grey']
+
+
+# --- Test licence key --------------------------------------------------------
+
+def _prime(rng: random.Random, bits: int) -> int:
+    while True:
+        # Top two bits set so the modulus has the full length and a high first byte
+        candidate = rng.getrandbits(bits) | (3 << (bits - 2)) | 1
+        if rsa.prime.is_prime(candidate):
+            return candidate
+
+
+def _keypair(rng: random.Random, bits: int) -> Tuple[int, int, int]:
+    """(n, e, d) of a reproducible RSA key of `bits` bits"""
+    e = 65537
+    while True:
+        p, q = _prime(rng, bits // 2), _prime(rng, bits // 2)
+        phi = (p - 1) * (q - 1)
+        if p != q and math.gcd(e, phi) == 1:
+            return p * q, e, pow(e, -1, phi)
+
+
+class LicenceEncryptor:
+    """Encrypts 714-byte payloads into 720-byte records for the bench key version"""
+
+    def __init__(self, seed: int):
+        rng = random.Random(seed)
+        self.key128 = _keypair(rng, 1024)
+        self.key74 = _keypair(rng, 592)
+        register_key_version(BENCH_KEY_VERSION, BENCH_KEY_HEADER,
+                             rsa.PublicKey(*self.key128[:2]).save_pkcs1().decode(),
+                             rsa.PublicKey(*self.key74[:2]).save_pkcs1().decode())
+
+    def encrypt(self, payload: bytes) -> bytes:
+        """Raises ValueError when a block is not below the modulus"""
+        record = bytearray(BENCH_KEY_HEADER + b'\x00\x00')
+        blocks = [(payload[i * 128:(i + 1) * 128], self.key128) for i in range(5)]
+        blocks.append((payload[640:714], self.key74))
+
+        for block, (n, _, d) in blocks:
+            value = int.from_bytes(block, 'big')
+            if value >= n:
+                raise ValueError('Block does not fit the modulus')
+            record += pow(value, d, n).to_bytes(len(block), 'big')
+
+        return bytes(record)
+
+    def licence(self, rng: random.Random) -> bytes:
+        """A random encrypted licence record"""
+        while True:
+            try:
+                return self.encrypt(make_record(rng))
+            except ValueError:
+                continue
+
+
+def disc_text(rng: random.Random) -> str:
+    make, model = rng.choice(DISC_MAKES)
+    digits = lambda n: ''.join(rng.choice('0123456789') for _ in range(n))
+    letters = lambda n: ''.join(rng.choice('ABCDEFGHJKLMNPRSTVWXYZ') for _ in range(n))
+    return '%'.join([
+        '', 'MVL1CC' + digits(2), '0159', digits(4) + letters(4), '1', digits(8) + letters(4),
+        letters(3) + digits(3) + 'GP', letters(3) + digits(3) + letters(1), 'Hatchback', make, model,
+        rng.choice(DISC_COLOURS), letters(5) + digits(12), letters(3) + digits(6),
+        f'20{digits(2)}-{rng.randint(1, 12):02d}-28', ''
+    ])
+
+
+# --- Corpus ------------------------------------------------------------------
+
+def encode_binary(data: bytes, columns: int = 14, security_level: int = 5):
+    """PDF417 codes for binary data in byte compaction only, as on a licence"""
+    words = [924 if len(data) % 6 == 0 else 901] + list(compact_bytes(data))
+    ec_count = 2 ** (security_level + 1)
+    padding = get_padding(len(words), ec_count, columns)
+    extended = [len(words) + len(padding) + 1] + words + padding
+    codewords = extended + compute_error_correction_code_words(extended, security_level)
+    return list(encode_rows(list(chunks(codewords, columns)), columns, security_level))
+
+
+def render_sample(kind: str, payload, condition: str, rng: np.random.Generator) -> np.ndarray:
+    """Draw one barcode into a grayscale scene and apply the condition"""
+    params = CONDITIONS[condition]
+    module = params.get('module', DEFAULT_MODULE)
+    scene_w, scene_h = params.get('scene', DEFAULT_SCENE)
+
+    codes = encode_binary(payload) if kind == 'license' else encode(payload, columns=8, security_level=4)
+    barcode = np.asarray(render_image(codes, scale=module, ratio=3, padding=2 * module).convert('L'))
+
+    if params.get('angle'):
+        h, w = barcode.shape
+        matrix = cv2.getRotationMatrix2D((w / 2, h / 2), params['angle'], 1.0)
+        cos, sin = abs(matrix[0, 0]), abs(matrix[0, 1])
+        size = (int(h * sin + w * cos), int(h * cos + w * sin))
+        matrix[0, 2] += size[0] / 2 - w / 2
+        matrix[1, 2] += size[1] / 2 - h / 2
+        barcode = cv2.warpAffine(barcode, matrix, size, borderValue=255)
+
+    # Uneven card-like background
+    low = rng.normal(190, 20, (12, 16)).astype(np.float32)
+    scene = cv2.resize(low, (scene_w, scene_h), interpolation=cv2.INTER_CUBIC)
+    h, w = barcode.shape
+    if w > scene_w or h > scene_h:
+        raise ValueError(f'Barcode {w}x{h} does not fit the {condition} scene')
+    y = int(rng.integers(0, scene_h - h + 1))
+    x = int(rng.integers(0, scene_w - w + 1))
+    scene[y:y + h, x:x + w] = np.minimum(scene[y:y + h, x:x + w], barcode)
+
+    if params.get('glare'):
+        yy, xx = np.mgrid[0:scene_h, 0:scene_w]
+        cx, cy = x + w * rng.uniform(0.3, 0.7), y + h * rng.uniform(0.3, 0.7)
+        radius = max(w, h) * 0.35
+        scene += params['glare'] * np.exp(-((xx - cx) ** 2 + (yy - cy) ** 2) / (2 * radius ** 2))
+    if params.get('blur_sigma'):
+        scene = cv2.GaussianBlur(scene, (0, 0), params['blur_sigma'])
+    if params.get('noise_sigma'):
+        scene += rng.normal(0, params['noise_sigma'], scene.shape)
+
+    return np.clip(scene, 0, 255).astype(np.uint8)
+
+
+def build_corpus(seed: int, samples: int, encryptor: LicenceEncryptor) -> List[Dict]:
+    """Every (kind, condition) pair `samples` times; identical for the same seed"""
+    corpus = []
+    payload_rng = random.Random(seed)
+    for kind in ('license', 'disc'):
+        for condition in CONDITIONS:
+            for index in range(samples):
+                image_rng = np.random.default_rng([seed, len(corpus)])
+                if kind == 'license':
+                    payload = encryptor.licence(payload_rng)
+                    expected = payload
+                else:
+                    payload = disc_text(payload_rng)
+                    expected = payload.encode()
+                corpus.append({
+                    'id': f'{kind}-{condition}-{index}',
+                    'kind': kind,
+                    'condition': condition,
+                    'image': render_sample(kind, payload, condition, image_rng),
+                    'expected': expected,
+                })
+    return corpus
+
+
+# --- Measurements ------------------------------------------------------------
+
+def latency_summary(times: List[float]) -> Dict:
+    ms = np.array(times) * 1000
+    if not len(ms):
+        return {}
+    return {
+        'mean': round(float(ms.mean()), 2),
+        'p50': round(float(np.percentile(ms, 50)), 2),
+        'p90': round(float(np.percentile(ms, 90)), 2),
+        'p99': round(float(np.percentile(ms, 99)), 2),
+        'max': round(float(ms.max()), 2),
+    }
+
+
+def summarize(rows: List[Dict]) -> Dict:
+    decoded = sum(row['correct'] for row in rows)
+    wall = sum(row['seconds'] for row in rows)
+    return {
+        'samples': len(rows),
+        'decoded': decoded,
+        'success_rate': round(decoded / len(rows), 4) if rows else None,
+        'throughput_per_s': round(len(rows) / wall, 3) if wall else None,
+        'latency_ms': latency_summary([row['seconds'] for row in rows]),
+    }
+
+
+def max_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale, 1)
+
+
+def bench_pipeline(corpus: List[Dict], run_variants: bool) -> Dict:
+    rows = []
+    for sample in corpus:
+        started = time.perf_counter()
+        result = run_cascade(sample['image'], mode='sequential')
+        seconds = time.perf_counter() - started
+        correct = bool(result.barcodes) and result.barcodes[0][1] == sample['expected']
+        rows.append({'id': sample['id'], 'kind': sample['kind'], 'condition': sample['condition'],
+                     'seconds': seconds, 'correct': correct, 'method': result.method_used,
+                     'localized': result.localized})
+
+    report = {
+        'overall': summarize(rows),
+        'by_kind': {kind: summarize([r for r in rows if r['kind'] == kind]) for kind in ('license', 'disc')},
+        'by_condition': {c: summarize([r for r in rows if r['condition'] == c]) for c in CONDITIONS},
+        'cascade': VARIANT_STATS.snapshot()['totals'],
+        'samples': [dict(row, seconds=round(row['seconds'] * 1000, 2)) for row in rows],
+    }
+
+    # Peak traced allocations of one decode per condition (tracing slows it, so timed separately)
+    memory = {}
+    for condition in CONDITIONS:
+        sample = next(s for s in corpus if s['condition'] == condition)
+        tracemalloc.start()
+        run_cascade(sample['image'], mode='sequential')
+        memory[condition] = round(tracemalloc.get_traced_memory()[1] / 1024 / 1024, 1)
+        tracemalloc.stop()
+    report['memory'] = {'traced_peak_mb': memory, 'max_rss_mb': max_rss_mb()}
+
+    if run_variants:
+        report['variants'] = bench_variants(corpus)
+
+    return report
+
+
+def bench_variants(corpus: List[Dict]) -> Dict:
+    """Success rate and latency of every variant on every sample's located region"""
+    stats = {name: {'attempts': 0, 'decoded': 0, 'times': []} for name, _ in PREPROCESSING_METHODS}
+    for sample in corpus:
+        region = locate_barcode(sample['image'])
+        gray = region if region is not None else sample['image']
+        for name, _ in PREPROCESSING_METHODS:
+            started = time.perf_counter()
+            barcodes = decode_variant(gray, name)
+            stats[name]['times'].append(time.perf_counter() - started)
+            stats[name]['attempts'] += 1
+            stats[name]['decoded'] += bool(barcodes) and barcodes[0][1] == sample['expected']
+
+    return {
+        name: {
+            'attempts': s['attempts'],
+            'decoded': s['decoded'],
+            'success_rate': round(s['decoded'] / s['attempts'], 4) if s['attempts'] else None,
+            'latency_ms': latency_summary(s['times']),
+        }
+        for name, s in stats.items()
+    }
+
+
+def bench_backends(corpus: List[Dict]) -> Dict:
+    """
+    Every decoder backend on its own, on each sample's located region
+
+    Reports success and latency per condition and which backend wins it
+    (most decoded, then lowest p50), the cost of the first call (JVM start
+    for zxing) and the throughput of one batched call over the corpus.
+    """
+    regions = []
+    for sample in corpus:
+        region = locate_barcode(sample['image'])
+        regions.append(region if region is not None else sample['image'])
+
+    report = {}
+    for name, backend_class in BACKENDS.items():
+        backend = backend_class()
+        if not backend.available():
+            report[name] = {'available': False}
+            continue
+
+        try:
+            started = time.perf_counter()
+            backend.decode(regions[0])
+            first_call = time.perf_counter() - started
+
+            rows = []
+            for sample, gray in zip(corpus, regions):
+                started = time.perf_counter()
+                barcodes = backend.decode(gray)
+                rows.append({'condition': sample['condition'], 'seconds': time.perf_counter() - started,
+                             'correct': bool(barcodes) and barcodes[0][1] == sample['expected']})
+
+            started = time.perf_counter()
+            backend.decode_many(regions)
+            batch_seconds = time.perf_counter() - started
+        except BackendError as e:
+            report[name] = {'available': False, 'error': str(e)}
+            continue
+
+        report[name] = {
+            'available': True,
+            'first_call_ms': round(first_call * 1000, 2),
+            'overall': summarize(rows),
+            'by_condition': {c: summarize([r for r in rows if r['condition'] == c]) for c in CONDITIONS},
+            'batch_throughput_per_s': round(len(regions) / batch_seconds, 3) if batch_seconds else None,
+        }
+
+    measured = {name: r for name, r in report.items() if r.get('available')}
+    report['winners'] = {
+        condition: min(measured, key=lambda name: (-measured[name]['by_condition'][condition]['decoded'],
+                                                   measured[name]['by_condition'][condition]['latency_ms']['p50']))
+        for condition in CONDITIONS
+    } if measured else {}
+
+    return report
+
+
+def bench_licence_decoder(encryptor: LicenceEncryptor, seed: int, count: int) -> Dict:
+    rng = random.Random(seed + 1)
+    records = [encryptor.licence(rng) for _ in range(count)]
+
+    times = []
+    failures = 0
+    started = time.perf_counter()
+    for record in records:
+        t = time.perf_counter()
+        result = decode_sa_license(record)
+        times.append(time.perf_counter() - t)
+        failures += not result['success']
+    wall = time.perf_counter() - started
+
+    tracemalloc.start()
+    for record in records[:100]:
+        decode_sa_license(record)
+    traced_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        'records': count,
+        'failures': failures,
+        'throughput_per_s': round(count / wall, 1),
+        'latency_ms': latency_summary(times),
+        'memory': {'traced_peak_kb_100_records': round(traced_peak / 1024, 1)},
+        'payload_bytes': DECRYPTED_SIZE,
+    }
+
+
+# --- Reporting ---------------------------------------------------------------
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ''
+
+
+def compare(current: Dict, previous: Dict):
+    """Print the headline metrics next to an earlier results file"""
+    def metrics(results):
+        pipeline, licence = results.get('pipeline', {}), results.get('license_decoder', {})
+        rows = {
+            'pipeline success_rate': pipeline.get('overall', {}).get('success_rate'),
+            'pipeline throughput/s': pipeline.get('overall', {}).get('throughput_per_s'),
+            'pipeline p50 ms': pipeline.get('overall', {}).get('latency_ms', {}).get('p50'),
+            'pipeline p90 ms': pipeline.get('overall', {}).get('latency_ms', {}).get('p90'),
+            'licence throughput/s': licence.get('throughput_per_s'),
+            'licence p50 ms': licence.get('latency_ms', {}).get('p50'),
+        }
+        for name, backend in results.get('backends', {}).items():
+            if isinstance(backend, dict) and backend.get('available'):
+                rows[f'{name} success_rate'] = backend['overall'].get('success_rate')
+                rows[f'{name} p50 ms'] = backend['overall'].get('latency_ms', {}).get('p50')
+        for condition, summary in pipeline.get('by_condition', {}).items():
+            rows[f'{condition} success_rate'] = summary.get('success_rate')
+        return rows
+
+    before, after = metrics(previous), metrics(current)
+    print(f"\n{'metric':28} {previous['meta'].get('revision') or 'before':>12} "
+          f"{current['meta'].get('revision') or 'after':>12}")
+    for name, value in after.items():
+        old = before.get(name)
+        change = f'{(value - old) / old * 100:+.1f}%' if old and value is not None else ''
+        print(f'{name:28} {old if old is not None else "-":>12} {value if value is not None else "-":>12} {change}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--samples', type=int, default=2, help='images per document type and condition')
+    parser.add_argument('--records', type=int, default=500, help='licence records for decode_sa_license')
+    parser.add_argument('--out', default='bench_results.json')
+    parser.add_argument('--compare', help='earlier results file to compare against')
+    parser.add_argument('--save-corpus', help='also write the corpus images as PNG to this directory')
+    parser.add_argument('--skip-variants', action='store_true', help='skip the per-variant matrix')
+    parser.add_argument('--skip-backends', action='store_true', help='skip the per-backend comparison')
+    args = parser.parse_args()
+
+    encryptor = LicenceEncryptor(args.seed)
+    corpus = build_corpus(args.seed, args.samples, encryptor)
+    print(f'Corpus: {len(corpus)} images, seed {args.seed}')
+
+    if args.save_corpus:
+        os.makedirs(args.save_corpus, exist_ok=True)
+        for sample in corpus:
+            cv2.imwrite(os.path.join(args.save_corpus, sample['id'] + '.png'), sample['image'])
+
+    results = {
+        'meta': {
+            'revision': git_revision(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'seed': args.seed,
+            'samples_per_condition': args.samples,
+            'conditions': CONDITIONS,
+            'config': {key: os.environ[key] for key in sorted(os.environ)
+                       if key.startswith(('DECODE_', 'DECODER_', 'BARCODE_', 'PYRAMID_', 'CASCADE_', 'ZXING_'))},
+        },
+        'pipeline': bench_pipeline(corpus, not args.skip_variants),
+        'license_decoder': bench_licence_decoder(encryptor, args.seed, args.records),
+    }
+    if not args.skip_backends:
+        results['backends'] = bench_backends(corpus)
+
+    with open(args.out, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    overall = results['pipeline']['overall']
+    print(f"Pipeline: {overall['decoded']}/{overall['samples']} decoded, "
+          f"{overall['throughput_per_s']} images/s, p50 {overall['latency_ms']['p50']} ms, "
+          f"p90 {overall['latency_ms']['p90']} ms")
+    for condition, summary in results['pipeline']['by_condition'].items():
+        print(f"  {condition:10} {summary['decoded']}/{summary['samples']}  p50 {summary['latency_ms']['p50']} ms")
+    licence = results['license_decoder']
+    print(f"decode_sa_license: {licence['throughput_per_s']} records/s, p50 {licence['latency_ms']['p50']} ms, "
+          f"{licence['failures']} failures")
+    for name, backend in results.get('backends', {}).items():
+        if name == 'winners':
+            continue
+        if not backend.get('available'):
+            print(f"Backend {name}: not available {backend.get('error', '')}")
+            continue
+        print(f"Backend {name}: {backend['overall']['decoded']}/{backend['overall']['samples']} decoded, "
+              f"p50 {backend['overall']['latency_ms']['p50']} ms, first call {backend['first_call_ms']} ms, "
+              f"batched {backend['batch_throughput_per_s']} images/s")
+    if results.get('backends', {}).get('winners'):
+        print('  winners: ' + ', '.join(f'{c} {b}' for c, b in results['backends']['winners'].items()))
+    print(f'Results written to {args.out}')
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
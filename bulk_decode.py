@@ -0,0 +1,252 @@
+"""
+Streaming bulk decoder for stored barcode payloads
+Reads raw licence records and vehicle disc strings that were already
+extracted from barcodes, decodes them with decode_license_record and
+decode_disc_record across a process pool and writes one NDJSON result
+per record, in input order. Only a few chunks are in flight at once, so
+memory stays flat whatever the input size.
+
+Input formats (--format):
+    raw: back-to-back 720-byte licence records
+    hex, base64: one payload per line; 720-byte payloads are decoded as
+        licences, payloads starting with "%" as vehicle discs
+    text: one vehicle disc string per line
+
+With --columnar PATH the results are written as columns instead (one per
+field, see columnar_export): Parquet or Arrow when pyarrow is installed,
+CSV otherwise.
+
+Usage:
+    python bulk_decode.py [--format raw|hex|base64|text] [--workers N]
+                          [--chunk N] [--output results.ndjson | --columnar results.parquet]
+                          [FILE ...]
+    FILE defaults to stdin ("-").
+"""
+
+import argparse
+import base64
+import binascii
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import BinaryIO, Iterable, Iterator, List, Optional, Tuple
+
+import columnar_export
+from bulk_decrypt import map_bounded
+from sa_license_decoder import (RECORD_SIZE, DecodeResult, decode_disc_record, decode_license_record,
+                                response_json)
+
+FORMATS = ('raw', 'hex', 'base64', 'text')
+
+# Records handed to a worker process per task
+CHUNK_RECORDS = 512
+
+# Lines longer than this are not payloads (a base64 licence is 960 characters)
+MAX_LINE = 64 * 1024
+
+# One task: (format, index of its first record, raw block or lines)
+Chunk = Tuple[str, int, object]
+
+
+def decode_payload(payload: bytes) -> DecodeResult:
+    """Decode one payload as a licence record or a vehicle disc string"""
+    if len(payload) == RECORD_SIZE:
+        return decode_license_record(payload)
+    if payload.startswith(b'%'):
+        return decode_disc_record(payload.decode('latin-1'))
+    return {'success': False, 'error': f'Unrecognised payload of {len(payload)} bytes'}
+
+
+def _ndjson_line(index: int, result: DecodeResult) -> str:
+    """json.dumps({'index': index, **result}) straight from the record"""
+    return f'{{"index": {index:d}, {response_json(result)[1:]}'
+
+
+def _line_payload(fmt: str, line: bytes) -> bytes:
+    line = line.strip()
+    if fmt == 'hex':
+        return bytes.fromhex(line.decode('ascii'))
+    if fmt == 'base64':
+        return base64.b64decode(line, validate=True)
+    return line
+
+
+def decode_chunk(fmt: str, first: int, data) -> bytes:
+    """Decode one chunk in a worker process; returns its NDJSON lines"""
+    lines = []
+
+    if fmt == 'raw':
+        view = memoryview(data)
+        for offset in range(0, len(view), RECORD_SIZE):
+            record = bytes(view[offset: offset + RECORD_SIZE])
+            if len(record) == RECORD_SIZE:
+                result = decode_license_record(record)
+            else:
+                result = {'success': False, 'error': f'Truncated record: {len(record)} bytes'}
+            lines.append(_ndjson_line(first + offset // RECORD_SIZE, result))
+    else:
+        for i, line in enumerate(data):
+            try:
+                result = decode_payload(_line_payload(fmt, line))
+            except (ValueError, binascii.Error, UnicodeDecodeError) as e:
+                result = {'success': False, 'error': f'Invalid {fmt} line: {e}'}
+            lines.append(_ndjson_line(first + i, result))
+
+    return ('\n'.join(lines) + '\n').encode() if lines else b''
+
+
+def decode_chunk_columns(fmt: str, first: int, data) -> columnar_export.Columns:
+    """Decode one chunk in a worker process into licence and disc columns"""
+    columns = columnar_export.new_columns()
+
+    if fmt == 'raw':
+        view = memoryview(data)
+        for offset in range(0, len(view), RECORD_SIZE):
+            index = first + offset // RECORD_SIZE
+            record = bytes(view[offset: offset + RECORD_SIZE])
+            if len(record) == RECORD_SIZE:
+                columnar_export.add_licence(columns, index, record)
+            else:
+                columnar_export.add_error(columns, index, f'Truncated record: {len(record)} bytes')
+        return columns
+
+    for i, line in enumerate(data):
+        try:
+            payload = _line_payload(fmt, line)
+        except (ValueError, binascii.Error) as e:
+            columnar_export.add_error(columns, first + i, f'Invalid {fmt} line: {e}')
+            continue
+
+        if len(payload) == RECORD_SIZE:
+            columnar_export.add_licence(columns, first + i, payload)
+        elif payload.startswith(b'%'):
+            columnar_export.add_disc(columns, first + i, payload.decode('latin-1'))
+        else:
+            columnar_export.add_error(columns, first + i, f'Unrecognised payload of {len(payload)} bytes')
+
+    return columns
+
+
+def iter_chunks(streams: Iterable[BinaryIO], fmt: str, chunk_records: int) -> Iterator[Chunk]:
+    """Cut the input into chunks of `chunk_records` records without reading ahead"""
+    index = 0
+
+    if fmt == 'raw':
+        for stream in streams:
+            while True:
+                block = stream.read(chunk_records * RECORD_SIZE)
+                if not block:
+                    break
+                yield fmt, index, block
+                index += -(-len(block) // RECORD_SIZE)
+        return
+
+    lines = []
+    for stream in streams:
+        for line in stream:
+            if not line.strip():
+                continue
+            lines.append(line[:MAX_LINE])
+            if len(lines) == chunk_records:
+                yield fmt, index, lines
+                index += len(lines)
+                lines = []
+    if lines:
+        yield fmt, index, lines
+
+
+def _open_inputs(paths: List[str]) -> Iterator[BinaryIO]:
+    for path in paths:
+        if path == '-':
+            yield sys.stdin.buffer
+        else:
+            with open(path, 'rb') as f:
+                yield f
+
+
+def decode_stream(chunks: Iterable[Chunk], out: BinaryIO, workers: Optional[int] = None) -> int:
+    """
+    Decode every chunk and write the NDJSON lines to `out` in input order
+
+    workers: process count; 0 or 1 decodes in the calling process, None uses every core.
+    Returns the number of records written.
+    """
+    workers = os.cpu_count() if workers is None else workers
+    written = 0
+
+    def write(lines: bytes):
+        nonlocal written
+        out.write(lines)
+        written += lines.count(b'\n')
+
+    if workers <= 1:
+        for chunk in chunks:
+            write(decode_chunk(*chunk))
+        return written
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for lines in map_bounded(pool, workers, decode_chunk, chunks):
+            write(lines)
+    return written
+
+
+def decode_columnar(chunks: Iterable[Chunk], writer: columnar_export.ColumnarWriter,
+                    workers: Optional[int] = None) -> int:
+    """
+    Decode every chunk into columns and hand them to `writer` in input order
+
+    Returns the number of records written.
+    """
+    workers = os.cpu_count() if workers is None else workers
+
+    if workers <= 1:
+        for chunk in chunks:
+            writer.write(decode_chunk_columns(*chunk))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for columns in map_bounded(pool, workers, decode_chunk_columns, chunks):
+                writer.write(columns)
+
+    return sum(writer.rows.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('files', nargs='*', default=['-'], help='input files, "-" for stdin')
+    parser.add_argument('--format', choices=FORMATS, default='raw')
+    parser.add_argument('--workers', type=int, default=None, help='decode processes (default: one per core)')
+    parser.add_argument('--chunk', type=int, default=CHUNK_RECORDS, help='records per worker task')
+    parser.add_argument('--output', '-o', default='-', help='NDJSON output file, "-" for stdout')
+    parser.add_argument('--columnar', metavar='PATH',
+                        help='write licence and disc columns to PATH (.parquet, .arrow or .csv) instead of NDJSON')
+    args = parser.parse_args()
+
+    if args.chunk < 1:
+        parser.error('--chunk must be at least 1')
+
+    started = time.perf_counter()
+    chunks = iter_chunks(_open_inputs(args.files), args.format, args.chunk)
+
+    if args.columnar:
+        writer = columnar_export.ColumnarWriter(args.columnar)
+        try:
+            count = decode_columnar(chunks, writer, args.workers)
+        finally:
+            for path in writer.close().values():
+                print(f'Wrote {path}', file=sys.stderr)
+    else:
+        out = sys.stdout.buffer if args.output == '-' else open(args.output, 'wb')
+        try:
+            count = decode_stream(chunks, out, args.workers)
+        finally:
+            if out is not sys.stdout.buffer:
+                out.close()
+            else:
+                out.flush()
+
+    seconds = time.perf_counter() - started
+    print(f'{count} records in {seconds:.1f} s ({count / seconds if seconds else 0:.0f}/s)', file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
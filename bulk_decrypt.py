@@ -0,0 +1,146 @@
+"""
+Bulk RSA decryption of stored SA driver's license barcodes
+Decrypts contiguous runs of 720-byte records (in memory or memory-mapped
+from disk) across a process pool into one preallocated output buffer
+
+The RSA step is a raw public-key operation (no padding). `cryptography`
+does not expose unpadded RSA, so the work is spread over processes and
+each one uses CPython's pow().
+"""
+
+import mmap
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterable, Iterator, Optional, Tuple
+
+from sa_license_decoder import DECRYPTED_SIZE, RECORD_SIZE, decrypt_into
+
+# Records handed to a worker process per task
+CHUNK_RECORDS = 2048
+
+# Tasks queued per worker process; bounds the input copies held for pickling
+IN_FLIGHT_PER_WORKER = 2
+
+
+def _decrypt_chunk(records: bytes) -> Tuple[bytes, bytes]:
+    """Decrypt a run of records; returns (decrypted bytes, per-record version or 0)"""
+    count = len(records) // RECORD_SIZE
+    out = bytearray(count * DECRYPTED_SIZE)
+    status = bytearray(count)
+    view = memoryview(records)
+
+    for i in range(count):
+        try:
+            status[i] = decrypt_into(view[i * RECORD_SIZE: (i + 1) * RECORD_SIZE], out, i * DECRYPTED_SIZE)
+        except ValueError:
+            status[i] = 0
+
+    return bytes(out), bytes(status)
+
+
+def _decrypt_file_chunk(path: str, first: int, count: int) -> Tuple[bytes, bytes]:
+    """Worker side of decrypt_file: map the file itself instead of receiving the bytes"""
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        return _decrypt_chunk(mapped[first * RECORD_SIZE: (first + count) * RECORD_SIZE])
+
+
+def map_bounded(pool: ProcessPoolExecutor, workers: int, fn: Callable,
+                 tasks: Iterable[tuple]) -> Iterator:
+    """Like pool.map, but only pulls tasks from `tasks` as results are consumed"""
+    pending = deque()
+    for args in tasks:
+        pending.append(pool.submit(fn, *args))
+        if len(pending) >= workers * IN_FLIGHT_PER_WORKER:
+            yield pending.popleft().result()
+
+    while pending:
+        yield pending.popleft().result()
+
+
+def _store(target: memoryview, status: bytearray, first: int, chunk: Tuple[bytes, bytes]):
+    decrypted, versions = chunk
+    target[first * DECRYPTED_SIZE: first * DECRYPTED_SIZE + len(decrypted)] = decrypted
+    status[first: first + len(versions)] = versions
+
+
+def _allocate_out(count: int, out):
+    if out is None:
+        return bytearray(count * DECRYPTED_SIZE)
+    if len(out) < count * DECRYPTED_SIZE:
+        raise ValueError(f"Output buffer too small: {len(out)} bytes, need {count * DECRYPTED_SIZE}")
+    return out
+
+
+def _record_count(size: int) -> int:
+    if size % RECORD_SIZE:
+        raise ValueError(f"Buffer length {size} is not a multiple of {RECORD_SIZE}")
+    return size // RECORD_SIZE
+
+
+def decrypt_many(records, out=None, workers: Optional[int] = None,
+                 chunk_records: int = CHUNK_RECORDS) -> Tuple[object, bytearray]:
+    """
+    Decrypt a contiguous buffer of 720-byte records
+
+    Args:
+        records: bytes-like object (bytes, bytearray, memoryview, mmap)
+        out: Writable buffer of at least len(records) / 720 * 714 bytes,
+             allocated when omitted. Record i lands at out[i * 714:(i + 1) * 714].
+        workers: Process count; 0 or 1 decrypts in the calling process,
+                 None uses every core
+        chunk_records: Records per worker task
+
+    Returns:
+        (out, status) where status[i] is the license version of record i,
+        or 0 if it could not be decrypted (its output bytes are left as is)
+    """
+    count = _record_count(len(records))
+    out = _allocate_out(count, out)
+    status = bytearray(count)
+    view = memoryview(records)
+    target = memoryview(out)
+
+    workers = os.cpu_count() if workers is None else workers
+    if workers <= 1 or count <= chunk_records:
+        _store(target, status, 0, _decrypt_chunk(view))
+        return out, status
+
+    starts = range(0, count, chunk_records)
+    tasks = ((bytes(view[first * RECORD_SIZE: (first + chunk_records) * RECORD_SIZE]),) for first in starts)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for first, chunk in zip(starts, map_bounded(pool, workers, _decrypt_chunk, tasks)):
+            _store(target, status, first, chunk)
+
+    return out, status
+
+
+def decrypt_file(path: str, out=None, workers: Optional[int] = None,
+                 chunk_records: int = CHUNK_RECORDS) -> Tuple[object, bytearray]:
+    """
+    Decrypt a file of back-to-back 720-byte records
+
+    The file is memory-mapped rather than read. With a process pool, each
+    worker maps the file itself and only receives (path, first, count), so
+    the input is never pickled. Arguments and return value as decrypt_many.
+    """
+    count = _record_count(os.path.getsize(path))
+    out = _allocate_out(count, out)
+    workers = os.cpu_count() if workers is None else workers
+
+    if count == 0:
+        return out, bytearray()
+
+    if workers <= 1 or count <= chunk_records:
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return decrypt_many(mapped, out, workers=0)
+
+    status = bytearray(count)
+    target = memoryview(out)
+    starts = range(0, count, chunk_records)
+    tasks = ((path, first, min(chunk_records, count - first)) for first in starts)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for first, chunk in zip(starts, map_bounded(pool, workers, _decrypt_file_chunk, tasks)):
+            _store(target, status, first, chunk)
+
+    return out, status
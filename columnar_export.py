@@ -0,0 +1,170 @@
+"""
+Columnar export of bulk-decoded licences and discs
+Decoded fields go straight from parse_fields / parse_disc_fields into one
+list per column, with no per-record dict, and each chunk is written out as
+a Parquet row group, an Arrow record batch or CSV rows.
+
+Licences and discs have different columns, so they are written to two
+files next to the requested path: results.parquet becomes
+results.licences.parquet and results.discs.parquet. Records that are
+neither (unreadable lines, unknown payloads) are kept in the licence file
+with success false and the error.
+
+pyarrow is optional: without it .parquet and .arrow outputs fall back to CSV.
+"""
+
+import csv
+import os
+import sys
+from typing import Dict, Optional
+
+from sa_license_decoder import (DISC_FIELDS, LICENSE_FIELDS, LICENSE_LIST_FIELDS, RECORD_SIZE,
+                                decrypt_data, parse_disc_fields, parse_fields)
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+KINDS = ('licences', 'discs')
+
+# Columns every table starts with
+COMMON_COLUMNS = ('index', 'success', 'error')
+
+COLUMNS = {
+    'licences': COMMON_COLUMNS + LICENSE_FIELDS,
+    'discs': COMMON_COLUMNS + DISC_FIELDS,
+}
+
+LIST_COLUMNS = {'licences': LICENSE_LIST_FIELDS, 'discs': ()}
+
+# Separator of list values in CSV cells
+CSV_LIST_SEPARATOR = ';'
+
+# Columns of one chunk: kind -> column name -> values
+Columns = Dict[str, Dict[str, list]]
+
+
+def new_columns() -> Columns:
+    return {kind: {name: [] for name in COLUMNS[kind]} for kind in KINDS}
+
+
+def _append(columns: Dict[str, list], kind: str, index: int, values: Optional[tuple], error: Optional[str]):
+    columns['index'].append(index)
+    columns['success'].append(error is None)
+    columns['error'].append(error)
+
+    fields = COLUMNS[kind][len(COMMON_COLUMNS):]
+    if values is None:
+        for name in fields:
+            columns[name].append([] if name in LIST_COLUMNS[kind] else None)
+    else:
+        for name, value in zip(fields, values):
+            columns[name].append(value)
+
+
+def add_licence(columns: Columns, index: int, record: bytes):
+    """Decrypt and parse one 720-byte record into the licence columns"""
+    try:
+        if len(record) != RECORD_SIZE:
+            raise ValueError(f'Invalid barcode length: {len(record)}, expected 720 bytes')
+        values, error = parse_fields(decrypt_data(record)), None
+    except Exception as e:
+        values, error = None, f'Failed to decode SA license: {e}'
+    _append(columns['licences'], 'licences', index, values, error)
+
+
+def add_disc(columns: Columns, index: int, barcode_text: str):
+    """Parse one disc string into the disc columns"""
+    try:
+        values, error = parse_disc_fields(barcode_text), None
+    except ValueError as e:
+        values, error = None, str(e)
+    _append(columns['discs'], 'discs', index, values, error)
+
+
+def add_error(columns: Columns, index: int, error: str):
+    """Record an input that is neither a licence nor a disc"""
+    _append(columns['licences'], 'licences', index, None, error)
+
+
+def output_paths(path: str, fmt: str) -> Dict[str, str]:
+    """results.parquet -> {'licences': 'results.licences.parquet', 'discs': 'results.discs.parquet'}"""
+    stem = os.path.splitext(path)[0]
+    return {kind: f'{stem}.{kind}.{fmt}' for kind in KINDS}
+
+
+def output_format(path: str) -> str:
+    """'parquet', 'arrow' or 'csv' from the file extension, CSV when pyarrow is missing"""
+    extension = os.path.splitext(path)[1].lower().lstrip('.')
+    fmt = {'parquet': 'parquet', 'arrow': 'arrow', 'feather': 'arrow'}.get(extension, 'csv')
+    if fmt != 'csv' and pa is None:
+        print(f'pyarrow is not installed, writing CSV instead of {fmt}', file=sys.stderr)
+        return 'csv'
+    return fmt
+
+
+def _arrow_schema(kind: str):
+    types = {'index': pa.int64(), 'success': pa.bool_(), 'version': pa.int16()}
+    return pa.schema([
+        (name, pa.list_(pa.string()) if name in LIST_COLUMNS[kind] else types.get(name, pa.string()))
+        for name in COLUMNS[kind]
+    ])
+
+
+class ColumnarWriter:
+    """Writes column chunks to one file per kind, opening each file on its first row"""
+
+    def __init__(self, path: str):
+        self.format = output_format(path)
+        self.paths = output_paths(path, self.format)
+        self.rows = {kind: 0 for kind in KINDS}
+        self._sinks = {}
+
+    def _open(self, kind: str):
+        path = self.paths[kind]
+        if self.format == 'parquet':
+            return pq.ParquetWriter(path, _arrow_schema(kind))
+        if self.format == 'arrow':
+            return pa.ipc.new_file(pa.OSFile(path, 'wb'), _arrow_schema(kind))
+
+        f = open(path, 'w', newline='', encoding='utf-8')
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS[kind])
+        return f, writer
+
+    def write(self, columns: Columns):
+        for kind in KINDS:
+            chunk = columns[kind]
+            count = len(chunk['index'])
+            if not count:
+                continue
+            if kind not in self._sinks:
+                self._sinks[kind] = self._open(kind)
+            sink = self._sinks[kind]
+
+            if self.format == 'csv':
+                lists = LIST_COLUMNS[kind]
+                values = [
+                    [CSV_LIST_SEPARATOR.join(value) for value in chunk[name]] if name in lists else chunk[name]
+                    for name in COLUMNS[kind]
+                ]
+                sink[1].writerows(zip(*values))
+            else:
+                batch = pa.record_batch([chunk[name] for name in COLUMNS[kind]], schema=_arrow_schema(kind))
+                if self.format == 'parquet':
+                    sink.write_batch(batch)
+                else:
+                    sink.write(batch)
+
+            self.rows[kind] += count
+
+    def close(self) -> Dict[str, str]:
+        """Close the files; returns kind -> path for the ones written"""
+        for kind, sink in self._sinks.items():
+            if self.format == 'csv':
+                sink[0].close()
+            else:
+                sink.close()
+        return {kind: self.paths[kind] for kind in self._sinks}
@@ -0,0 +1,62 @@
+"""
+Per-request latency budget
+A Deadline is created when a request arrives and handed to every decode
+stage, which checks it before starting more work and raises
+DeadlineExceeded once the budget is spent.
+"""
+
+import os
+import time
+from typing import Optional
+
+# Budget applied when a request does not send one (0 = no deadline)
+DECODE_DEADLINE_MS = int(os.environ.get('DECODE_DEADLINE_MS', '0') or 0)
+
+
+class DeadlineExceeded(Exception):
+    """The request ran out of time; carries where it stopped and how far it got"""
+
+    def __init__(self, stage: str, deadline: 'Deadline'):
+        self.stage = stage
+        self.budget_ms = deadline.budget_ms
+        self.elapsed_ms = deadline.elapsed_ms()
+        self.variants_tried = deadline.variants_tried
+        super().__init__(f'Decode deadline of {self.budget_ms} ms exceeded during {stage} '
+                         f'after {self.variants_tried} variants')
+
+
+class Deadline:
+    """
+    Time budget of one request
+
+    Also counts the preprocessing variants attempted so far, so a timeout
+    can report how much of the cascade ran.
+    """
+
+    def __init__(self, budget_ms: Optional[int]):
+        self.budget_ms = budget_ms if budget_ms and budget_ms > 0 else None
+        self.started = time.monotonic()
+        self.expires = self.started + self.budget_ms / 1000 if self.budget_ms else None
+        self.variants_tried = 0
+
+    @classmethod
+    def from_options(cls, options) -> 'Deadline':
+        """Deadline from the request's deadline_ms, else DECODE_DEADLINE_MS"""
+        return cls(options.get('deadline_ms') or DECODE_DEADLINE_MS)
+
+    def remaining(self) -> Optional[float]:
+        """Seconds left, or None when there is no deadline"""
+        if self.expires is None:
+            return None
+        return max(0.0, self.expires - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.expires is not None and time.monotonic() >= self.expires
+
+    def check(self, stage: str):
+        """Raise DeadlineExceeded if the budget is spent"""
+        if self.expired():
+            raise DeadlineExceeded(stage, self)
+
+    def elapsed_ms(self) -> int:
+        return round((time.monotonic() - self.started) * 1000)
@@ -0,0 +1,458 @@
+"""
+PDF417 decode pipeline shared by app.py and app_sa.py
+Localizes the barcode, walks a coarse-to-fine resolution pyramid and runs
+the preprocessing cascade at each level, either sequentially, as a
+parallel race, or with every decoder backend voting on each variant
+"""
+
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, TimeoutError as FuturesTimeout, wait
+from typing import Dict, List, NamedTuple, Optional, Tuple, Union
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from barcode_locator import locate_barcode
+from deadline import Deadline, DeadlineExceeded
+from decode_trace import Trace, size_of
+from decoder_backends import DECODER, AcceptBarcode
+from image_pyramid import pyramid_scales
+from metrics import VARIANT_ATTEMPTS, VARIANT_DECODE_SECONDS, VARIANT_PREPROCESS_SECONDS
+from pools import LazyPool
+from preprocessing import PREPROCESSING_METHODS, to_gray
+from result_cache import PAYLOAD_CACHE
+from sa_license_decoder import Record, decode_license_record, is_disc_text, is_license_payload
+from variant_stats import VariantStats, size_bucket
+
+logger = logging.getLogger(__name__)
+
+# Cascade mode used when a request does not ask for one ('sequential', 'race' or 'vote')
+DECODE_MODE = os.environ.get('DECODE_MODE', 'sequential')
+
+# Size of the per-worker process pool used by race mode (0 = one per core, at most one per
+# variant). gunicorn.conf.py sets it to the worker's share of the host's CPUs
+RACE_WORKERS = int(os.environ.get('DECODE_RACE_WORKERS', '0') or 0)
+
+DECODE_MODES = ('sequential', 'race', 'vote')
+
+# Crop to the located barcode region before running the cascade
+LOCALIZE = os.environ.get('BARCODE_LOCALIZE', '1') == '1'
+
+# Run the cascade on the full image when the cropped region does not decode
+LOCALIZE_FALLBACK = os.environ.get('BARCODE_LOCALIZE_FALLBACK', '1') == '1'
+
+# Try downscaled copies before the full resolution image
+PYRAMID = os.environ.get('DECODE_PYRAMID', '1') == '1'
+
+# Which barcodes end the cascade when a request does not say (a name in ACCEPT_PREDICATES)
+DECODE_ACCEPT = os.environ.get('DECODE_ACCEPT', 'document')
+
+
+class CascadeResult(NamedTuple):
+    method_used: Optional[str]
+    barcodes: List[Tuple[str, bytes]]
+    localized: bool = False
+    resolution: Optional[Tuple[int, int]] = None
+    backend: Optional[str] = None
+    accepted: bool = False
+
+
+_PREPROCESSORS = dict(PREPROCESSING_METHODS)
+
+VARIANT_STATS = VariantStats([method_name for method_name, _ in PREPROCESSING_METHODS])
+
+_RACE_POOL = LazyPool(ProcessPoolExecutor, min(len(PREPROCESSING_METHODS), RACE_WORKERS or os.cpu_count() or 1))
+
+
+def decode_variant_timed(gray: np.ndarray, method_name: str
+                         ) -> Tuple[List[Tuple[str, bytes]], float, float, Optional[str]]:
+    """
+    Apply one preprocessing method to the shared grayscale buffer and run
+    the decoder backend chain on the result
+    Returns (barcodes, preprocess seconds, decode seconds, backend), where
+    barcodes is a list of (barcode_text, barcode_bytes), empty if nothing
+    decoded, and backend names the decoder that found them.
+    The timings are returned rather than recorded so race mode can report
+    them from the parent process.
+    """
+    logger.debug("Trying preprocessing method: %s", method_name)
+    started = time.perf_counter()
+    preprocessed = started
+    backend = None
+    try:
+        processed = _PREPROCESSORS[method_name](gray)
+        preprocessed = time.perf_counter()
+
+        barcodes, backend = DECODER.decode(processed)
+        logger.debug("%s: %d barcodes (%s)", method_name, len(barcodes), backend)
+    except Exception as e:
+        # Let the caller move on to the next method
+        logger.info("Method %s failed: %s", method_name, e)
+        barcodes = []
+
+    return barcodes, preprocessed - started, time.perf_counter() - preprocessed, backend
+
+
+def decode_variant(gray: np.ndarray, method_name: str) -> List[Tuple[str, bytes]]:
+    """decode_variant_timed without the timings"""
+    return decode_variant_timed(gray, method_name)[0]
+
+
+def _observe_variant(method_name: str, outcome: str, preprocess_seconds: float, decode_seconds: float,
+                     backend: Optional[str], gray: np.ndarray, trace: Trace):
+    VARIANT_PREPROCESS_SECONDS.observe(preprocess_seconds, variant=method_name)
+    VARIANT_DECODE_SECONDS.observe(decode_seconds, variant=method_name)
+    VARIANT_ATTEMPTS.inc(variant=method_name, outcome=outcome)
+    trace.record('variant', preprocess_seconds + decode_seconds, variant=method_name, outcome=outcome,
+                 size=size_of(gray), preprocess_ms=round(preprocess_seconds * 1000, 3),
+                 decode_ms=round(decode_seconds * 1000, 3), backend=backend)
+
+
+def classify_barcode(barcode_text: Optional[str], barcode_bytes: Optional[bytes]) -> str:
+    """Guess the document type from a decoded barcode ('license', 'disc' or 'unknown')"""
+    if barcode_bytes and len(barcode_bytes) == 720:
+        return 'license'
+    if barcode_text and barcode_text.startswith('%'):
+        return 'disc'
+    return 'unknown'
+
+
+def usable_barcode(barcode_text: Optional[str], barcode_bytes: Optional[bytes]) -> bool:
+    """
+    A payload the document decoders can use: a 720-byte licence record with
+    a known version header that decrypts and parses, or a vehicle disc that
+    passes the DISC_SCHEMA validation
+
+    The licence is decrypted through PAYLOAD_CACHE under the key the app
+    decodes it with, so the accepted record is not decrypted a second time.
+    """
+    if is_license_payload(barcode_bytes):
+        record = PAYLOAD_CACHE.decode('license', barcode_bytes, lambda: decode_license_record(barcode_bytes))
+        return isinstance(record, Record)
+    return is_disc_text(barcode_text)
+
+
+def usable_barcode_uncached(barcode_text: Optional[str], barcode_bytes: Optional[bytes]) -> bool:
+    """usable_barcode for requests that opted out of the payload cache"""
+    if is_license_payload(barcode_bytes):
+        return isinstance(decode_license_record(barcode_bytes), Record)
+    return is_disc_text(barcode_text)
+
+
+def any_barcode(barcode_text: Optional[str], barcode_bytes: Optional[bytes]) -> bool:
+    """Every barcode read, whatever it holds"""
+    return True
+
+
+# Acceptance predicates by name: only a barcode the predicate accepts ends the cascade
+ACCEPT_PREDICATES: Dict[str, AcceptBarcode] = {
+    'document': usable_barcode,
+    'any': any_barcode,
+}
+
+
+def accept_predicate(accept: Union[str, AcceptBarcode, None], cache: bool = True) -> AcceptBarcode:
+    """
+    Resolve a predicate name (or None for DECODE_ACCEPT); callables are used as they are
+
+    cache: False for a request that opted out of the payload cache, so the
+        'document' check keeps nothing it decrypts
+    """
+    if callable(accept):
+        return accept
+
+    name = accept or DECODE_ACCEPT
+    if name not in ACCEPT_PREDICATES:
+        raise ValueError(f"Unknown accept predicate: {name}, expected one of {', '.join(ACCEPT_PREDICATES)}")
+    if ACCEPT_PREDICATES[name] is usable_barcode and not cache:
+        return usable_barcode_uncached
+    return ACCEPT_PREDICATES[name]
+
+
+def _confirmed(barcodes: list, fallback: Optional[tuple]) -> bool:
+    """
+    Whether a rejected read repeats the fallback's payload. Two
+    error-corrected reads that agree are what the barcode holds (say a
+    licence from a key generation that is not configured), so trying more
+    variants would not change it; the read ends the search and the document
+    decoder reports why it is unusable.
+    """
+    return bool(barcodes) and fallback is not None and barcodes[0] == fallback[1][0]
+
+
+def _accepted(barcodes: list, accept: AcceptBarcode, fallback: Optional[tuple]) -> list:
+    """The barcodes of a variant that end the search: those `accept` agrees with, or a confirmed read"""
+    accepted = [barcode for barcode in barcodes if accept(*barcode)]
+    return accepted or (barcodes if _confirmed(barcodes, fallback) else [])
+
+
+def _outcome(barcodes: list, accepted: bool) -> str:
+    """Variant outcome for metrics and the trace: success, rejected (read but not accepted) or failure"""
+    if accepted:
+        return 'success'
+    return 'rejected' if barcodes else 'failure'
+
+
+def _run_sequential(gray: np.ndarray, methods: List[str], accept: AcceptBarcode, deadline: Deadline,
+                    trace: Trace, failed: List[str]):
+    """
+    Try the variants in order until one reads a barcode `accept` agrees with
+
+    A rejected read counts as a failed variant and is kept as the fallback
+    returned (with accepted False) when no variant is accepted; a second
+    identical rejected read ends the search (see _accepted). A variant
+    already running is not interrupted by the deadline.
+    """
+    fallback = None
+    for method_name in methods:
+        deadline.check('cascade')
+        barcodes, preprocess_seconds, decode_seconds, backend = decode_variant_timed(gray, method_name)
+        accepted = _accepted(barcodes, accept, fallback)
+        _observe_variant(method_name, _outcome(barcodes, bool(accepted)), preprocess_seconds, decode_seconds,
+                         backend, gray, trace)
+        deadline.variants_tried += 1
+        if accepted:
+            return method_name, accepted, backend, True
+
+        failed.append(method_name)
+        if barcodes and fallback is None:
+            fallback = (method_name, barcodes, backend, False)
+
+    return fallback or (None, [], None, False)
+
+
+def _run_race(gray: np.ndarray, methods: List[str], parallelism: Optional[int], accept: AcceptBarcode,
+              deadline: Deadline, trace: Trace, failed: List[str]):
+    """
+    Run up to `parallelism` variants at once on the race pool, refilling the
+    window as variants fail, and return the first one whose barcode `accept`
+    agrees with (`accept` runs here, in the parent process). Rejected reads
+    are handled as in _run_sequential.
+
+    Variants that have not started yet are cancelled once a winner is found
+    or the deadline passes. Variants already running cannot be interrupted
+    by ProcessPoolExecutor; they finish in the background and their results
+    are discarded.
+    """
+    pool = _RACE_POOL.get()
+    window = max(1, min(int(parallelism or pool._max_workers), pool._max_workers))
+
+    pending_methods = list(methods)
+    in_flight = {}
+    fallback = None
+
+    def submit_next():
+        method_name = pending_methods.pop(0)
+        in_flight[pool.submit(decode_variant_timed, gray, method_name)] = method_name
+
+    while pending_methods and len(in_flight) < window:
+        submit_next()
+
+    try:
+        while in_flight:
+            done, _ = wait(in_flight, timeout=deadline.remaining(), return_when=FIRST_COMPLETED)
+            if not done:
+                raise DeadlineExceeded('cascade', deadline)
+
+            for future in done:
+                method_name = in_flight.pop(future)
+                barcodes, preprocess_seconds, decode_seconds, backend = future.result()
+                accepted = _accepted(barcodes, accept, fallback)
+                _observe_variant(method_name, _outcome(barcodes, bool(accepted)), preprocess_seconds,
+                                 decode_seconds, backend, gray, trace)
+                deadline.variants_tried += 1
+                if accepted:
+                    return method_name, accepted, backend, True
+
+                failed.append(method_name)
+                if barcodes and fallback is None:
+                    fallback = (method_name, barcodes, backend, False)
+                if pending_methods:
+                    submit_next()
+    finally:
+        for future in in_flight:
+            future.cancel()
+
+    return fallback or (None, [], None, False)
+
+
+def _run_vote(gray: np.ndarray, methods: List[str], accept: AcceptBarcode, deadline: Deadline,
+              trace: Trace, failed: List[str]):
+    """
+    Try the variants in order, running every decoder backend at once on each
+
+    A variant only wins with a barcode `accept` agrees with (or a confirmed
+    read, see _confirmed), so a misread from one backend does not end the
+    cascade. If nothing is accepted, the first barcode any backend read is
+    returned instead.
+    """
+    fallback = None
+    for method_name in methods:
+        deadline.check('cascade')
+        started = time.perf_counter()
+        preprocessed = started
+        try:
+            processed = _PREPROCESSORS[method_name](gray)
+            preprocessed = time.perf_counter()
+            barcodes, backend, accepted = DECODER.vote(processed, accept, deadline.remaining())
+            accepted = accepted or _confirmed(barcodes, fallback)
+        except FuturesTimeout:
+            raise DeadlineExceeded('cascade', deadline)
+        except Exception as e:
+            logger.info("Method %s failed: %s", method_name, e)
+            barcodes, backend, accepted = [], None, False
+
+        _observe_variant(method_name, _outcome(barcodes, accepted), preprocessed - started,
+                         time.perf_counter() - preprocessed, backend, gray, trace)
+        deadline.variants_tried += 1
+        if accepted:
+            return method_name, barcodes, backend, True
+
+        # A rejected read still counts as a failure for the variant ordering
+        failed.append(method_name)
+        if barcodes and fallback is None:
+            fallback = (method_name, barcodes, backend, False)
+
+    return fallback or (None, [], None, False)
+
+
+def _cascade(gray: np.ndarray, mode: str, parallelism: Optional[int], document_type: Optional[str],
+             accept: AcceptBarcode, deadline: Deadline, trace: Trace):
+    height, width = gray.shape
+    bucket = size_bucket(width, height)
+    methods = VARIANT_STATS.order(document_type, bucket)
+
+    failed = []
+    try:
+        if mode == 'race':
+            method_used, barcodes, backend, accepted = _run_race(gray, methods, parallelism, accept,
+                                                                 deadline, trace, failed)
+        elif mode == 'vote':
+            method_used, barcodes, backend, accepted = _run_vote(gray, methods, accept, deadline, trace, failed)
+        else:
+            method_used, barcodes, backend, accepted = _run_sequential(gray, methods, accept, deadline, trace,
+                                                                       failed)
+    except DeadlineExceeded:
+        # The variants that did finish still count as failures
+        if failed:
+            VARIANT_STATS.record(document_type, bucket, failed, None)
+        raise
+
+    if barcodes and not document_type:
+        document_type = classify_barcode(*barcodes[0])
+    VARIANT_STATS.record(document_type, bucket, failed, method_used if accepted else None)
+
+    return method_used, barcodes, backend, accepted
+
+
+def _cascade_pyramid(gray: np.ndarray, mode: str, parallelism: Optional[int],
+                     document_type: Optional[str], pyramid: bool, accept: AcceptBarcode, deadline: Deadline,
+                     trace: Trace, localized: bool) -> CascadeResult:
+    """Run the cascade from the coarsest pyramid level up"""
+    height, width = gray.shape
+    scales = pyramid_scales(gray) if pyramid else [1.0]
+    fallback = None
+
+    # Every level is resized from the same grayscale buffer
+    for scale in scales:
+        deadline.check('pyramid')
+        if scale == 1.0:
+            level = gray
+        else:
+            size = (max(1, round(width * scale)), max(1, round(height * scale)))
+            with trace.stage('pyramid_resize', scale=round(scale, 4)) as span:
+                level = cv2.resize(gray, size, interpolation=cv2.INTER_AREA)
+                if span is not None:
+                    span['size'] = size_of(level)
+
+        method_used, barcodes, backend, accepted = _cascade(level, mode, parallelism, document_type, accept,
+                                                            deadline, trace)
+        if barcodes:
+            result = CascadeResult(method_used, barcodes, localized, (level.shape[1], level.shape[0]), backend,
+                                   accepted)
+            if accepted:
+                return result
+            fallback = fallback or result
+
+    return fallback or CascadeResult(None, [], localized)
+
+
+def run_cascade(image: Union[Image.Image, np.ndarray], mode: Optional[str] = None,
+                parallelism: Optional[int] = None,
+                document_type: Optional[str] = None,
+                localize: Optional[bool] = None,
+                pyramid: Optional[bool] = None,
+                deadline: Optional[Deadline] = None,
+                trace: Optional[Trace] = None,
+                accept: Union[str, AcceptBarcode, None] = None) -> CascadeResult:
+    """
+    Try the preprocessing methods until one decodes a PDF417 barcode
+
+    The image is converted to grayscale once; localization, the pyramid and
+    every preprocessing variant work from that single buffer.
+    When localization is on, the cascade first runs on a deskewed crop of the
+    barcode region and only falls back to the full image if that fails.
+    With the pyramid on, each image is first tried at a reduced resolution
+    (module size ~TARGET_MODULE_SIZE px) and scaled up only on failure.
+    The variant order comes from VARIANT_STATS, so the method most likely to
+    win for this document type and image size is tried first.
+    Only a barcode the `accept` predicate agrees with ends the search, so a
+    truncated read or a licence with an unknown header moves on to the next
+    variant instead of failing the request later; when nothing is
+    accepted, the first barcode read anywhere is returned with accepted
+    False. In vote mode every decoder backend runs on each variant.
+    Every stage checks `deadline` before starting more work and is timed
+    through `trace`.
+
+    Args:
+        image: PIL image in any mode, or a grayscale/RGB array
+        mode: 'sequential', 'race' or 'vote', defaults to DECODE_MODE
+        parallelism: Max variants in flight at once in race mode
+        document_type: Optional hint ('license' or 'disc') used for ordering
+        localize: Crop to the barcode region first, defaults to LOCALIZE
+        pyramid: Try downscaled levels first, defaults to PYRAMID
+        deadline: Request time budget, unlimited when omitted
+        trace: Stage trace of the request, metrics only when omitted
+        accept: Acceptance predicate, a name in ACCEPT_PREDICATES ('document' or
+            'any') or a callable(barcode_text, barcode_bytes), defaults to DECODE_ACCEPT
+
+    Returns:
+        CascadeResult(method_used, [(barcode_text, barcode_bytes), ...],
+                      localized, resolution, backend, accepted)
+
+    Raises:
+        DeadlineExceeded: when the deadline passes before a barcode is found
+    """
+    mode = mode or DECODE_MODE
+    if mode not in DECODE_MODES:
+        raise ValueError(f"Unknown decode mode: {mode}, expected one of {', '.join(DECODE_MODES)}")
+
+    accept = accept_predicate(accept)
+    pyramid = PYRAMID if pyramid is None else pyramid
+    deadline = deadline or Deadline(None)
+    cropped = None
+    trace = trace or Trace(enabled=False)
+    with trace.stage('grayscale') as span:
+        gray = to_gray(image)
+        if span is not None:
+            span['size'] = size_of(gray)
+
+    if LOCALIZE if localize is None else localize:
+        deadline.check('localization')
+        with trace.stage('localization') as span:
+            region = locate_barcode(gray)
+            if span is not None:
+                span['size'] = size_of(region) if region is not None else None
+        if region is not None:
+            cropped = _cascade_pyramid(region, mode, parallelism, document_type, pyramid, accept, deadline,
+                                       trace, True)
+            if cropped.accepted or not LOCALIZE_FALLBACK:
+                return cropped
+
+    full = _cascade_pyramid(gray, mode, parallelism, document_type, pyramid, accept, deadline, trace, False)
+    if not full.accepted and cropped is not None and cropped.barcodes:
+        return cropped
+    return full
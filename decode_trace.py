@@ -0,0 +1,108 @@
+"""
+Per-request stage trace for /decode
+With "trace": true the response gets a "trace" listing every stage in the
+order it finished, with its duration, the image size it worked on and the
+change in resident memory. Stages are also timed for /metrics whether or
+not the request is traced.
+"""
+
+import os
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+from metrics import STAGE_SECONDS
+
+STATM_PATH = '/proc/self/statm'
+
+try:
+    PAGE_KB = os.sysconf('SC_PAGE_SIZE') // 1024
+except (AttributeError, ValueError, OSError):
+    PAGE_KB = 4
+
+
+def rss_kb() -> Optional[int]:
+    """
+    Resident set size of this process in KiB, or None where unavailable
+
+    One small read of /proc, cheap enough to take around every stage
+    (tracemalloc would slow every allocation down while tracing).
+    """
+    try:
+        with open(STATM_PATH, 'rb') as statm:
+            return int(statm.read().split()[1]) * PAGE_KB
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def _ms(seconds: float) -> float:
+    return round(seconds * 1000, 3)
+
+
+class Trace:
+    """
+    Stage timings of one request
+
+    A disabled trace still feeds STAGE_SECONDS, so the decode code times
+    each stage once through `stage` whether or not the client asked for a trace.
+    """
+
+    def __init__(self, enabled: bool = True, started: Optional[float] = None):
+        self.enabled = enabled
+        self.started = time.perf_counter() if started is None else started
+        self.rss_start_kb = rss_kb() if enabled else None
+        self.spans: List[Dict] = []
+        self.notes: Dict = {}
+
+    @classmethod
+    def from_options(cls, options, started: Optional[float] = None) -> 'Trace':
+        """Trace enabled by the request's trace option"""
+        return cls(bool(options.get('trace')), started)
+
+    @contextmanager
+    def stage(self, name: str, **info):
+        """
+        Time the with-block as stage `name`
+
+        Yields the span dict (None when disabled) so the block can add
+        what it found, such as the size of its output.
+        """
+        span = {'stage': name, **info} if self.enabled else None
+        rss_before = rss_kb() if self.enabled else None
+        started = time.perf_counter()
+        try:
+            yield span
+        finally:
+            elapsed = time.perf_counter() - started
+            STAGE_SECONDS.observe(elapsed, stage=name)
+            if span is not None:
+                span['ms'] = _ms(elapsed)
+                rss_after = rss_kb()
+                if rss_after is not None and rss_before is not None:
+                    span['rss_kb'] = rss_after
+                    span['rss_delta_kb'] = rss_after - rss_before
+                self.spans.append(span)
+
+    def record(self, name: str, seconds: float, **info):
+        """Add a stage measured elsewhere, such as a race variant run in a pool process"""
+        if self.enabled:
+            self.spans.append({'stage': name, 'ms': _ms(seconds), **info})
+
+    def note(self, **notes):
+        if self.enabled:
+            self.notes.update(notes)
+
+    def as_dict(self) -> Dict:
+        trace = {'total_ms': _ms(time.perf_counter() - self.started), **self.notes, 'stages': self.spans}
+        if self.rss_start_kb is not None:
+            trace['rss_start_kb'] = self.rss_start_kb
+        return trace
+
+
+def size_of(array_or_image) -> str:
+    """'WIDTHxHEIGHT' of a NumPy array or PIL image"""
+    if hasattr(array_or_image, 'shape'):
+        height, width = array_or_image.shape[:2]
+    else:
+        width, height = array_or_image.size
+    return f'{width}x{height}'
@@ -0,0 +1,327 @@
+"""
+PDF417 decoder backends for the decode cascade
+Every preprocessing variant is handed to a chain of backends, fastest
+first, and the first one that finds a barcode wins.
+
+Backends:
+    pdf417decoder (default): the pure-Python decoder the service has always used.
+    zxing (opt-in): ZXing's PDF417 reader in a JVM that stays resident for
+        the life of the process (ZxingServer.java) and takes batches of
+        grayscale images over a pipe. Needs java and core-3.5.3.jar; skipped
+        when either is missing. Every race, batch and job pool process starts
+        its own JVM, so measure memory before enabling it.
+"""
+
+import logging
+import os
+import shutil
+import struct
+import subprocess
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from pdf417decoder import PDF417Decoder
+from PIL import Image
+
+from pools import LazyPool
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Comma-separated backends tried in order for every variant
+DECODER_BACKENDS = os.environ.get('DECODER_BACKENDS', 'pdf417decoder')
+
+ZXING_JAVA = os.environ.get('ZXING_JAVA', 'java')
+ZXING_JAR = os.environ.get('ZXING_JAR', os.path.join(BASE_DIR, 'core-3.5.3.jar'))
+
+# Directory holding a compiled ZxingServer.class; without one the source is compiled at JVM start (JDK 11+)
+ZXING_CLASS_DIR = os.environ.get('ZXING_CLASS_DIR', os.path.join(BASE_DIR, 'zxing'))
+ZXING_SOURCE = os.path.join(BASE_DIR, 'ZxingServer.java')
+
+# Seconds to wait before starting the JVM again after it failed
+ZXING_RETRY_SECONDS = 30
+
+# Votes running at once per process, the same as app_sa's decode slots. A losing backend keeps
+# its vote thread until it finishes, so when they are all busy the backend runs in the request thread
+VOTE_CONCURRENCY = int(os.environ.get('DECODE_CONCURRENCY', '1'))
+
+# (barcode_text, barcode_bytes) per barcode found
+Barcodes = List[Tuple[str, bytes]]
+
+# Whether a decoded (barcode_text, barcode_bytes) is a payload worth returning
+AcceptBarcode = Callable[[str, bytes], bool]
+
+
+class BackendError(Exception):
+    """A backend could not run; the chain moves on to the next one"""
+
+
+class DecoderBackend:
+    """Decodes PDF417 barcodes from 2-D uint8 grayscale arrays"""
+
+    name = ''
+
+    def available(self) -> bool:
+        return True
+
+    def decode(self, gray: np.ndarray) -> Barcodes:
+        raise NotImplementedError
+
+    def decode_many(self, images: Sequence[np.ndarray]) -> List[Barcodes]:
+        return [self.decode(gray) for gray in images]
+
+
+class Pdf417DecoderBackend(DecoderBackend):
+    name = 'pdf417decoder'
+
+    def decode(self, gray: np.ndarray) -> Barcodes:
+        decoder = PDF417Decoder(Image.fromarray(gray))
+        decode_count = decoder.decode()
+        logger.debug("pdf417decoder: decode_count = %d", decode_count)
+
+        return [
+            (decoder.barcode_data_index_to_string(i), bytes(decoder.barcodes_data[i]))
+            for i in range(decode_count)
+        ]
+
+
+def _text_bytes(text: str) -> bytes:
+    """
+    Raw barcode bytes from ZXing's text
+
+    Byte compaction (the encrypted licence) is decoded as ISO-8859-1, so
+    encoding back to it restores the exact payload.
+    """
+    try:
+        return text.encode('latin-1')
+    except UnicodeEncodeError:
+        return text.encode('utf-8')
+
+
+class ZxingBackend(DecoderBackend):
+    """
+    ZXing in a long-lived JVM subprocess
+
+    The JVM is started on first use, and again in a forked child (race and
+    batch pool processes get their own). A lock serialises the pipe between
+    threads; a forked child gets a fresh lock and no JVM, since the parent's
+    lock may have been held by another thread at the fork. If the JVM dies
+    the call raises BackendError and the next start is attempted after
+    ZXING_RETRY_SECONDS.
+    """
+
+    name = 'zxing'
+
+    def __init__(self, java: str = ZXING_JAVA, jar: str = ZXING_JAR, class_dir: str = ZXING_CLASS_DIR):
+        self.java = java
+        self.jar = jar
+        self.class_dir = class_dir
+        self._process = None
+        self._pid = None
+        self._failed_at = None
+        self._lock = threading.Lock()
+        _ZXING_BACKENDS.add(self)
+
+    def _after_fork(self):
+        """Forget the parent's JVM and pipe lock in a freshly forked child"""
+        self._lock = threading.Lock()
+        self._process = None
+        self._pid = None
+
+    def available(self) -> bool:
+        return bool(shutil.which(self.java)) and os.path.exists(self.jar)
+
+    def command(self) -> List[str]:
+        if os.path.exists(os.path.join(self.class_dir, 'ZxingServer.class')):
+            return [self.java, '-cp', os.pathsep.join([self.jar, self.class_dir]), 'ZxingServer']
+        return [self.java, '-cp', self.jar, ZXING_SOURCE]
+
+    def _get_process(self) -> subprocess.Popen:
+        if self._process is not None and self._pid == os.getpid() and self._process.poll() is None:
+            return self._process
+
+        if self._failed_at is not None and time.monotonic() - self._failed_at < ZXING_RETRY_SECONDS:
+            raise BackendError('ZXing JVM failed recently, not restarting yet')
+
+        try:
+            self._process = subprocess.Popen(self.command(), stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        except OSError as e:
+            self._failed_at = time.monotonic()
+            raise BackendError(f'Could not start the ZXing JVM: {e}')
+        self._pid = os.getpid()
+        logger.info("Started ZXing JVM (pid %d)", self._process.pid)
+        return self._process
+
+    def _stop(self):
+        self._failed_at = time.monotonic()
+        if self._process is not None and self._pid == os.getpid():
+            self._process.kill()
+        self._process = None
+
+    def _read(self, stream, size: int) -> bytes:
+        data = stream.read(size)
+        if len(data) != size:
+            raise EOFError('ZXing JVM closed the pipe')
+        return data
+
+    def decode(self, gray: np.ndarray) -> Barcodes:
+        return self.decode_many([gray])[0]
+
+    def decode_many(self, images: Sequence[np.ndarray]) -> List[Barcodes]:
+        """Send every image in one batch and read all the answers back"""
+        with self._lock:
+            process = self._get_process()
+            try:
+                process.stdin.write(struct.pack('>i', len(images)))
+                for gray in images:
+                    height, width = gray.shape
+                    process.stdin.write(struct.pack('>ii', width, height))
+                    process.stdin.write(np.ascontiguousarray(gray, dtype=np.uint8).data)
+                process.stdin.flush()
+
+                results = []
+                for _ in images:
+                    count, = struct.unpack('>i', self._read(process.stdout, 4))
+                    if count < 0:
+                        logger.warning("ZXing raised while decoding an image, see its stderr")
+                    barcodes = []
+                    for _ in range(count):
+                        length, = struct.unpack('>i', self._read(process.stdout, 4))
+                        text = self._read(process.stdout, length).decode('utf-8')
+                        barcodes.append((text, _text_bytes(text)))
+                    results.append(barcodes)
+                return results
+
+            except (OSError, EOFError, struct.error) as e:
+                self._stop()
+                raise BackendError(f'ZXing JVM failed: {e}')
+
+
+# Every ZxingBackend, reset in forked children
+_ZXING_BACKENDS = weakref.WeakSet()
+
+
+def _reset_zxing_after_fork():
+    for backend in list(_ZXING_BACKENDS):
+        backend._after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_zxing_after_fork)
+
+
+BACKENDS = {
+    Pdf417DecoderBackend.name: Pdf417DecoderBackend,
+    ZxingBackend.name: ZxingBackend,
+}
+
+
+class BackendChain:
+    """Backends tried in order until one decodes, or all at once in a vote"""
+
+    def __init__(self, backends: Sequence[DecoderBackend]):
+        if not backends:
+            raise ValueError('No decoder backend available')
+        self.backends = list(backends)
+        self._vote_pool = LazyPool(ThreadPoolExecutor, len(self.backends) * VOTE_CONCURRENCY,
+                                   thread_name_prefix='decoder-vote')
+
+    @property
+    def names(self) -> List[str]:
+        return [backend.name for backend in self.backends]
+
+    def decode(self, gray: np.ndarray) -> Tuple[Barcodes, Optional[str]]:
+        """Returns (barcodes, name of the backend that found them or None)"""
+        for backend in self.backends:
+            try:
+                barcodes = backend.decode(gray)
+            except BackendError as e:
+                logger.warning("Decoder backend %s failed: %s", backend.name, e)
+                continue
+            if barcodes:
+                return barcodes, backend.name
+
+        return [], None
+
+    def _decode_quietly(self, backend: DecoderBackend, gray: np.ndarray) -> Barcodes:
+        try:
+            return backend.decode(gray)
+        except BackendError as e:
+            logger.warning("Decoder backend %s failed: %s", backend.name, e)
+            return []
+
+    def vote(self, gray: np.ndarray, accept: AcceptBarcode,
+             timeout: Optional[float] = None) -> Tuple[Barcodes, Optional[str], bool]:
+        """
+        Run every backend at once and return the first answer `accept` agrees with
+
+        Returns (barcodes, backend, accepted). When no backend produced an
+        accepted barcode, the first non-empty answer is returned with
+        accepted False. Backends still running when an answer is accepted
+        finish in the background and are ignored. A backend that finds every
+        vote thread busy runs in the calling thread instead, so at most
+        DECODE_CONCURRENCY decodes per backend run beside the request threads.
+
+        Raises:
+            concurrent.futures.TimeoutError: when `timeout` seconds pass first
+        """
+        if len(self.backends) == 1:
+            barcodes = self._decode_quietly(self.backends[0], gray)
+            accepted = [barcode for barcode in barcodes if accept(*barcode)]
+            return (accepted or barcodes), self.backends[0].name if barcodes else None, bool(accepted)
+
+        started = time.monotonic()
+        futures, inline = {}, []
+        for backend in self.backends:
+            future = self._vote_pool.try_submit(self._decode_quietly, backend, gray)
+            if future is None:
+                inline.append(backend)
+            else:
+                futures[future] = backend.name
+
+        fallback, fallback_backend = [], None
+        for backend in inline:
+            barcodes = self._decode_quietly(backend, gray)
+            accepted = [barcode for barcode in barcodes if accept(*barcode)]
+            if accepted:
+                return accepted, backend.name, True
+            if barcodes and not fallback:
+                fallback, fallback_backend = barcodes, backend.name
+
+        if timeout is not None:
+            timeout = max(0.0, timeout - (time.monotonic() - started))
+        for future in as_completed(futures, timeout=timeout):
+            barcodes = future.result()
+            accepted = [barcode for barcode in barcodes if accept(*barcode)]
+            if accepted:
+                return accepted, futures[future], True
+            if barcodes and not fallback:
+                fallback, fallback_backend = barcodes, futures[future]
+
+        return fallback, fallback_backend, False
+
+
+def create_chain(names: str) -> BackendChain:
+    """Build the chain named by DECODER_BACKENDS, leaving out unavailable backends"""
+    backends = []
+    for name in (n.strip() for n in names.split(',')):
+        if not name:
+            continue
+        if name not in BACKENDS:
+            raise ValueError(f"Unknown decoder backend: {name}, expected one of {', '.join(BACKENDS)}")
+
+        backend = BACKENDS[name]()
+        if backend.available():
+            backends.append(backend)
+        else:
+            logger.info("Decoder backend %s is not available here, skipping it", name)
+
+    return BackendChain(backends)
+
+
+DECODER = create_chain(DECODER_BACKENDS)
@@ -0,0 +1,120 @@
+"""
+Production gunicorn profile for app_sa
+    gunicorn -c gunicorn.conf.py app_sa:app
+
+The app is imported once in the master (RSA keys, decoder tables, NumPy and
+OpenCV) and shared copy-on-write with the workers. There is one worker per
+CPU the container may use. Each worker has a thread for each of its
+DECODE_CONCURRENCY decode slots, DECODE_QUEUE_DEPTH waiting decodes and
+BATCH_CONCURRENCY streamed batches (app_sa answers further ones 503 at once)
+plus spare threads, so /health and /stats answer while every decode slot is
+busy.
+
+The memory job backend only works in a single web worker: with more, /jobs
+is disabled (and an error logged) rather than losing jobs between workers.
+"""
+
+import gc
+import glob
+import os
+
+# Decodes run at once per worker (app_sa reads the same variable)
+DECODE_CONCURRENCY = int(os.environ.get('DECODE_CONCURRENCY', '1'))
+
+# Decodes per worker that may wait for a slot (app_sa reads the same variable)
+DECODE_QUEUE_DEPTH = max(0, int(os.environ.get('DECODE_QUEUE_DEPTH', '1')))
+
+# Streamed /decode/batch requests per worker (app_sa reads the same variable)
+BATCH_CONCURRENCY = max(0, int(os.environ.get('BATCH_CONCURRENCY', '1')))
+
+# Threads per worker kept free for /health, /stats, /metrics and /jobs
+LIGHT_THREADS = int(os.environ.get('GUNICORN_LIGHT_THREADS', '2'))
+
+
+def available_cpus() -> int:
+    """
+    CPUs this process may use: the cgroup CPU quota when there is one,
+    else the CPUs it is allowed to run on
+    """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+
+    quota = None
+    try:
+        # cgroup v2: "<quota> <period>" or "max <period>"
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            limit, period = f.read().split()
+        if limit != 'max':
+            quota = int(limit) / int(period)
+    except (OSError, ValueError):
+        try:
+            # cgroup v1: a quota of -1 means unlimited
+            with open('/sys/fs/cgroup/cpu/cpu.cfs_quota_us') as f:
+                limit = int(f.read())
+            with open('/sys/fs/cgroup/cpu/cpu.cfs_period_us') as f:
+                period = int(f.read())
+            if limit > 0 and period > 0:
+                quota = limit / period
+        except (OSError, ValueError):
+            pass
+
+    if quota is not None:
+        cpus = min(cpus, max(1, int(quota)))
+    return max(1, cpus)
+
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+
+workers = int(os.environ.get('WEB_CONCURRENCY', '0') or 0) or available_cpus()
+worker_class = 'gthread'
+threads = DECODE_CONCURRENCY + DECODE_QUEUE_DEPTH + BATCH_CONCURRENCY + LIGHT_THREADS
+
+raw_env = []
+
+# Every worker has its own batch and race pools, so each gets its share of the CPUs rather than all of them
+CPU_SHARE = max(1, available_cpus() // workers)
+for pool_size in ('BATCH_WORKERS', 'DECODE_RACE_WORKERS'):
+    if not os.environ.get(pool_size):
+        raw_env.append(f'{pool_size}={CPU_SHARE}')
+
+# Memory backend jobs live in the worker that accepted them, so they cannot be polled across workers
+JOBS_BACKEND = os.environ.get('JOBS_BACKEND', 'memory')
+MEMORY_JOBS_DISABLED = JOBS_BACKEND == 'memory' and workers > 1
+if MEMORY_JOBS_DISABLED:
+    raw_env.append('JOBS_BACKEND=disabled')
+
+# Load the app before forking so its memory is shared by the workers
+preload_app = True
+
+# Restart each worker after a few hundred requests, staggered so they do not all restart together.
+# Not by default while memory backend jobs are on: a restart drops every job its worker holds.
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS',
+                                  '0' if JOBS_BACKEND == 'memory' and not MEMORY_JOBS_DISABLED else '500'))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', '100'))
+
+# Worker heartbeats come from the main thread, so a long decode does not trip this
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '120'))
+graceful_timeout = 30
+keepalive = 5
+
+
+def on_starting(server):
+    # Snapshots of a previous run's processes would be summed into /metrics
+    metrics_dir = os.environ.get('METRICS_DIR')
+    if metrics_dir:
+        os.makedirs(metrics_dir, exist_ok=True)
+        for path in glob.glob(os.path.join(metrics_dir, 'metrics_*.json')):
+            os.remove(path)
+
+    if MEMORY_JOBS_DISABLED:
+        server.log.error('JOBS_BACKEND=memory cannot serve /jobs from %d web workers; /jobs is disabled. '
+                         'Set WEB_CONCURRENCY=1 or a redis:// JOBS_BACKEND', workers)
+
+
+def when_ready(server):
+    # Move everything the app allocated at import out of the collector's reach,
+    # so collections in the workers do not touch (and copy) those pages
+    gc.collect()
+    gc.freeze()
@@ -0,0 +1,309 @@
+"""
+Asynchronous decode jobs for /jobs
+POST /jobs queues an image and returns at once; separate decode processes
+work through the queue and the client polls GET /jobs/<id> or is called back.
+
+Backends:
+    memory (default): a process pool owned by each web worker. Jobs can
+        only be polled on the worker that accepted them, so run gunicorn
+        with one worker or use the redis backend; polling a job on another
+        worker raises JobElsewhere rather than reporting it unknown.
+    redis://...: a list queue and job records in any Redis-compatible
+        server, drained by `python jobs.py` worker processes.
+    disabled: /jobs answers 503. gunicorn.conf.py switches to it when the
+        memory backend would run under several web workers.
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+import urllib.request
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, Optional
+from urllib.parse import urlparse
+
+from image_input import InvalidRequest
+from pools import LazyPool
+from result_cache import TTLCache
+
+# "memory", "disabled" or a redis:// URL
+JOBS_BACKEND = os.environ.get('JOBS_BACKEND', 'memory')
+
+# Decode processes (0 = one per core)
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '0') or 0)
+
+# Queued plus running jobs accepted before POST /jobs answers 503
+JOBS_MAX_PENDING = int(os.environ.get('JOBS_MAX_PENDING', '32'))
+
+# Seconds a finished job (and its decoded personal data) can be fetched
+JOB_RESULT_TTL = int(os.environ.get('JOB_RESULT_TTL', '300'))
+
+# Comma-separated hosts callbacks may be sent to; callbacks are refused when empty,
+# since the job record carries decrypted personal data
+JOB_CALLBACK_HOSTS = [h.strip() for h in os.environ.get('JOB_CALLBACK_HOSTS', '').split(',') if h.strip()]
+
+CALLBACK_TIMEOUT = 10
+
+# Seconds a queued job may wait for a redis worker before it is dropped
+QUEUED_JOB_TTL = 3600
+
+# Signature of the decode function run for each job: (image bytes, options) -> result dict
+JobRunner = Callable[[bytes, Dict], Dict]
+
+
+class QueueFull(Exception):
+    """Raised by submit when JOBS_MAX_PENDING jobs are already waiting"""
+
+
+class JobElsewhere(Exception):
+    """A memory backend job polled on a web worker process other than the one that accepted it"""
+
+
+class JobsDisabled(Exception):
+    """Raised by the disabled backend for every submit and status call"""
+
+
+def validate_callback_url(url: str) -> str:
+    """Only allow http(s) callbacks to a host listed in JOB_CALLBACK_HOSTS"""
+    if not JOB_CALLBACK_HOSTS:
+        raise InvalidRequest('callback_url is disabled on this server (JOB_CALLBACK_HOSTS is not set)')
+
+    parsed = urlparse(url)
+    if parsed.scheme not in ('http', 'https') or not parsed.hostname:
+        raise InvalidRequest(f'Invalid callback_url: {url}')
+    if parsed.hostname not in JOB_CALLBACK_HOSTS:
+        raise InvalidRequest(f'callback_url host not allowed: {parsed.hostname}')
+    return url
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    """Fail on redirects, so an allowed host cannot forward the record elsewhere"""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+_callback_opener = urllib.request.build_opener(_NoRedirect)
+
+
+def _job_record(job_id: str, status: str, **fields) -> Dict:
+    return {'job_id': job_id, 'status': status, **fields}
+
+
+def send_callback(url: str, record: Dict) -> Optional[str]:
+    """POST the finished job record to `url`; returns an error message or None"""
+    try:
+        validate_callback_url(url)
+    except InvalidRequest as e:
+        return str(e)
+
+    body = json.dumps(record).encode()
+    callback = urllib.request.Request(url, data=body, method='POST',
+                                      headers={'Content-Type': 'application/json'})
+    try:
+        with _callback_opener.open(callback, timeout=CALLBACK_TIMEOUT) as response:
+            response.read()
+        return None
+    except Exception as e:
+        return str(e)
+
+
+def execute_job(run_job: JobRunner, job_id: str, image_bytes: bytes, options: Dict) -> Dict:
+    """Decode one job in a worker process and notify the callback, if any"""
+    started = time.time()
+    try:
+        record = _job_record(job_id, 'done', result=run_job(image_bytes, options))
+    except Exception as e:
+        record = _job_record(job_id, 'failed', error=str(e))
+    record['duration_ms'] = round((time.time() - started) * 1000)
+
+    callback_url = options.get('callback_url')
+    if callback_url:
+        error = send_callback(callback_url, record)
+        record['callback'] = 'failed' if error else 'sent'
+        if error:
+            record['callback_error'] = error
+
+    return record
+
+
+class MemoryJobBackend:
+    """Jobs queued on a process pool owned by this web worker"""
+
+    def __init__(self, run_job: JobRunner, workers: int = JOB_WORKERS,
+                 max_pending: int = JOBS_MAX_PENDING, ttl: int = JOB_RESULT_TTL):
+        self.run_job = run_job
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending
+        self._pending = {}
+        self._finished = TTLCache(max_entries=max(1024, max_pending * 8), ttl=ttl)
+        self._lock = threading.Lock()
+        self._pool = LazyPool(ProcessPoolExecutor, self.workers, start_method='forkserver')
+
+    def submit(self, image_bytes: bytes, options: Dict) -> str:
+        with self._lock:
+            if len(self._pending) >= self.max_pending:
+                raise QueueFull(f'{len(self._pending)} jobs pending')
+
+            # The accepting process is part of the id, so other workers can tell it is not theirs
+            job_id = f'{os.getpid():x}-{uuid.uuid4().hex}'
+            future = self._pool.get().submit(execute_job, self.run_job, job_id, image_bytes, options)
+            self._pending[job_id] = future
+
+        future.add_done_callback(lambda f: self._finish(job_id, f))
+        return job_id
+
+    def _finish(self, job_id: str, future):
+        try:
+            record = future.result()
+        except Exception as e:
+            # The worker process died or the job could not be pickled
+            record = _job_record(job_id, 'failed', error=str(e))
+
+        self._finished.set(job_id, record)
+        with self._lock:
+            self._pending.pop(job_id, None)
+
+    def status(self, job_id: str) -> Optional[Dict]:
+        record = self._finished.get(job_id)
+        if record is not None:
+            return record
+
+        future = self._pending.get(job_id)
+        if future is None:
+            owner = job_id.partition('-')[0]
+            if '-' in job_id and owner != f'{os.getpid():x}':
+                raise JobElsewhere(f'Job {job_id} was accepted by web worker process {int(owner, 16)}, '
+                                   f'this is {os.getpid()}; JOBS_BACKEND=memory needs a single web '
+                                   f'worker (WEB_CONCURRENCY=1) or a redis:// JOBS_BACKEND')
+            return None
+        return _job_record(job_id, 'running' if future.running() else 'queued')
+
+    def stats(self) -> Dict:
+        return {'backend': 'memory', 'workers': self.workers, 'pending': len(self._pending),
+                'max_pending': self.max_pending, 'finished': len(self._finished)}
+
+
+class RedisJobBackend:
+    """
+    Jobs kept in a Redis-compatible server
+
+    `client` is anything with the redis-py get/set/delete/lpush/brpop/llen
+    methods. The web side only enqueues and reads records; `work()` runs in
+    the worker processes started by `python jobs.py`.
+    """
+
+    def __init__(self, client, run_job: Optional[JobRunner] = None,
+                 max_pending: int = JOBS_MAX_PENDING, ttl: int = JOB_RESULT_TTL,
+                 prefix: str = 'decode:jobs'):
+        self.client = client
+        self.run_job = run_job
+        self.max_pending = max_pending
+        self.ttl = ttl
+        self.queue_key = f'{prefix}:queue'
+        self.prefix = prefix
+
+    def _key(self, job_id: str, part: str = 'record') -> str:
+        return f'{self.prefix}:{job_id}:{part}'
+
+    def submit(self, image_bytes: bytes, options: Dict) -> str:
+        # Approximate: checked and pushed without a transaction
+        if self.client.llen(self.queue_key) >= self.max_pending:
+            raise QueueFull(f'{self.max_pending} jobs queued')
+
+        job_id = uuid.uuid4().hex
+        self.client.set(self._key(job_id, 'image'), image_bytes, ex=QUEUED_JOB_TTL)
+        self.client.set(self._key(job_id, 'options'), json.dumps(options), ex=QUEUED_JOB_TTL)
+        self.client.set(self._key(job_id), json.dumps(_job_record(job_id, 'queued')), ex=QUEUED_JOB_TTL)
+        self.client.lpush(self.queue_key, job_id)
+        return job_id
+
+    def status(self, job_id: str) -> Optional[Dict]:
+        stored = self.client.get(self._key(job_id))
+        return json.loads(stored) if stored is not None else None
+
+    def work_one(self, timeout: int = 5) -> bool:
+        """Run the next queued job; returns False when the queue stayed empty"""
+        popped = self.client.brpop(self.queue_key, timeout=timeout)
+        if popped is None:
+            return False
+
+        job_id = popped[1].decode() if isinstance(popped[1], bytes) else popped[1]
+        image_bytes = self.client.get(self._key(job_id, 'image'))
+        options = self.client.get(self._key(job_id, 'options'))
+        self.client.delete(self._key(job_id, 'image'), self._key(job_id, 'options'))
+
+        if image_bytes is None:
+            record = _job_record(job_id, 'failed', error='Job expired before a worker picked it up')
+        else:
+            self.client.set(self._key(job_id), json.dumps(_job_record(job_id, 'running')), ex=QUEUED_JOB_TTL)
+            record = execute_job(self.run_job, job_id, image_bytes, json.loads(options or '{}'))
+
+        self.client.set(self._key(job_id), json.dumps(record), ex=self.ttl)
+        return True
+
+    def work(self):
+        while True:
+            self.work_one()
+
+    def stats(self) -> Dict:
+        return {'backend': 'redis', 'queued': self.client.llen(self.queue_key),
+                'max_pending': self.max_pending}
+
+
+class DisabledJobBackend:
+    """No job queue: the deployment cannot run the one it asked for"""
+
+    reason = ('Jobs are disabled: JOBS_BACKEND=memory cannot run under several web workers; '
+              'set WEB_CONCURRENCY=1 or a redis:// JOBS_BACKEND')
+
+    def submit(self, image_bytes: bytes, options: Dict) -> str:
+        raise JobsDisabled(self.reason)
+
+    def status(self, job_id: str) -> Optional[Dict]:
+        raise JobsDisabled(self.reason)
+
+    def stats(self) -> Dict:
+        return {'backend': 'disabled'}
+
+
+def create_backend(target: str, run_job: JobRunner):
+    """Build the job backend named by JOBS_BACKEND"""
+    if target == 'memory':
+        return MemoryJobBackend(run_job)
+    if target == 'disabled':
+        return DisabledJobBackend()
+
+    try:
+        import redis
+    except ImportError:
+        raise RuntimeError(f'JOBS_BACKEND={target} needs the redis package')
+
+    return RedisJobBackend(redis.Redis.from_url(target), run_job)
+
+
+def _worker_main(target: str):
+    from app_sa import decode_job
+    create_backend(target, decode_job).work()
+
+
+def main():
+    """Start JOB_WORKERS decode processes for the redis backend"""
+    if JOBS_BACKEND in ('memory', 'disabled'):
+        sys.exit('JOBS_BACKEND=memory runs jobs inside the web workers; set a redis:// URL to use `python jobs.py`')
+
+    import multiprocessing
+    workers = [multiprocessing.Process(target=_worker_main, args=(JOBS_BACKEND,), daemon=True)
+               for _ in range(JOB_WORKERS or os.cpu_count() or 1)]
+    for worker in workers:
+        worker.start()
+    print(f'{len(workers)} decode workers on {JOBS_BACKEND}')
+    for worker in workers:
+        worker.join()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,265 @@
+"""
+Prometheus metrics for the decode pipeline
+Histograms and counters kept per process and rendered in the Prometheus
+text format by /metrics. Standard library only.
+
+Without METRICS_DIR /metrics shows the answering process only, with a pid
+label on every sample. With it, every process (gunicorn workers and their
+batch and job pools) writes a snapshot of its values there every
+METRICS_FLUSH_SECONDS, and /metrics sums the snapshots, so any worker
+answers for the whole host.
+"""
+
+import bisect
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Directory shared by the processes of one host for metric snapshots; empty keeps metrics per process
+METRICS_DIR = os.environ.get('METRICS_DIR', '')
+
+# Seconds between snapshots of each process's metrics in METRICS_DIR
+METRICS_FLUSH_SECONDS = float(os.environ.get('METRICS_FLUSH_SECONDS', '5'))
+
+# Seconds; covers sub-millisecond RSA up to whole-image cascades
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+REGISTRY: List['_Metric'] = []
+
+
+def _format_labels(names: Sequence[str], values: Tuple, extra: Sequence[str] = ()) -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    pairs.extend(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple, object] = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels: Dict) -> Tuple:
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def values(self) -> Dict[Tuple, object]:
+        """A copy of this process's values by label key"""
+        with self._lock:
+            return {key: self._copy(value) for key, value in self._values.items()}
+
+    def render(self, values: Optional[Dict[Tuple, object]] = None, extra: Sequence[str] = ()) -> List[str]:
+        """values: merged from several processes (default: this process's own); extra: labels added to each sample"""
+        values = self.values() if values is None else values
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for key, value in sorted(values.items()):
+            lines.extend(self._render_one(key, value, extra))
+        return lines
+
+    def _copy(self, value):
+        return value
+
+    def _merge(self, total, value):
+        raise NotImplementedError
+
+    def _render_one(self, key: Tuple, value, extra: Sequence[str]) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        if _flusher_pid != os.getpid():
+            _start_flusher()
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _merge(self, total, value):
+        return (total or 0) + value
+
+    def _render_one(self, key, value, extra):
+        return [f'{self.name}{_format_labels(self.labelnames, key, extra)} {value}']
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        if _flusher_pid != os.getpid():
+            _start_flusher()
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket counts (last one is +Inf), then sum
+                state = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            state[index] += 1
+            state[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the with-block"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _copy(self, state):
+        return list(state)
+
+    def _merge(self, total, state):
+        if total is None or len(total) != len(state):
+            return list(state)
+        return [a + b for a, b in zip(total, state)]
+
+    def _render_one(self, key, state, extra):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), state[:-1]):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            bucket_labels = _format_labels(self.labelnames, key, (*extra, f'le="{le}"'))
+            lines.append(f'{self.name}_bucket{bucket_labels} {cumulative}')
+        labels = _format_labels(self.labelnames, key, extra)
+        lines.append(f'{self.name}_sum{labels} {state[-1]}')
+        lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+# Process whose snapshot thread is running (None before the first metric update)
+_flusher_pid = None
+_flusher_lock = threading.Lock()
+
+
+def _snapshot_path(pid: int) -> str:
+    return os.path.join(METRICS_DIR, f'metrics_{pid}.json')
+
+
+def write_snapshot():
+    """Write this process's values to METRICS_DIR, replacing its previous snapshot"""
+    snapshot = {metric.name: [[list(key), value] for key, value in metric.values().items()]
+                for metric in REGISTRY}
+    path = _snapshot_path(os.getpid())
+    with open(path + '.tmp', 'w') as f:
+        json.dump(snapshot, f)
+    os.replace(path + '.tmp', path)
+
+
+def _flush_loop():
+    while True:
+        time.sleep(METRICS_FLUSH_SECONDS)
+        try:
+            write_snapshot()
+        except OSError as e:
+            logger.warning("Could not write metrics snapshot to %s: %s", METRICS_DIR, e)
+
+
+def _start_flusher():
+    """Start the snapshot thread of this process (again in a forked child) when METRICS_DIR is set"""
+    global _flusher_pid
+    with _flusher_lock:
+        if _flusher_pid == os.getpid():
+            return
+        _flusher_pid = os.getpid()
+        if METRICS_DIR:
+            threading.Thread(target=_flush_loop, name='metrics-flush', daemon=True).start()
+
+
+def _reset_after_fork():
+    """
+    Start a forked child (batch and job pool processes) from zero with fresh
+    locks: its snapshot is summed with the parent's, so inherited values
+    would be counted twice, and a lock another thread held at the fork
+    would never be released
+    """
+    global _flusher_lock
+    _flusher_lock = threading.Lock()
+    for metric in REGISTRY:
+        metric._lock = threading.Lock()
+        metric._values = {}
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _merged_snapshots() -> Dict[str, Dict[Tuple, object]]:
+    """Metric name -> label key -> value summed over every snapshot in METRICS_DIR"""
+    metrics = {metric.name: metric for metric in REGISTRY}
+    merged: Dict[str, Dict[Tuple, object]] = {name: {} for name in metrics}
+
+    for path in glob.glob(os.path.join(METRICS_DIR, 'metrics_*.json')):
+        try:
+            with open(path) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for name, samples in snapshot.items():
+            if name not in metrics:
+                continue
+            values = merged[name]
+            for key, value in samples:
+                key = tuple(key)
+                values[key] = metrics[name]._merge(values.get(key), value)
+
+    return merged
+
+
+def render_metrics() -> str:
+    """
+    Every registered metric in the Prometheus text exposition format
+
+    Summed over every process's snapshot with METRICS_DIR (this process's is
+    written first, so it is current), else this process's own with a pid label.
+    """
+    lines = []
+    if METRICS_DIR:
+        write_snapshot()
+        merged = _merged_snapshots()
+        for metric in REGISTRY:
+            lines.extend(metric.render(merged[metric.name]))
+    else:
+        pid = (f'pid="{os.getpid()}"',)
+        for metric in REGISTRY:
+            lines.extend(metric.render(extra=pid))
+    return '\n'.join(lines) + '\n'
+
+
+STAGE_SECONDS = Histogram(
+    'sa_decode_stage_seconds',
+    'Time per decode stage (base64_decode, image_open, grayscale, localization, cascade, rsa_decrypt, parse, ...)',
+    ('stage',))
+
+VARIANT_PREPROCESS_SECONDS = Histogram(
+    'sa_variant_preprocess_seconds', 'Time to compute one preprocessing variant', ('variant',))
+
+VARIANT_DECODE_SECONDS = Histogram(
+    'sa_pdf417_decode_seconds', 'Decoder backend chain time on one preprocessing variant', ('variant',))
+
+VARIANT_ATTEMPTS = Counter(
+    'sa_variant_attempts_total', 'Preprocessing variants tried, by outcome (success, rejected or failure)',
+    ('variant', 'outcome'))
+
+DOCUMENTS = Counter(
+    'sa_documents_total', 'Decoded images by document type and outcome (success, failure, timeout)',
+    ('document_type', 'outcome'))
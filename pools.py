@@ -0,0 +1,64 @@
+"""
+Lazily created executors shared by the requests of one process
+The race, batch, job and vote pools are all created on first use, so the
+gunicorn master (which imports the app before forking) starts none, and
+again in a forked child, which cannot use its parent's processes or threads.
+"""
+
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Executor, Future
+from typing import Callable, Optional, Type
+
+
+class LazyPool:
+    """
+    An executor made on first use in each process
+
+    start_method: multiprocessing start method for a ProcessPoolExecutor.
+        'forkserver' keeps a multi-threaded web worker from forking pool
+        processes that inherit locks other threads held at that moment; it
+        falls back to the platform default where it is not available.
+    Other keyword arguments (thread_name_prefix, ...) go to the executor.
+    """
+
+    def __init__(self, executor_class: Type[Executor], max_workers: int,
+                 start_method: Optional[str] = None, **kwargs):
+        self.executor_class = executor_class
+        self.max_workers = max(1, max_workers)
+        self.start_method = start_method
+        self.kwargs = kwargs
+        self._executor = None
+        self._slots = None
+        self._pid = None
+
+    def get(self) -> Executor:
+        """This process's executor"""
+        if self._executor is None or self._pid != os.getpid():
+            kwargs = dict(self.kwargs)
+            if self.start_method in multiprocessing.get_all_start_methods():
+                kwargs['mp_context'] = multiprocessing.get_context(self.start_method)
+            self._executor = self.executor_class(max_workers=self.max_workers, **kwargs)
+            self._slots = threading.BoundedSemaphore(self.max_workers)
+            self._pid = os.getpid()
+        return self._executor
+
+    def try_submit(self, fn: Callable, *args) -> Optional[Future]:
+        """
+        Submit `fn(*args)` if a worker is free, else return None
+
+        A slot stays taken until the task finishes, even when nobody waits
+        for its result any more, so tasks never queue behind busy workers.
+        """
+        executor = self.get()
+        slots = self._slots
+        if not slots.acquire(blocking=False):
+            return None
+        try:
+            future = executor.submit(fn, *args)
+        except BaseException:
+            slots.release()
+            raise
+        future.add_done_callback(lambda _: slots.release())
+        return future
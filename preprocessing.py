@@ -0,0 +1,107 @@
+"""
+Vectorized preprocessing engine for the decode cascade
+The upload is converted once to a grayscale NumPy array and every variant
+is computed from that shared buffer with lookup tables or OpenCV kernels
+"""
+
+from typing import Union
+
+import cv2
+import numpy as np
+from PIL import Image
+
+# PIL's ImageFilter.SMOOTH kernel, the degenerate image ImageEnhance.Sharpness blends against
+SMOOTH_KERNEL = np.array([[1, 1, 1], [1, 5, 1], [1, 1, 1]], dtype=np.float32) / 13
+
+CLAHE_CLIP_LIMIT = 2.0
+CLAHE_TILES = (8, 8)
+
+# Offset subtracted from the local mean by the adaptive threshold
+ADAPTIVE_OFFSET = 5
+
+
+def _gain_lut(factor: float) -> np.ndarray:
+    """256-entry table equal to ImageEnhance.Brightness(factor), which truncates rather than rounds"""
+    return np.clip(np.arange(256, dtype=np.float32) * factor, 0, 255).astype(np.uint8)
+
+
+BRIGHT_LUT = _gain_lut(1.5)
+VERY_BRIGHT_LUT = _gain_lut(2.0)
+
+
+def to_gray(image: Union[Image.Image, np.ndarray]) -> np.ndarray:
+    """
+    Convert an uploaded image to a 2-D uint8 array, once per request
+
+    JPEG uploads that have not been loaded yet are decoded straight to
+    luminance, which skips building the RGB image altogether.
+    """
+    if isinstance(image, np.ndarray):
+        return image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+
+    if image.format == 'JPEG' and image.mode != 'L':
+        image.draft('L', image.size)
+    if image.mode != 'L':
+        image = image.convert('L')
+
+    return np.asarray(image)
+
+
+def preprocess_original(gray: np.ndarray) -> np.ndarray:
+    return gray
+
+
+def preprocess_bright(gray: np.ndarray) -> np.ndarray:
+    return cv2.LUT(gray, BRIGHT_LUT)
+
+
+def preprocess_very_bright(gray: np.ndarray) -> np.ndarray:
+    return cv2.LUT(gray, VERY_BRIGHT_LUT)
+
+
+def preprocess_high_contrast(gray: np.ndarray) -> np.ndarray:
+    # Same as ImageEnhance.Contrast(2.0): stretch around the mean grey level
+    mean = cv2.mean(gray)[0]
+    lut = np.clip(mean + 2.0 * (np.arange(256, dtype=np.float32) - mean) + 0.5, 0, 255)
+    return cv2.LUT(gray, lut.astype(np.uint8))
+
+
+def preprocess_sharp(gray: np.ndarray) -> np.ndarray:
+    # Same as ImageEnhance.Sharpness(2.0): smooth + 2 * (gray - smooth)
+    smooth = cv2.filter2D(gray, -1, SMOOTH_KERNEL)
+    sharp = cv2.addWeighted(gray, 2.0, smooth, -1.0, 0)
+    # PIL's SMOOTH leaves the 1-pixel border as it was, so there the blend gives back the input
+    sharp[[0, -1], :] = gray[[0, -1], :]
+    sharp[:, [0, -1]] = gray[:, [0, -1]]
+    return sharp
+
+
+def preprocess_clahe(gray: np.ndarray) -> np.ndarray:
+    clahe = cv2.createCLAHE(clipLimit=CLAHE_CLIP_LIMIT, tileGridSize=CLAHE_TILES)
+    return clahe.apply(gray)
+
+
+def preprocess_otsu(gray: np.ndarray) -> np.ndarray:
+    # The decoder already applies Otsu to its input, so denoise first to make this variant differ
+    blurred = cv2.GaussianBlur(gray, (3, 3), 0)
+    return cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)[1]
+
+
+def preprocess_adaptive(gray: np.ndarray) -> np.ndarray:
+    # Local threshold copes with glare and uneven lighting across the barcode.
+    # The block must be wider than the 8-module start bar or its centre turns white.
+    block = max(31, min(gray.shape[:2]) // 2) | 1
+    return cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+                                 cv2.THRESH_BINARY, block, ADAPTIVE_OFFSET)
+
+
+PREPROCESSING_METHODS = [
+    ("original", preprocess_original),
+    ("bright", preprocess_bright),
+    ("high_contrast", preprocess_high_contrast),
+    ("sharp", preprocess_sharp),
+    ("very_bright", preprocess_very_bright),
+    ("clahe", preprocess_clahe),
+    ("otsu", preprocess_otsu),
+    ("adaptive", preprocess_adaptive),
+]
@@ -0,0 +1,262 @@
+"""
+Content-addressed caches for /decode
+The result cache is keyed by a hash of the uploaded image bytes and the
+decode options, so a client retrying the same capture gets the earlier
+result without another cascade or RSA decryption. The payload cache is
+keyed by the raw barcode, so different photos of the same document skip
+decryption and parsing. Both hold decrypted personal data, so every entry
+is dropped once its TTL has passed, whether or not it is read again.
+"""
+
+import hashlib
+import heapq
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Seconds a result may be kept (0 disables the cache)
+RESULT_CACHE_TTL = float(os.environ.get('RESULT_CACHE_TTL', '120'))
+
+# Most results kept per worker process
+RESULT_CACHE_SIZE = int(os.environ.get('RESULT_CACHE_SIZE', '256'))
+
+# Optional shared tier: a redis:// URL, or "local" for the in-process stand-in
+RESULT_CACHE_SHARED = os.environ.get('RESULT_CACHE_SHARED', '')
+
+# Parsed documents kept per worker process, and for how long (either 0 disables it)
+PAYLOAD_CACHE_SIZE = int(os.environ.get('PAYLOAD_CACHE_SIZE', '1024'))
+PAYLOAD_CACHE_TTL = float(os.environ.get('PAYLOAD_CACHE_TTL', '600'))
+
+# Options that change the response; anything else (race_workers, cache) does not
+KEY_OPTIONS = ('mode', 'document_type', 'localize', 'pyramid', 'accept')
+
+HASH_CHUNK = 1024 * 1024
+
+
+def image_key(image_file, options: Dict) -> str:
+    """
+    Hash an uploaded image and the options that affect its result
+
+    BytesIO uploads are hashed through their buffer without a copy; other
+    file objects are read in chunks and rewound for the decoder.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+
+    if hasattr(image_file, 'getbuffer'):
+        with image_file.getbuffer() as buffer:
+            digest.update(buffer)
+    else:
+        start = image_file.tell()
+        for chunk in iter(lambda: image_file.read(HASH_CHUNK), b''):
+            digest.update(chunk)
+        image_file.seek(start)
+
+    digest.update(json.dumps([options.get(name) for name in KEY_OPTIONS]).encode())
+    return digest.hexdigest()
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache whose entries expire a fixed time after insertion
+
+    Expired entries are removed by a sweeper thread at their expiry time,
+    not on the next lookup. get/set mirror the redis client (set takes
+    `ex` seconds), so an instance can also stand in for the shared tier.
+    """
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()   # key -> (expires, value), least recently used first
+        self._expiry = []               # heap of (expires, key)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._sweeper_pid = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: str, value, ex: Optional[float] = None):
+        ttl = self.ttl if ex is None else ex
+        expires = time.monotonic() + ttl
+
+        with self._lock:
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            heapq.heappush(self._expiry, (expires, key))
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+        self._ensure_sweeper()
+        self._wakeup.set()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._expiry.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _expire(self) -> Optional[float]:
+        """Drop everything past its expiry; returns the next expiry time"""
+        now = time.monotonic()
+        with self._lock:
+            while self._expiry and self._expiry[0][0] <= now:
+                expires, key = heapq.heappop(self._expiry)
+                entry = self._entries.get(key)
+                # Skip keys that were evicted or set again since
+                if entry is not None and entry[0] == expires:
+                    del self._entries[key]
+                    self.expirations += 1
+            return self._expiry[0][0] if self._expiry else None
+
+    def _ensure_sweeper(self):
+        """Start the sweeper thread, again after a fork (threads do not survive it)"""
+        if self._sweeper_pid == os.getpid():
+            return
+        self._sweeper_pid = os.getpid()
+        threading.Thread(target=self._sweep, name='result-cache-sweeper', daemon=True).start()
+
+    def _sweep(self):
+        while True:
+            next_expiry = self._expire()
+            timeout = None if next_expiry is None else max(0.0, next_expiry - time.monotonic())
+            self._wakeup.wait(timeout)
+            self._wakeup.clear()
+
+    def stats(self) -> Dict:
+        return {
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+            'ttl_seconds': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
+
+
+def _connect_shared(target: str):
+    """Build the shared tier client from RESULT_CACHE_SHARED, or None"""
+    if not target:
+        return None
+
+    if target == 'local':
+        return TTLCache(RESULT_CACHE_SIZE * 4, RESULT_CACHE_TTL)
+
+    try:
+        import redis
+    except ImportError:
+        logger.warning("RESULT_CACHE_SHARED=%s needs the redis package, shared tier disabled", target)
+        return None
+
+    return redis.Redis.from_url(target, socket_timeout=0.2)
+
+
+class ResultCache:
+    """In-process tier in front of an optional shared tier (redis or a stand-in)"""
+
+    def __init__(self, ttl: float = RESULT_CACHE_TTL, max_entries: int = RESULT_CACHE_SIZE,
+                 shared=None):
+        self.ttl = ttl
+        self.local = TTLCache(max_entries, ttl)
+        self.shared = shared
+        self.shared_hits = 0
+        self.shared_errors = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+
+    def get(self, key: str) -> Optional[Dict]:
+        result = self.local.get(key)
+        if result is not None or self.shared is None:
+            return result
+
+        try:
+            stored = self.shared.get(key)
+        except Exception:
+            self.shared_errors += 1
+            return None
+        if stored is None:
+            return None
+
+        # Not copied into the local tier: the shared copy's remaining TTL is unknown
+        self.shared_hits += 1
+        return json.loads(stored)
+
+    def set(self, key: str, result: Dict):
+        self.local.set(key, result)
+        if self.shared is None:
+            return
+
+        try:
+            self.shared.set(key, json.dumps(result), ex=max(1, int(self.ttl)))
+        except Exception:
+            self.shared_errors += 1
+
+    def stats(self) -> Dict:
+        stats = self.local.stats()
+        stats['shared'] = type(self.shared).__name__ if self.shared is not None else None
+        stats['shared_hits'] = self.shared_hits
+        stats['shared_errors'] = self.shared_errors
+        return stats
+
+
+class PayloadCache:
+    """Parsed document results keyed by a digest of the raw barcode payload"""
+
+    def __init__(self, ttl: float = PAYLOAD_CACHE_TTL, max_entries: int = PAYLOAD_CACHE_SIZE):
+        self.ttl = ttl
+        self.entries = TTLCache(max_entries, ttl)
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0 and self.entries.max_entries > 0
+
+    def decode(self, kind: str, payload: bytes, decoder: Callable[[], Any]) -> Any:
+        """
+        Return decoder() for this payload, computing it only on a miss
+
+        `kind` separates document types. Results are shared between callers,
+        so they should be immutable (sa_license_decoder records, or error
+        dicts the caller copies before adding response fields).
+        """
+        if not self.enabled:
+            return decoder()
+
+        key = kind.encode() + hashlib.blake2b(payload, digest_size=16).digest()
+        result = self.entries.get(key)
+        if result is None:
+            result = decoder()
+            self.entries.set(key, result)
+
+        return result
+
+    def stats(self) -> Dict:
+        return self.entries.stats()
+
+
+RESULT_CACHE = ResultCache(shared=_connect_shared(RESULT_CACHE_SHARED) if RESULT_CACHE_TTL > 0 else None)
+PAYLOAD_CACHE = PayloadCache()
@@ -5,8 +5,16 @@ Decodes, decrypts and parses SA driving license PDF417 barcodes
 Based on: https://www.dynamsoft.com/codepool/south-africa-driving-license-python.html
 """
 
+import json
+import os
+import re
 import rsa
-from typing import Dict, List, Optional
+from abc import ABC, abstractmethod
+from datetime import date
+from json.encoder import encode_basestring_ascii as _json_str
+from typing import Dict, Optional, Tuple, Union
+
+from decode_trace import Trace
 
 # RSA Public Keys for SA Driver's License Decryption
 # Version 1 keys
@@ -38,79 +46,134 @@ Kw==
 -----END RSA PUBLIC KEY-----'''
 
 
+# 4-byte barcode header -> license version
+VERSION_HEADERS: Dict[bytes, int] = {}
+
+# License version -> (key for the five 128-byte blocks, key for the final 74-byte block)
+KEY_REGISTRY: Dict[int, Tuple[rsa.PublicKey, rsa.PublicKey]] = {}
+
+
+def register_key_version(version: int, header: bytes, pem_128: str, pem_74: str):
+    """Parse a key pair once and make it available to decrypt_data"""
+    if len(header) != 4:
+        raise ValueError(f"Version header must be 4 bytes, got {len(header)}")
+
+    KEY_REGISTRY[version] = (
+        rsa.PublicKey.load_pkcs1(pem_128.encode()),
+        rsa.PublicKey.load_pkcs1(pem_74.encode())
+    )
+    VERSION_HEADERS[bytes(header)] = version
+
+
+def load_key_config(path: str):
+    """
+    Register extra key versions from a JSON file
+
+    Format:
+    {
+        "versions": [
+            {"version": 3, "header": "01XXXX45", "key_128": "-----BEGIN RSA PUBLIC KEY-----...",
+             "key_74": "-----BEGIN RSA PUBLIC KEY-----..."}
+        ]
+    }
+    """
+    with open(path) as f:
+        config = json.load(f)
+
+    for entry in config.get('versions', []):
+        register_key_version(int(entry['version']), bytes.fromhex(entry['header']),
+                             entry['key_128'], entry['key_74'])
+
+
+register_key_version(1, bytes([0x01, 0xe1, 0x02, 0x45]), pk_v1_128, pk_v1_74)
+register_key_version(2, bytes([0x01, 0x9b, 0x09, 0x45]), pk_v2_128, pk_v2_74)
+
+# New key generations can be rolled out with config instead of a redeploy
+if os.environ.get('SA_LICENSE_KEYS_FILE'):
+    load_key_config(os.environ['SA_LICENSE_KEYS_FILE'])
+
+
 def detect_version(data: bytes) -> int:
-    """Detect SA license version (1 or 2)"""
-    v1 = [0x01, 0xe1, 0x02, 0x45]
-    v2 = [0x01, 0x9b, 0x09, 0x45]
-
-    if data[:4] == bytes(v1):
-        return 1
-    elif data[:4] == bytes(v2):
-        return 2
-    else:
-        return 0
+    """Detect SA license version from the barcode header (0 if unknown)"""
+    return VERSION_HEADERS.get(bytes(data[:4]), 0)
 
 
-def decrypt_data(data: bytes) -> bytes:
-    """Decrypt SA license data using RSA public keys"""
-    if len(data) != 720:
+# Raw barcode record and decrypted payload sizes
+RECORD_SIZE = 720
+DECRYPTED_SIZE = 5 * 128 + 74
+
+
+def is_license_payload(barcode_bytes: Optional[bytes]) -> bool:
+    """A raw licence record: 720 bytes starting with a known version header"""
+    return bool(barcode_bytes) and len(barcode_bytes) == RECORD_SIZE and detect_version(barcode_bytes) != 0
+
+
+def is_disc_text(barcode_text: Optional[str]) -> bool:
+    """A vehicle disc that passes parse_disc_fields' validation"""
+    if not barcode_text or not barcode_text.startswith('%'):
+        return False
+    try:
+        parse_disc_fields(barcode_text)
+    except ValueError:
+        return False
+    return True
+
+
+def decrypt_into(data: bytes, out, offset: int = 0) -> int:
+    """
+    Decrypt one 720-byte record into `out[offset:offset + 714]`
+
+    `out` is any writable buffer (bytearray, memoryview, mmap), so bulk
+    callers can fill a preallocated buffer without intermediate copies.
+    Returns the license version.
+    """
+    if len(data) != RECORD_SIZE:
         raise ValueError(f"Invalid data length: {len(data)}, expected 720 bytes")
 
     version = detect_version(data)
     if version == 0:
         raise ValueError("Unknown license version")
 
-    # Select appropriate keys
-    if version == 1:
-        pk128 = pk_v1_128
-        pk74 = pk_v1_74
-    else:
-        pk128 = pk_v2_128
-        pk74 = pk_v2_74
+    # Keys were parsed once at import
+    key128, key74 = KEY_REGISTRY[version]
 
     # Decrypt the 5 blocks of 128 bytes
-    all_bytes = bytearray()
-    pubKey = rsa.PublicKey.load_pkcs1(pk128.encode())
-
     start = 6  # Skip first 6 bytes (version + zeros)
     for i in range(5):
-        block = data[start: start + 128]
-        input_val = int.from_bytes(block, byteorder='big', signed=False)
-        output_val = pow(input_val, pubKey.e, mod=pubKey.n)
+        input_val = int.from_bytes(data[start: start + 128], byteorder='big', signed=False)
+        output_val = pow(input_val, key128.e, key128.n)
+        out[offset: offset + 128] = output_val.to_bytes(128, byteorder='big', signed=False)
 
-        decrypted_bytes = output_val.to_bytes(128, byteorder='big', signed=False)
-        all_bytes += decrypted_bytes
-
-        start = start + 128
+        start += 128
+        offset += 128
 
     # Decrypt the last block of 74 bytes
-    pubKey = rsa.PublicKey.load_pkcs1(pk74.encode())
-    block = data[start: start + 74]
-    input_val = int.from_bytes(block, byteorder='big', signed=False)
-    output_val = pow(input_val, pubKey.e, mod=pubKey.n)
+    input_val = int.from_bytes(data[start: start + 74], byteorder='big', signed=False)
+    output_val = pow(input_val, key74.e, key74.n)
+    out[offset: offset + 74] = output_val.to_bytes(74, byteorder='big', signed=False)
 
-    decrypted_bytes = output_val.to_bytes(74, byteorder='big', signed=False)
-    all_bytes += decrypted_bytes
+    return version
 
-    return bytes(all_bytes)
 
+def decrypt_data(data: bytes) -> bytes:
+    """Decrypt SA license data using RSA public keys"""
+    out = bytearray(DECRYPTED_SIZE)
+    decrypt_into(data, out)
+    return bytes(out)
 
-def read_string(data: bytes, index: int) -> tuple:
-    """Read a single string from data"""
-    value = ''
-    delimiter = 0xe0
 
-    while True:
-        currentByte = data[index]
-        index += 1
+# String fields end at 0xe0 (next field follows) or 0xe1 (field group ends)
+STRING_DELIMITERS = re.compile(b'[\xe0\xe1]')
 
-        if currentByte == 0xe0 or currentByte == 0xe1:
-            delimiter = currentByte
-            break
 
-        value += chr(currentByte)
+def read_string(data: bytes, index: int) -> tuple:
+    """Read a single string from data"""
+    match = STRING_DELIMITERS.search(data, index)
+    if match is None:
+        raise ValueError(f"Unterminated string field at offset {index}")
 
-    return value, index, delimiter
+    end = match.start()
+    return data[index:end].decode('latin-1'), end + 1, data[end]
 
 
 def read_strings(data: bytes, index: int, length: int) -> tuple:
@@ -118,70 +181,72 @@ def read_strings(data: bytes, index: int, length: int) -> tuple:
     strings = []
 
     i = 0
-    while i < length:
-        value = ''
-        while True:
-            currentByte = data[index]
-            index += 1
-
-            if currentByte == 0xe0:
-                break
-            elif currentByte == 0xe1:
-                if value != '':
-                    i += 1
-                break
-
-            value += chr(currentByte)
-
+    for match in STRING_DELIMITERS.finditer(data, index):
+        end = match.start()
+        if end > index:
+            strings.append(data[index:end].decode('latin-1'))
+            # A non-empty field closed by 0xe1 also accounts for the slot after it
+            if data[end] == 0xe1:
+                i += 1
         i += 1
+        index = end + 1
 
-        if value != '':
-            strings.append(value)
+        if i >= length:
+            break
+    else:
+        raise ValueError(f"Unterminated string field at offset {index}")
 
     return strings, index
 
 
-def read_nibble_date_string(nibble_queue: list) -> str:
-    """Read date from nibble queue"""
-    m = nibble_queue.pop(0)
-    if m == 10:
-        return ''
+def read_nibble_date_string(nibbles: str, pos: int) -> tuple:
+    """Read a date from the nibble digits, returns (date, next position)"""
+    if nibbles[pos] == 'a':
+        return '', pos + 1
 
-    c = nibble_queue.pop(0)
-    d = nibble_queue.pop(0)
-    y = nibble_queue.pop(0)
+    return f'{nibbles[pos:pos + 4]}-{nibbles[pos + 4:pos + 6]}-{nibbles[pos + 6:pos + 8]}', pos + 8
 
-    m1 = nibble_queue.pop(0)
-    m2 = nibble_queue.pop(0)
 
-    d1 = nibble_queue.pop(0)
-    d2 = nibble_queue.pop(0)
-
-    return f'{m}{c}{d}{y}-{m1}{m2}-{d1}{d2}'
-
-
-def read_nibble_date_list(nibble_queue: list, length: int) -> list:
-    """Read multiple dates from nibble queue"""
+def read_nibble_date_list(nibbles: str, pos: int, length: int) -> tuple:
+    """Read multiple dates from the nibble digits"""
     date_list = []
 
     for i in range(length):
-        date_string = read_nibble_date_string(nibble_queue)
+        date_string, pos = read_nibble_date_string(nibbles, pos)
         if date_string != '':
             date_list.append(date_string)
 
-    return date_list
+    return date_list, pos
 
 
-def parse_data(data: bytes) -> Dict:
-    """Parse decrypted SA license data"""
-    # Find the start of strings section (0x82 marker)
-    index = 0
-    for i in range(len(data)):
-        if data[i] == 0x82:
-            index = i
-            break
+# Values returned by parse_fields, in order
+LICENSE_FIELDS = (
+    'version', 'surname', 'initials', 'id_number', 'id_number_type', 'id_country_of_issue',
+    'birth_date', 'gender', 'license_number', 'license_country_of_issue', 'license_issue_number',
+    'license_issue_date', 'license_expiry_date', 'vehicle_codes', 'vehicle_restrictions',
+    'license_code_issue_dates', 'driver_restriction_codes', 'prdp_code', 'prdp_expiry_date',
+)
+
+# LICENSE_FIELDS holding a list of strings
+LICENSE_LIST_FIELDS = ('vehicle_codes', 'vehicle_restrictions', 'license_code_issue_dates')
 
-    if index == 0:
+
+def parse_fields(data: bytes) -> tuple:
+    """
+    Parse decrypted SA license data into a flat tuple in LICENSE_FIELDS order
+
+    Single pass over the record by offset: delimiters are located with
+    bytes.find and a regex scan, each field is sliced and decoded whole and
+    the nibble section is unpacked in one go with bytes.hex(). `data` may be
+    bytes, a bytearray or an mmap; a memoryview is copied out once (714 bytes).
+    Bulk exports use this directly to skip building parse_data's nested dict.
+    """
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+
+    # Find the start of strings section (0x82 marker)
+    index = data.find(b'\x82')
+    if index <= 0:
         raise ValueError("Could not find string section marker (0x82)")
 
     # Skip marker and next byte
@@ -203,79 +268,188 @@ def parse_data(data: bytes) -> Dict:
     license_number, index, delimiter = read_string(data, index)
 
     # Read ID number (13 characters)
-    id_number = ''
-    for i in range(13):
-        id_number += chr(data[index])
-        index += 1
+    id_number = data[index: index + 13].decode('latin-1')
+    index += 13
 
     id_number_type = f'{data[index]:02d}'
     index += 1
 
-    # Read binary nibble data
-    nibble_queue = []
-    while True:
-        currentByte = data[index]
-        index += 1
-        if currentByte == 0x57:
-            break
-
-        nibbles = [currentByte >> 4, currentByte & 0x0f]
-        nibble_queue += nibbles
+    # Read binary nibble data: one hex digit per nibble, high nibble first.
+    # 'a' (10) marks an absent date.
+    end = data.find(b'\x57', index)
+    if end < 0:
+        raise ValueError("Could not find end of date section (0x57)")
+    nibbles = data[index:end].hex()
 
     # Parse nibble data
-    license_code_issue_dates = read_nibble_date_list(nibble_queue, 4)
-    driver_restriction_codes = f'{nibble_queue.pop(0)}{nibble_queue.pop(0)}'
-    prdp_permit_expiry_date = read_nibble_date_string(nibble_queue)
-    license_issue_number = f'{nibble_queue.pop(0)}{nibble_queue.pop(0)}'
-    birthdate = read_nibble_date_string(nibble_queue)
-    license_issue_date = read_nibble_date_string(nibble_queue)
-    license_expiry_date = read_nibble_date_string(nibble_queue)
-
-    gender_code = f'{nibble_queue.pop(0)}{nibble_queue.pop(0)}'
+    license_code_issue_dates, pos = read_nibble_date_list(nibbles, 0, 4)
+    driver_restriction_codes = nibbles[pos:pos + 2]
+    prdp_permit_expiry_date, pos = read_nibble_date_string(nibbles, pos + 2)
+    license_issue_number = nibbles[pos:pos + 2]
+    birthdate, pos = read_nibble_date_string(nibbles, pos + 2)
+    license_issue_date, pos = read_nibble_date_string(nibbles, pos)
+    license_expiry_date, pos = read_nibble_date_string(nibbles, pos)
+
+    gender_code = nibbles[pos:pos + 2]
+    if len(gender_code) < 2:
+        raise ValueError("Date section ends early")
     gender = 'Male' if gender_code == '01' else 'Female'
 
-    # Return structured data
-    return {
-        'success': True,
-        'license_type': 'SA_DRIVER_LICENSE',
-        'version': detect_version(data),
-        'personal_info': {
-            'surname': surname,
-            'initials': initials,
-            'id_number': id_number,
-            'id_number_type': id_number_type,
-            'id_country_of_issue': id_country_of_issue,
-            'birth_date': birthdate,
-            'gender': gender
-        },
-        'license_info': {
-            'license_number': license_number,
-            'license_country_of_issue': license_country_of_issue,
-            'license_issue_number': license_issue_number,
-            'license_issue_date': license_issue_date,
-            'license_expiry_date': license_expiry_date,
-            'vehicle_codes': vehicle_codes,
-            'vehicle_restrictions': vehicle_restrictions,
-            'license_code_issue_dates': license_code_issue_dates,
-            'driver_restriction_codes': driver_restriction_codes
-        },
-        'prdp_info': {
-            'code': prdp_code,
-            'expiry_date': prdp_permit_expiry_date
-        }
-    }
+    return (detect_version(data), surname, initials, id_number, id_number_type, id_country_of_issue,
+            birthdate, gender, license_number, license_country_of_issue, license_issue_number,
+            license_issue_date, license_expiry_date, vehicle_codes, vehicle_restrictions,
+            license_code_issue_dates, driver_restriction_codes, prdp_code, prdp_permit_expiry_date)
 
 
-def decode_sa_license(barcode_bytes: bytes) -> Dict:
+class Record(ABC):
     """
-    Main function to decode SA driver's license
+    Parsed document fields in __slots__, one attribute per field
 
-    Args:
-        barcode_bytes: Raw bytes from PDF417 barcode
-
-    Returns:
-        Dictionary with parsed license data
+    Records are what the payload cache and bulk paths keep: a slot per field
+    instead of the nested response dicts, and list fields held as tuples so
+    a cached record cannot be changed through a response. The response dict
+    or its JSON is only built at the API edge, by as_dict() / as_json().
     """
+
+    __slots__ = ()
+
+    FIELDS: Tuple[str, ...] = ()
+
+    def values(self) -> tuple:
+        return tuple(getattr(self, name) for name in self.FIELDS)
+
+    def __eq__(self, other):
+        return type(other) is type(self) and other.values() == self.values()
+
+    def __repr__(self):
+        return f"{type(self).__name__}({', '.join(f'{n}={getattr(self, n)!r}' for n in self.FIELDS)})"
+
+    @abstractmethod
+    def as_dict(self) -> Dict:
+        """The response dict"""
+
+    @abstractmethod
+    def as_json(self) -> str:
+        """Same text as json.dumps(self.as_dict()), without building the dict"""
+
+
+def _json_list(values) -> str:
+    return '[' + ', '.join(map(_json_str, values)) + ']'
+
+
+class DriverLicense(Record):
+    """A parsed SA driver's licence, fields in LICENSE_FIELDS order"""
+
+    __slots__ = LICENSE_FIELDS
+
+    FIELDS = LICENSE_FIELDS
+
+    def __init__(self, version, surname, initials, id_number, id_number_type, id_country_of_issue,
+                 birth_date, gender, license_number, license_country_of_issue, license_issue_number,
+                 license_issue_date, license_expiry_date, vehicle_codes, vehicle_restrictions,
+                 license_code_issue_dates, driver_restriction_codes, prdp_code, prdp_expiry_date):
+        self.version = version
+        self.surname = surname
+        self.initials = initials
+        self.id_number = id_number
+        self.id_number_type = id_number_type
+        self.id_country_of_issue = id_country_of_issue
+        self.birth_date = birth_date
+        self.gender = gender
+        self.license_number = license_number
+        self.license_country_of_issue = license_country_of_issue
+        self.license_issue_number = license_issue_number
+        self.license_issue_date = license_issue_date
+        self.license_expiry_date = license_expiry_date
+        self.vehicle_codes = tuple(vehicle_codes)
+        self.vehicle_restrictions = tuple(vehicle_restrictions)
+        self.license_code_issue_dates = tuple(license_code_issue_dates)
+        self.driver_restriction_codes = driver_restriction_codes
+        self.prdp_code = prdp_code
+        self.prdp_expiry_date = prdp_expiry_date
+
+    def as_dict(self) -> Dict:
+        """The nested /decode response"""
+        return {
+            'success': True,
+            'license_type': 'SA_DRIVER_LICENSE',
+            'version': self.version,
+            'personal_info': {
+                'surname': self.surname,
+                'initials': self.initials,
+                'id_number': self.id_number,
+                'id_number_type': self.id_number_type,
+                'id_country_of_issue': self.id_country_of_issue,
+                'birth_date': self.birth_date,
+                'gender': self.gender
+            },
+            'license_info': {
+                'license_number': self.license_number,
+                'license_country_of_issue': self.license_country_of_issue,
+                'license_issue_number': self.license_issue_number,
+                'license_issue_date': self.license_issue_date,
+                'license_expiry_date': self.license_expiry_date,
+                'vehicle_codes': list(self.vehicle_codes),
+                'vehicle_restrictions': list(self.vehicle_restrictions),
+                'license_code_issue_dates': list(self.license_code_issue_dates),
+                'driver_restriction_codes': self.driver_restriction_codes
+            },
+            'prdp_info': {
+                'code': self.prdp_code,
+                'expiry_date': self.prdp_expiry_date
+            }
+        }
+
+    def as_json(self) -> str:
+        return (
+            f'{{"success": true, "license_type": "SA_DRIVER_LICENSE", "version": {self.version:d}, '
+            f'"personal_info": {{"surname": {_json_str(self.surname)}, '
+            f'"initials": {_json_str(self.initials)}, '
+            f'"id_number": {_json_str(self.id_number)}, '
+            f'"id_number_type": {_json_str(self.id_number_type)}, '
+            f'"id_country_of_issue": {_json_str(self.id_country_of_issue)}, '
+            f'"birth_date": {_json_str(self.birth_date)}, '
+            f'"gender": {_json_str(self.gender)}}}, '
+            f'"license_info": {{"license_number": {_json_str(self.license_number)}, '
+            f'"license_country_of_issue": {_json_str(self.license_country_of_issue)}, '
+            f'"license_issue_number": {_json_str(self.license_issue_number)}, '
+            f'"license_issue_date": {_json_str(self.license_issue_date)}, '
+            f'"license_expiry_date": {_json_str(self.license_expiry_date)}, '
+            f'"vehicle_codes": {_json_list(self.vehicle_codes)}, '
+            f'"vehicle_restrictions": {_json_list(self.vehicle_restrictions)}, '
+            f'"license_code_issue_dates": {_json_list(self.license_code_issue_dates)}, '
+            f'"driver_restriction_codes": {_json_str(self.driver_restriction_codes)}}}, '
+            f'"prdp_info": {{"code": {_json_str(self.prdp_code)}, '
+            f'"expiry_date": {_json_str(self.prdp_expiry_date)}}}}}'
+        )
+
+
+def parse_license(data: bytes) -> DriverLicense:
+    """Parse decrypted SA license data into a DriverLicense"""
+    return DriverLicense(*parse_fields(data))
+
+
+def parse_data(data: bytes) -> Dict:
+    """Parse decrypted SA license data into the nested /decode response"""
+    return parse_license(data).as_dict()
+
+
+# A parsed record, or the {'success': False, 'error': ...} dict of a failed decode
+DecodeResult = Union[Record, Dict]
+
+
+def response_dict(result: DecodeResult) -> Dict:
+    """The response dict of a decode result; always a new top-level dict"""
+    return result.as_dict() if isinstance(result, Record) else dict(result)
+
+
+def response_json(result: DecodeResult) -> str:
+    """The JSON text of a decode result"""
+    return result.as_json() if isinstance(result, Record) else json.dumps(result)
+
+
+def decode_license_record(barcode_bytes: bytes, trace: Optional[Trace] = None) -> DecodeResult:
+    """decode_sa_license, returning the DriverLicense itself on success"""
     try:
         if len(barcode_bytes) != 720:
             return {
@@ -283,13 +457,17 @@ def decode_sa_license(barcode_bytes: bytes) -> Dict:
                 'error': f'Invalid barcode length: {len(barcode_bytes)}, expected 720 bytes'
             }
 
+        trace = trace or Trace(enabled=False)
+
         # Decrypt the data
-        decrypted_data = decrypt_data(barcode_bytes)
+        with trace.stage('rsa_decrypt', input_bytes=len(barcode_bytes)) as span:
+            decrypted_data = decrypt_data(barcode_bytes)
+            if span is not None:
+                span['output_bytes'] = len(decrypted_data)
 
         # Parse the decrypted data
-        result = parse_data(decrypted_data)
-
-        return result
+        with trace.stage('parse'):
+            return parse_license(decrypted_data)
 
     except Exception as e:
         return {
@@ -298,40 +476,224 @@ def decode_sa_license(barcode_bytes: bytes) -> Dict:
         }
 
 
-def decode_sa_vehicle_disc(barcode_text: str) -> Dict:
+def decode_sa_license(barcode_bytes: bytes, trace: Optional[Trace] = None) -> Dict:
     """
-    Decode SA vehicle license disc (not encrypted, just text parsing)
+    Main function to decode SA driver's license
 
-    Format: %MVL2DD93%0153%1099A6ML%1%10990565X1GW%CFM11111%DTR111K%...
+    Args:
+        barcode_bytes: Raw bytes from PDF417 barcode
+        trace: Stage trace of the request, metrics only when omitted
+
+    Returns:
+        Dictionary with parsed license data
     """
-    try:
-        parts = barcode_text.split('%')
+    return response_dict(decode_license_record(barcode_bytes, trace))
+
+
+# Vehicle disc layout: (field, pattern) for each %-separated field after the leading %.
+# The discs quoted in this repo (fixtures/vehicle_discs.txt) share one layout:
+#     %MVL1CC85%0159%4024O00G%1%40240486XLJ4%BG51NTGP%NJF536W%Sedan (closed top) / Sedan (toe-kap)%
+#         HYUNDAI%I30%Blue / Blou%KMHDC51DLBU297451%...
+#     %MVL2DD93%0153%1099A6ML%1%10990565X1GW%CFM11111%DTR111K%...
+# Only the first DISC_REQUIRED fields are checked against both samples. The later
+# ones may be empty or missing (a disc that ends early still parses, with '' for
+# the rest), and the engine number and expiry date formats have not been seen on
+# a real disc, so their patterns only keep out control characters and stray text.
+_DISC_TEXT = r'[^%\x00-\x1f\x7f-\x9f]*'
+DISC_SCHEMA = (
+    ('control_number', r'MVL\d[A-Z0-9]{4}'),
+    ('meta2', r'\d{4}'),
+    ('meta3', r'[A-Z0-9]{8}'),
+    ('meta4', r'\d'),
+    ('disk_number', r'[A-Z0-9]{12}'),
+    # Licence number on the number plate: BG51NTGP, CFM11111, ND 123-456
+    ('license_number', r'[A-Z0-9][A-Z0-9 -]{1,11}'),
+    # Vehicle register number: NJF536W, DTR111K
+    ('register_number', r'[A-Z0-9][A-Z0-9 -]{1,11}'),
+    ('description', _DISC_TEXT),
+    ('make', _DISC_TEXT),
+    ('model', _DISC_TEXT),
+    ('color', _DISC_TEXT),
+    # A 17-character VIN, or the shorter chassis number of an older vehicle
+    ('vin', r'[A-HJ-NPR-Z0-9]{17}|[A-Z0-9]{6,16}|'),
+    ('engine_number', r'[A-Z0-9 ./-]{0,24}'),
+    ('expiry_date', r'[0-9][0-9 ./-]{5,9}|'),
+)
+
+# Values returned by parse_disc_fields, in order
+DISC_FIELDS = tuple(name for name, _ in DISC_SCHEMA)
+DISC_VIN = DISC_FIELDS.index('vin')
+DISC_EXPIRY_DATE = DISC_FIELDS.index('expiry_date')
+
+# Fields every disc must have: up to the register number
+DISC_REQUIRED = DISC_FIELDS.index('register_number') + 1
+
+
+def _disc_pattern() -> re.Pattern:
+    """
+    The whole disc in one match, one group per field. The groups after
+    DISC_REQUIRED nest, so a disc may stop after any of them.
+    """
+    tail = ''
+    for _, pattern in reversed(DISC_SCHEMA[DISC_REQUIRED:]):
+        tail = f'(?:%({pattern}){tail})?'
+    head = '%'.join(f'({pattern})' for _, pattern in DISC_SCHEMA[:DISC_REQUIRED])
+    return re.compile('%' + head + tail + r'%?\s*')
 
-        if len(parts) < 10:
-            return {
-                'success': False,
-                'error': 'Invalid vehicle disc format'
-            }
 
+DISC_PATTERN = _disc_pattern()
+
+_DISC_FIELD_PATTERNS = [(name, re.compile(pattern)) for name, pattern in DISC_SCHEMA]
+
+# An expiry date checked as a calendar date (other formats pass as they are)
+_ISO_DATE = re.compile(r'\d{4}-\d{2}-\d{2}')
+
+# VIN transliteration and position weights for the check digit (ISO 3779 / 49 CFR 565)
+_VIN_VALUES = {
+    **{str(d): d for d in range(10)},
+    **dict(zip('ABCDEFGH', range(1, 9))), **dict(zip('JKLMN', range(1, 6))), 'P': 7, 'R': 9,
+    **dict(zip('STUVWXYZ', range(2, 10))),
+}
+_VIN_WEIGHTS = (8, 7, 6, 5, 4, 3, 2, 10, 0, 9, 8, 7, 6, 5, 4, 3, 2)
+
+
+def vin_check_digit(vin: str) -> str:
+    """The check digit (position 9) a 17-character VIN should carry"""
+    remainder = sum(_VIN_VALUES[c] * w for c, w in zip(vin, _VIN_WEIGHTS)) % 11
+    return 'X' if remainder == 10 else str(remainder)
+
+
+def _disc_error(barcode_text: str) -> str:
+    """Name the first field of a disc that DISC_PATTERN rejected"""
+    parts = barcode_text.rstrip().split('%')
+    if parts and parts[-1] == '':
+        parts.pop()
+    if not DISC_REQUIRED < len(parts) <= len(DISC_SCHEMA) + 1 or parts[0] != '':
+        return (f'Invalid vehicle disc format: {len(parts) - 1} fields, '
+                f'expected {DISC_REQUIRED} to {len(DISC_SCHEMA)}')
+
+    for value, (name, pattern) in zip(parts[1:], _DISC_FIELD_PATTERNS):
+        if not pattern.fullmatch(value):
+            return f'Invalid vehicle disc {name}'
+    return 'Invalid vehicle disc format'
+
+
+def parse_disc_fields(barcode_text: str) -> tuple:
+    """
+    Validate a vehicle disc and return its fields as a tuple in DISC_FIELDS order
+
+    The text is matched against DISC_SCHEMA in a single regex pass, then the
+    VIN check digit (North American VINs, where it is mandatory) and an ISO
+    expiry date are checked. Fields after DISC_REQUIRED that the disc does
+    not have are ''. Raises ValueError naming the first bad field, so a
+    misread is rejected instead of returned as a disc.
+    """
+    match = DISC_PATTERN.fullmatch(barcode_text)
+    if match is None:
+        raise ValueError(_disc_error(barcode_text))
+
+    fields = match.groups('')
+    vin = fields[DISC_VIN]
+    if len(vin) == 17 and vin[0] in '12345' and vin[8] != vin_check_digit(vin):
+        raise ValueError('Invalid vehicle disc vin: check digit does not match')
+
+    expiry_date = fields[DISC_EXPIRY_DATE]
+    if _ISO_DATE.fullmatch(expiry_date):
+        try:
+            date.fromisoformat(expiry_date)
+        except ValueError:
+            raise ValueError('Invalid vehicle disc expiry_date')
+
+    return fields
+
+
+class VehicleDisc(Record):
+    """A parsed SA vehicle licence disc, fields in DISC_FIELDS order"""
+
+    __slots__ = DISC_FIELDS
+
+    FIELDS = DISC_FIELDS
+
+    def __init__(self, control_number, meta2, meta3, meta4, disk_number, license_number, register_number,
+                 description, make, model, color, vin, engine_number, expiry_date):
+        self.control_number = control_number
+        self.meta2 = meta2
+        self.meta3 = meta3
+        self.meta4 = meta4
+        self.disk_number = disk_number
+        self.license_number = license_number
+        self.register_number = register_number
+        self.description = description
+        self.make = make
+        self.model = model
+        self.color = color
+        self.vin = vin
+        self.engine_number = engine_number
+        self.expiry_date = expiry_date
+
+    def as_dict(self) -> Dict:
         return {
             'success': True,
             'license_type': 'SA_VEHICLE_DISC',
-            'control_number': parts[1] if len(parts) > 1 else '',
-            'license_number': parts[2] if len(parts) > 2 else '',
-            'register_number': parts[3] if len(parts) > 3 else '',
-            'meta4': parts[4] if len(parts) > 4 else '',
-            'disk_number': parts[5] if len(parts) > 5 else '',
-            'vin': parts[6] if len(parts) > 6 else '',
-            'engine_number': parts[7] if len(parts) > 7 else '',
-            'description': parts[8] if len(parts) > 8 else '',
-            'make': parts[9] if len(parts) > 9 else '',
-            'model': parts[10] if len(parts) > 10 else '' if len(parts) > 10 else '',
-            'color': parts[11] if len(parts) > 11 else '',
-            'expiry_date': parts[12] if len(parts) > 12 else ''
+            'control_number': self.control_number,
+            'meta2': self.meta2,
+            'meta3': self.meta3,
+            'meta4': self.meta4,
+            'disk_number': self.disk_number,
+            'license_number': self.license_number,
+            'register_number': self.register_number,
+            'description': self.description,
+            'make': self.make,
+            'model': self.model,
+            'color': self.color,
+            'vin': self.vin,
+            'engine_number': self.engine_number,
+            'expiry_date': self.expiry_date
         }
 
+    def as_json(self) -> str:
+        return (
+            f'{{"success": true, "license_type": "SA_VEHICLE_DISC", '
+            f'"control_number": {_json_str(self.control_number)}, '
+            f'"meta2": {_json_str(self.meta2)}, '
+            f'"meta3": {_json_str(self.meta3)}, '
+            f'"meta4": {_json_str(self.meta4)}, '
+            f'"disk_number": {_json_str(self.disk_number)}, '
+            f'"license_number": {_json_str(self.license_number)}, '
+            f'"register_number": {_json_str(self.register_number)}, '
+            f'"description": {_json_str(self.description)}, '
+            f'"make": {_json_str(self.make)}, '
+            f'"model": {_json_str(self.model)}, '
+            f'"color": {_json_str(self.color)}, '
+            f'"vin": {_json_str(self.vin)}, '
+            f'"engine_number": {_json_str(self.engine_number)}, '
+            f'"expiry_date": {_json_str(self.expiry_date)}}}'
+        )
+
+
+def decode_disc_record(barcode_text: str) -> DecodeResult:
+    """decode_sa_vehicle_disc, returning the VehicleDisc itself on success"""
+    try:
+        try:
+            return VehicleDisc(*parse_disc_fields(barcode_text))
+        except ValueError as e:
+            return {
+                'success': False,
+                'error': str(e)
+            }
+
     except Exception as e:
         return {
             'success': False,
             'error': f'Failed to parse vehicle disc: {str(e)}'
         }
+
+
+def decode_sa_vehicle_disc(barcode_text: str) -> Dict:
+    """
+    Decode SA vehicle license disc (not encrypted, just text parsing)
+
+    Format: %MVL2DD93%0153%1099A6ML%1%10990565X1GW%CFM11111%DTR111K%... (see DISC_SCHEMA);
+    text that does not validate is returned as a failure.
+    """
+    return response_dict(decode_disc_record(barcode_text))
@@ -1,3 +1,3 @@
 #!/bin/bash
-# Start gunicorn with dynamic PORT from Railway
-exec gunicorn --bind 0.0.0.0:${PORT:-5000} --workers 2 --timeout 120 app_sa:app
+# Start gunicorn with dynamic PORT from Railway; workers, threads and timeouts come from gunicorn.conf.py
+exec gunicorn -c gunicorn.conf.py app_sa:app
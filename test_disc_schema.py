@@ -0,0 +1,63 @@
+"""
+Check the vehicle disc schema against every known disc layout
+Run with pytest, or directly: python test_disc_schema.py
+"""
+import os
+
+import pytest
+
+from sa_license_decoder import DISC_FIELDS, DISC_REQUIRED, decode_disc_record, parse_disc_fields, vin_check_digit
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'vehicle_discs.txt')
+
+# The MVL2 fixture with the rest of the fields filled in around a test VIN
+DISC_WITH_VIN = '%MVL2DD93%0153%1099A6ML%1%10990565X1GW%CFM11111%DTR111K%Truck%MACK%CH613%White%{vin}%'
+
+# North American VIN with a valid check digit (X) at position 9
+VALID_VIN = '1M8GDM9AXKP042788'
+
+
+def fixture_discs():
+    with open(FIXTURES, encoding='utf-8') as f:
+        return [line.rstrip('\n') for line in f if line.strip() and not line.startswith('#')]
+
+
+@pytest.mark.parametrize('disc', fixture_discs())
+def test_fixture_disc_parses(disc):
+    fields = parse_disc_fields(disc)
+    values = disc.rstrip('%').split('%')[1:]
+
+    assert len(fields) == len(DISC_FIELDS)
+    assert fields[:len(values)] == tuple(values)
+    assert all(value == '' for value in fields[len(values):])
+    assert decode_disc_record(disc).as_dict()['success']
+
+
+def test_fixtures_cover_every_layout():
+    controls = {disc.split('%')[1][:4] for disc in fixture_discs()}
+    assert controls == {'MVL1', 'MVL2'}
+
+
+def test_valid_vin_check_digit():
+    assert vin_check_digit(VALID_VIN) == 'X'
+    fields = parse_disc_fields(DISC_WITH_VIN.format(vin=VALID_VIN))
+    assert fields[DISC_FIELDS.index('vin')] == VALID_VIN
+
+
+def test_corrupted_vin_check_digit():
+    corrupted = VALID_VIN[:8] + '1' + VALID_VIN[9:]
+    with pytest.raises(ValueError, match='check digit'):
+        parse_disc_fields(DISC_WITH_VIN.format(vin=corrupted))
+
+
+def test_short_or_garbled_disc_rejected():
+    mvl2 = fixture_discs()[-1]
+    too_short = '%'.join(mvl2.split('%')[:DISC_REQUIRED])
+    with pytest.raises(ValueError, match='fields'):
+        parse_disc_fields(too_short)
+    with pytest.raises(ValueError, match='control_number'):
+        parse_disc_fields(mvl2.replace('MVL2', 'MV12'))
+
+
+if __name__ == '__main__':
+    raise SystemExit(pytest.main([__file__, '-q']))
@@ -0,0 +1,129 @@
+"""
+Online success statistics for the preprocessing cascade
+Learns which variant tends to win per document type and image size and
+reorders the cascade so the likely winner runs first
+"""
+
+import os
+import random
+import threading
+from typing import Dict, List, Optional, Tuple
+
+# 'adaptive' reorders the cascade from live statistics, 'fixed' keeps the default order
+CASCADE_ORDERING = os.environ.get('CASCADE_ORDERING', 'adaptive')
+
+# Observations a context needs before its statistics are trusted for ordering
+ADAPTIVE_MIN_SAMPLES = int(os.environ.get('CASCADE_ADAPTIVE_MIN_SAMPLES', '20'))
+
+DOCUMENT_TYPES = ('license', 'disc')
+
+# (upper bound in megapixels, bucket name)
+SIZE_BUCKETS = [
+    (1.0, 'small'),
+    (4.0, 'medium'),
+    (8.0, 'large'),
+    (float('inf'), 'xlarge'),
+]
+
+
+def size_bucket(width: int, height: int) -> str:
+    """Map image dimensions to a coarse size bucket"""
+    megapixels = width * height / 1_000_000
+    for limit, name in SIZE_BUCKETS:
+        if megapixels < limit:
+            return name
+    return SIZE_BUCKETS[-1][1]
+
+
+class VariantStats:
+    """
+    Per-context success counters for the preprocessing variants
+
+    A context is (document_type, size_bucket). Requests without a document
+    type hint are ordered from the 'any' context, which every request feeds.
+    Ordering uses Thompson sampling over Beta(successes + 1, failures + 1).
+    """
+
+    def __init__(self, variants: List[str], ordering: str = CASCADE_ORDERING,
+                 min_samples: int = ADAPTIVE_MIN_SAMPLES):
+        self.variants = list(variants)
+        self.ordering = ordering
+        self.min_samples = min_samples
+        self._lock = threading.Lock()
+        # context -> variant -> [attempts, successes]
+        self._counts: Dict[Tuple[str, str], Dict[str, List[int]]] = {}
+        self._totals = {'requests': 0, 'decoded': 0, 'attempts': 0, 'baseline_attempts': 0}
+
+    def _context(self, context: Tuple[str, str]) -> Dict[str, List[int]]:
+        counts = self._counts.get(context)
+        if counts is None:
+            counts = {variant: [0, 0] for variant in self.variants}
+            self._counts[context] = counts
+        return counts
+
+    def order(self, document_type: Optional[str], bucket: str) -> List[str]:
+        """Return the variant order to try for this context"""
+        if self.ordering != 'adaptive':
+            return list(self.variants)
+
+        with self._lock:
+            counts = self._counts.get((document_type or 'any', bucket))
+            if counts is None or sum(a for a, _ in counts.values()) < self.min_samples:
+                counts = self._counts.get(('any', bucket))
+            if counts is None or sum(a for a, _ in counts.values()) < self.min_samples:
+                return list(self.variants)
+
+            scores = {
+                variant: random.betavariate(successes + 1, attempts - successes + 1)
+                for variant, (attempts, successes) in counts.items()
+            }
+
+        return sorted(self.variants, key=lambda variant: -scores[variant])
+
+    def record(self, document_type: Optional[str], bucket: str,
+               failed: List[str], winner: Optional[str]):
+        """Record the outcome of one cascade run"""
+        contexts = [('any', bucket)]
+        if document_type:
+            contexts.append((document_type, bucket))
+
+        with self._lock:
+            for context in contexts:
+                counts = self._context(context)
+                for variant in failed:
+                    counts[variant][0] += 1
+                if winner:
+                    counts[winner][0] += 1
+                    counts[winner][1] += 1
+
+            self._totals['requests'] += 1
+            self._totals['attempts'] += len(failed) + (1 if winner else 0)
+            if winner:
+                self._totals['decoded'] += 1
+                # What the fixed order would have spent to reach the same winner
+                self._totals['baseline_attempts'] += self.variants.index(winner) + 1
+            else:
+                self._totals['baseline_attempts'] += len(self.variants)
+
+    def snapshot(self) -> Dict:
+        """Return a JSON-serializable view of the counters"""
+        with self._lock:
+            contexts = {}
+            for (document_type, bucket), counts in sorted(self._counts.items()):
+                contexts.setdefault(document_type, {})[bucket] = {
+                    variant: {
+                        'attempts': attempts,
+                        'successes': successes,
+                        'success_rate': round(successes / attempts, 4) if attempts else None
+                    }
+                    for variant, (attempts, successes) in counts.items()
+                }
+            totals = dict(self._totals)
+
+        totals['attempts_saved'] = totals['baseline_attempts'] - totals['attempts']
+        return {
+            'ordering': self.ordering,
+            'pid': os.getpid(),
+            'totals': totals,
+            'contexts': contexts
+        }